@@ -103,6 +103,9 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         self.properties.setProperty("slavename", name, "BuildSlave")
 
         self.lastMessageReceived = 0
+        # the latest resource report from the slave, if any; see
+        # perspective_reportResources
+        self.resources = None
         if isinstance(notify_on_missing, str):
             notify_on_missing = [notify_on_missing]
         self.notify_on_missing = notify_on_missing
@@ -515,6 +518,7 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         self.slave_status.removeGracefulWatcher(self._gracefulChanged)
         self.slave_status.removePauseWatcher(self._pauseChanged)
         self.slave_status.setConnected(False)
+        self.resources = None
         log.msg("BuildSlave.detached(%s)" % self.slavename)
         self.master.status.slaveDisconnected(self.slavename)
         self.stopKeepaliveTimer()
@@ -612,6 +616,16 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
     def perspective_keepalive(self):
         self.messageReceivedFromSlave()
 
+    def perspective_reportResources(self, resources):
+        """Called by the slave with its keepalives, to say how busy the
+        machine is.  C{resources} is a dictionary with keys C{load},
+        C{cpus}, C{free_memory} and C{free_disk}, any of which may be None.
+        """
+        self.messageReceivedFromSlave()
+        self.resources = dict((k, resources.get(k))
+                              for k in ('load', 'cpus', 'free_memory',
+                                        'free_disk'))
+
     def perspective_shutdown(self):
         log.msg("slave %s wants to shut down" % self.slavename)
         self.slave_status.setGraceful(True)
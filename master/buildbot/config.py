@@ -73,10 +73,12 @@ class MasterConfig(object):
         self.logCompressionMethod = 'bz2'
         self.logMaxTailSize = None
         self.logMaxSize = None
+        self.buildHistoryStore = 'pickle'
         self.properties = properties.Properties()
         self.mergeRequests = None
         self.codebaseGenerator = None
         self.prioritizeBuilders = None
+        self.distributorConcurrency = 1
         self.slavePortnum = None
         self.multiMaster = False
         self.debugPassword = None
@@ -107,9 +109,11 @@ class MasterConfig(object):
         self.revlink = default_revlink_matcher
 
     _known_config_keys = set([
-        "buildbotURL", "buildCacheSize", "builders", "buildHorizon", "caches",
+        "buildbotURL", "buildCacheSize", "builders", "buildHistoryStore",
+        "buildHorizon", "caches",
         "change_source", "codebaseGenerator", "changeCacheSize", "changeHorizon",
-        'db', "db_poll_interval", "db_url", "debugPassword", "eventHorizon",
+        'db', "db_poll_interval", "db_url", "debugPassword",
+        "distributorConcurrency", "eventHorizon",
         "logCompressionLimit", "logCompressionMethod", "logHorizon",
         "logMaxSize", "logMaxTailSize", "manhole", "mergeRequests", "metrics",
         "multiMaster", "prioritizeBuilders", "projectName", "projectURL",
@@ -264,6 +268,12 @@ class MasterConfig(object):
         copy_int_param('logMaxSize')
         copy_int_param('logMaxTailSize')
 
+        if 'buildHistoryStore' in config_dict:
+            buildHistoryStore = config_dict.get('buildHistoryStore')
+            if buildHistoryStore not in ('pickle', 'indexed'):
+                error("c['buildHistoryStore'] must be 'pickle' or 'indexed'")
+            self.buildHistoryStore = buildHistoryStore
+
         properties = config_dict.get('properties', {})
         if not isinstance(properties, dict):
             error("c['properties'] must be a dictionary")
@@ -290,6 +300,14 @@ class MasterConfig(object):
         else:
             self.prioritizeBuilders = prioritizeBuilders
 
+        if 'distributorConcurrency' in config_dict:
+            distributorConcurrency = config_dict['distributorConcurrency']
+            if (not isinstance(distributorConcurrency, int)
+                    or distributorConcurrency < 1):
+                error("c['distributorConcurrency'] must be a positive int")
+            else:
+                self.distributorConcurrency = distributorConcurrency
+
         protocols = config_dict.get('protocols', {})
         if isinstance(protocols, dict):
             for proto, options in protocols.iteritems():
@@ -351,7 +369,13 @@ class MasterConfig(object):
     def load_db(self, filename, config_dict):
         if 'db' in config_dict:
             db = config_dict['db']
-            if set(db.keys()) > set(['db_url', 'db_poll_interval']):
+            if set(db.keys()) - set(['db_url', 'db_poll_interval',
+                                     'db_read_url', 'db_read_pool_size',
+                                     'db_write_pool_size', 'janitor_horizon',
+                                     'janitor_batch_size',
+                                     'janitor_time_budget',
+                                     'slow_query_threshold',
+                                     'state_flush_interval']):
                 error("unrecognized keys in c['db']")
             self.db.update(db)
         if 'db_url' in config_dict:
@@ -369,6 +393,28 @@ class MasterConfig(object):
         else:
             self.db['db_poll_interval'] = db_poll_interval
 
+        # check the pool sizes
+        for key in 'db_read_pool_size', 'db_write_pool_size':
+            pool_size = self.db.get(key)
+            if pool_size is not None and \
+                    (not isinstance(pool_size, int) or pool_size < 1):
+                error("c['db']['%s'] must be a positive int" % (key,))
+
+        # check the janitor parameters
+        for key in 'janitor_horizon', 'janitor_batch_size', \
+                'janitor_time_budget':
+            value = self.db.get(key)
+            if value is not None and \
+                    (not isinstance(value, (int, long)) or value < 1):
+                error("c['db']['%s'] must be a positive int" % (key,))
+
+        # check the slow query threshold and state flush interval, in seconds
+        for key in 'slow_query_threshold', 'state_flush_interval':
+            value = self.db.get(key)
+            if value is not None and \
+                    (not isinstance(value, (int, long, float)) or value < 0):
+                error("c['db']['%s'] must be a non-negative number" % (key,))
+
     def load_metrics(self, filename, config_dict):
         # we don't try to validate metrics keys
         if 'metrics' in config_dict:
@@ -640,7 +686,8 @@ class BuilderConfig:
                  category=None, tags=None,
                  nextSlave=None, nextBuild=None, locks=None, env=None,
                  properties=None, mergeRequests=None, description=None,
-                 canStartBuild=None):
+                 canStartBuild=None, buildAvoidanceHorizon=None,
+                 buildAvoidanceIgnoreProperties=None):
 
         # name is required, and can't start with '_'
         if not name or type(name) not in (str, unicode):
@@ -725,6 +772,17 @@ class BuilderConfig:
         self.properties = properties or {}
         self.mergeRequests = mergeRequests
 
+        self.buildAvoidanceHorizon = buildAvoidanceHorizon
+        if buildAvoidanceHorizon is not None and \
+                not isinstance(buildAvoidanceHorizon, (int, long, float)):
+            error("builder '%s': buildAvoidanceHorizon must be a number"
+                  % (name,))
+        self.buildAvoidanceIgnoreProperties = \
+            buildAvoidanceIgnoreProperties or []
+        if not isinstance(self.buildAvoidanceIgnoreProperties, list):
+            error("builder '%s': buildAvoidanceIgnoreProperties must be a "
+                  "list" % (name,))
+
         self.description = description
 
     def getConfigDict(self):
@@ -753,6 +811,11 @@ class BuilderConfig:
             rv['mergeRequests'] = self.mergeRequests
         if self.description:
             rv['description'] = self.description
+        if self.buildAvoidanceHorizon is not None:
+            rv['buildAvoidanceHorizon'] = self.buildAvoidanceHorizon
+        if self.buildAvoidanceIgnoreProperties:
+            rv['buildAvoidanceIgnoreProperties'] = \
+                self.buildAvoidanceIgnoreProperties
         return rv
 
 
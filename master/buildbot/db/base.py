@@ -20,6 +20,13 @@ class DBConnectorComponent(object):
     # DBConnector object, so that they are available at e.g.,
     # C{master.db.model} or C{master.db.changes}.  This parent class takes care
     # of the necessary backlinks and other housekeeping.
+    #
+    # Queries run with C{self.db.pool.do}.  The read pool may be connected to
+    # a replica that lags behind, so C{self.db.read_pool.do} is only for reads
+    # that can tolerate stale data: the listings made for the web status and
+    # other status displays (getRecentChanges, getBuildsets,
+    # getRecentBuildsets, getUsers, getBuildslaves).  Anything that may
+    # follow a write, or that feeds scheduling, must use C{self.db.pool.do}.
 
     connector = None
 
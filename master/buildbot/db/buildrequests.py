@@ -34,6 +34,20 @@ class NotClaimedError(Exception):
 class BrDict(dict):
     pass
 
+
+# the sum of the squared ids is taken modulo this prime, so that it cannot
+# overflow
+CHECKSUM_MODULUS = 1000003
+
+
+def checksumBuildRequestIds(brids):
+    """Return the checksum of a set of buildrequest ids that
+    L{BuildRequestsConnectorComponent.getUnclaimedBuildRequestsChecksum}
+    returns for the same set of unclaimed requests."""
+    brids = list(brids)
+    return (len(brids), max(brids or [0]), sum(brids),
+            sum((brid * brid) % CHECKSUM_MODULUS for brid in brids))
+
 # private decorator to add a _master_objectid keyword argument, querying from
 # the master
 
@@ -72,7 +86,8 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
     @with_master_objectid
     def getBuildRequests(self, buildername=None, complete=None, claimed=None,
-                         bsid=None, _master_objectid=None, branch=None, repository=None):
+                         bsid=None, _master_objectid=None, branch=None, repository=None,
+                         min_brid=None, max_brid=None):
         def thd(conn):
             reqs_tbl = self.db.model.buildrequests
             claims_tbl = self.db.model.buildrequest_claims
@@ -111,6 +126,10 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                     q = q.where(reqs_tbl.c.complete == 0)
             if bsid is not None:
                 q = q.where(reqs_tbl.c.buildsetid == bsid)
+            if min_brid is not None:
+                q = q.where(reqs_tbl.c.id >= min_brid)
+            if max_brid is not None:
+                q = q.where(reqs_tbl.c.id <= max_brid)
 
             if branch is not None:
                 q = q.where(sstamps_tbls.c.branch == branch)
@@ -123,6 +142,53 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                     for row in res.fetchall()]
         return self.db.pool.do(thd)
 
+    def getUnclaimedBuildRequestsChecksum(self, max_brid=None):
+        def thd(conn):
+            reqs_tbl = self.db.model.buildrequests
+            claims_tbl = self.db.model.buildrequest_claims
+
+            from_clause = reqs_tbl.outerjoin(claims_tbl,
+                                             reqs_tbl.c.id == claims_tbl.c.brid)
+            # the count and sum alone would not notice, say, {1, 4} becoming
+            # {2, 3}; the squares make such a collision very unlikely
+            squared = (reqs_tbl.c.id * reqs_tbl.c.id) % CHECKSUM_MODULUS
+            q = sa.select([sa.func.count(reqs_tbl.c.id),
+                           sa.func.max(reqs_tbl.c.id),
+                           sa.func.sum(reqs_tbl.c.id),
+                           sa.func.sum(squared)]).select_from(from_clause)
+            q = q.where((claims_tbl.c.claimed_at == None) &
+                        (reqs_tbl.c.complete == 0))
+            if max_brid is not None:
+                q = q.where(reqs_tbl.c.id <= max_brid)
+
+            row = conn.execute(q).fetchone()
+            # MAX and SUM of no rows are NULL
+            return (row[0],) + tuple(int(v or 0) for v in row[1:])
+        return self.db.pool.do(thd)
+
+    def getUnclaimedBuildRequestSummaries(self):
+        def thd(conn):
+            reqs_tbl = self.db.model.buildrequests
+            claims_tbl = self.db.model.buildrequest_claims
+
+            from_clause = reqs_tbl.outerjoin(claims_tbl,
+                                             reqs_tbl.c.id == claims_tbl.c.brid)
+            q = sa.select([reqs_tbl.c.buildername,
+                           sa.func.min(reqs_tbl.c.submitted_at),
+                           sa.func.count(reqs_tbl.c.id)]
+                          ).select_from(from_clause)
+            q = q.where((claims_tbl.c.claimed_at == None) &
+                        (reqs_tbl.c.complete == 0))
+            q = q.group_by(reqs_tbl.c.buildername)
+
+            rv = {}
+            for buildername, oldest, count in conn.execute(q):
+                rv[buildername] = dict(
+                    oldest_submitted_at=epoch2datetime(oldest),
+                    count=count)
+            return rv
+        return self.db.pool.do(thd)
+
     @with_master_objectid
     def claimBuildRequests(self, brids, claimed_at=None, _reactor=reactor,
                            _master_objectid=None):
@@ -148,6 +214,57 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
         return self.db.pool.do(thd)
 
+    @with_master_objectid
+    def claimBuildRequestsBatch(self, brids, claimed_at=None,
+                                _reactor=reactor, _master_objectid=None):
+        if claimed_at is not None:
+            claimed_at = datetime2epoch(claimed_at)
+        else:
+            claimed_at = _reactor.seconds()
+
+        def thd(conn):
+            tbl = self.db.model.buildrequest_claims
+
+            while True:
+                transaction = conn.begin()
+
+                # find the requests that are already claimed, 100 at a time
+                # so that the parameter lists supported by the DBAPI aren't
+                # exhausted
+                already_claimed = set()
+                iterator = iter(brids)
+                while True:
+                    batch = list(itertools.islice(iterator, 100))
+                    if not batch:
+                        break
+                    q = sa.select([tbl.c.brid],
+                                  whereclause=tbl.c.brid.in_(batch))
+                    already_claimed.update(row.brid for row in conn.execute(q))
+
+                to_claim = []
+                for brid in brids:
+                    if brid not in already_claimed:
+                        to_claim.append(brid)
+                        already_claimed.add(brid)
+
+                try:
+                    if to_claim:
+                        conn.execute(tbl.insert(),
+                                     [dict(brid=id, objectid=_master_objectid,
+                                           claimed_at=claimed_at)
+                                      for id in to_claim])
+                except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
+                    # another master claimed some of these requests since we
+                    # looked; try again
+                    transaction.rollback()
+                    continue
+
+                transaction.commit()
+                to_claim = set(to_claim)
+                return dict((brid, brid in to_claim) for brid in brids)
+
+        return self.db.pool.do(thd)
+
     @with_master_objectid
     def reclaimBuildRequests(self, brids, _reactor=reactor,
                              _master_objectid=None):
@@ -249,6 +366,48 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
             transaction.commit()
         return self.db.pool.do(thd)
 
+    def completeBuildRequestsBatch(self, brid_results, complete_at=None,
+                                   _reactor=reactor):
+        if complete_at is not None:
+            complete_at = datetime2epoch(complete_at)
+        else:
+            complete_at = _reactor.seconds()
+
+        def thd(conn):
+            transaction = conn.begin()
+            reqs_tbl = self.db.model.buildrequests
+            completed = set()
+
+            # batch the brids into groups of 100, as for completeBuildRequests
+            iterator = iter(sorted(brid_results))
+            while True:
+                batch = list(itertools.islice(iterator, 100))
+                if not batch:
+                    break
+
+                q = sa.select([reqs_tbl.c.id],
+                              whereclause=(reqs_tbl.c.id.in_(batch) &
+                                           (reqs_tbl.c.complete != 1)))
+                incomplete = [row.id for row in conn.execute(q)]
+
+                # one update for each distinct result in this batch
+                by_results = {}
+                for brid in incomplete:
+                    by_results.setdefault(brid_results[brid], []).append(brid)
+                for results, ids in by_results.iteritems():
+                    q = reqs_tbl.update()
+                    q = q.where(reqs_tbl.c.id.in_(ids))
+                    q = q.where(reqs_tbl.c.complete != 1)
+                    conn.execute(q,
+                                 complete=1,
+                                 results=results,
+                                 complete_at=complete_at)
+                completed.update(incomplete)
+
+            transaction.commit()
+            return dict((brid, brid in completed) for brid in brid_results)
+        return self.db.pool.do(thd)
+
     def unclaimExpiredRequests(self, old, _reactor=reactor):
         def thd(conn):
             reqs_tbl = self.db.model.buildrequests
@@ -13,6 +13,8 @@
 #
 # Copyright Buildbot Team Members
 
+import sqlalchemy as sa
+
 from buildbot.db import base
 from buildbot.util import epoch2datetime
 from twisted.internet import reactor
@@ -68,6 +70,29 @@ class BuildsConnectorComponent(base.DBConnectorComponent):
             transaction.commit()
         return self.db.pool.do(thd)
 
+    def finishBuildsBatch(self, bids, _reactor=reactor):
+        def thd(conn):
+            transaction = conn.begin()
+            tbl = self.db.model.builds
+            now = _reactor.seconds()
+            finished = set()
+
+            remaining = sorted(set(bids))
+            while remaining:
+                batch, remaining = remaining[:100], remaining[100:]
+                q = sa.select([tbl.c.id],
+                              whereclause=(tbl.c.id.in_(batch) &
+                                           (tbl.c.finish_time == None)))
+                unfinished = [row.id for row in conn.execute(q)]
+                if unfinished:
+                    q = tbl.update(whereclause=(tbl.c.id.in_(unfinished)))
+                    conn.execute(q, finish_time=now)
+                finished.update(unfinished)
+
+            transaction.commit()
+            return dict((bid, bid in finished) for bid in bids)
+        return self.db.pool.do(thd)
+
     def _bdictFromRow(self, row):
         def mkdt(epoch):
             if epoch:
@@ -43,53 +43,12 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
                     external_idstring=None, _reactor=reactor):
 
         def thd(conn):
-            buildsets_tbl = self.db.model.buildsets
             submitted_at = _reactor.seconds()
 
-            self.check_length(buildsets_tbl.c.reason, reason)
-            self.check_length(buildsets_tbl.c.external_idstring,
-                              external_idstring)
-
             transaction = conn.begin()
-
-            # insert the buildset itself
-            r = conn.execute(buildsets_tbl.insert(), dict(
-                sourcestampsetid=sourcestampsetid, submitted_at=submitted_at,
-                reason=reason, complete=0, complete_at=None, results=-1,
-                external_idstring=external_idstring))
-            bsid = r.inserted_primary_key[0]
-
-            # add any properties
-            if properties:
-                bs_props_tbl = self.db.model.buildset_properties
-
-                inserts = [
-                    dict(buildsetid=bsid, property_name=k,
-                         property_value=json.dumps([v, s]))
-                    for k, (v, s) in properties.iteritems()]
-                for i in inserts:
-                    self.check_length(bs_props_tbl.c.property_name,
-                                      i['property_name'])
-
-                conn.execute(bs_props_tbl.insert(), inserts)
-
-            # and finish with a build request for each builder.  Note that
-            # sqlalchemy and the Python DBAPI do not provide a way to recover
-            # inserted IDs from a multi-row insert, so this is done one row at
-            # a time.
-            brids = {}
-            br_tbl = self.db.model.buildrequests
-            ins = br_tbl.insert()
-            for buildername in builderNames:
-                self.check_length(br_tbl.c.buildername, buildername)
-                r = conn.execute(ins,
-                                 dict(buildsetid=bsid, buildername=buildername, priority=0,
-                                      claimed_at=0, claimed_by_name=None,
-                                      claimed_by_incarnation=None, complete=0, results=-1,
-                                      submitted_at=submitted_at, complete_at=None))
-
-                brids[buildername] = r.inserted_primary_key[0]
-
+            bsid, brids = self._addBuildset_thd(
+                conn, sourcestampsetid, reason, properties, builderNames,
+                external_idstring, submitted_at)
             transaction.commit()
 
             return (bsid, brids)
@@ -101,6 +60,89 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
 
         defer.returnValue((bsid, brids))
 
+    @defer.inlineCallbacks
+    def addBuildsets(self, buildsets, _reactor=reactor):
+
+        def thd(conn):
+            submitted_at = _reactor.seconds()
+            ss_tbl = self.db.model.sourcestampsets
+
+            transaction = conn.begin()
+            rv = []
+            for bs in buildsets:
+                sourcestampsetid = bs.get('sourcestampsetid')
+                if sourcestampsetid is None:
+                    r = conn.execute(ss_tbl.insert(), dict())
+                    sourcestampsetid = r.inserted_primary_key[0]
+                    for ss in bs['sourcestamps']:
+                        self.db.sourcestamps._addSourceStamp_thd(
+                            conn, sourcestampsetid=sourcestampsetid, **ss)
+
+                rv.append(self._addBuildset_thd(
+                    conn, sourcestampsetid, bs['reason'], bs['properties'],
+                    bs['builderNames'], bs.get('external_idstring'),
+                    submitted_at))
+            transaction.commit()
+
+            return rv
+
+        rv = yield self.db.pool.do(thd)
+
+        # Seed the buildset property cache.
+        for (bsid, _), bs in zip(rv, buildsets):
+            self.getBuildsetProperties.cache.put(bsid,
+                                                 BsProps(bs['properties']))
+
+        defer.returnValue(rv)
+
+    def _addBuildset_thd(self, conn, sourcestampsetid, reason, properties,
+                         builderNames, external_idstring, submitted_at):
+        buildsets_tbl = self.db.model.buildsets
+
+        self.check_length(buildsets_tbl.c.reason, reason)
+        self.check_length(buildsets_tbl.c.external_idstring,
+                          external_idstring)
+
+        # insert the buildset itself
+        r = conn.execute(buildsets_tbl.insert(), dict(
+            sourcestampsetid=sourcestampsetid, submitted_at=submitted_at,
+            reason=reason, complete=0, complete_at=None, results=-1,
+            external_idstring=external_idstring))
+        bsid = r.inserted_primary_key[0]
+
+        # add any properties
+        if properties:
+            bs_props_tbl = self.db.model.buildset_properties
+
+            inserts = [
+                dict(buildsetid=bsid, property_name=k,
+                     property_value=json.dumps([v, s]))
+                for k, (v, s) in properties.iteritems()]
+            for i in inserts:
+                self.check_length(bs_props_tbl.c.property_name,
+                                  i['property_name'])
+
+            conn.execute(bs_props_tbl.insert(), inserts)
+
+        # and finish with a build request for each builder.  Note that
+        # sqlalchemy and the Python DBAPI do not provide a way to recover
+        # inserted IDs from a multi-row insert, so this is done one row at
+        # a time.
+        brids = {}
+        br_tbl = self.db.model.buildrequests
+        ins = br_tbl.insert()
+        for buildername in builderNames:
+            self.check_length(br_tbl.c.buildername, buildername)
+            r = conn.execute(ins,
+                             dict(buildsetid=bsid, buildername=buildername, priority=0,
+                                  claimed_at=0, claimed_by_name=None,
+                                  claimed_by_incarnation=None, complete=0, results=-1,
+                                  submitted_at=submitted_at, complete_at=None))
+
+            brids[buildername] = r.inserted_primary_key[0]
+
+        return (bsid, brids)
+
     def completeBuildset(self, bsid, results, complete_at=None,
                          _reactor=reactor):
         if complete_at is not None:
@@ -146,7 +188,7 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
                                 (bs_tbl.c.complete == None))
             res = conn.execute(q)
             return [self._row2dict(row) for row in res.fetchall()]
-        return self.db.pool.do(thd)
+        return self.db.read_pool.do(thd)
 
     def getRecentBuildsets(self, count, branch=None, repository=None,
                            complete=None):
@@ -174,7 +216,7 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
             res = conn.execute(q)
             return list(reversed([self._row2dict(row)
                                   for row in res.fetchall()]))
-        return self.db.pool.do(thd)
+        return self.db.read_pool.do(thd)
 
     @base.cached("BuildsetProperties")
     def getBuildsetProperties(self, buildsetid):
@@ -206,6 +248,114 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
             return BsProps(l)
         return self.db.pool.do(thd)
 
+    # tables from which pruneBuildsets removes rows, in deletion order
+    PRUNED_TABLES = ('builds', 'buildrequest_claims', 'buildrequests',
+                     'buildset_properties', 'buildsets', 'sourcestamp_changes',
+                     'sourcestamps', 'patches', 'sourcestampsets')
+
+    @defer.inlineCallbacks
+    def pruneBuildsets(self, horizon, batch_size=100, time_budget=10,
+                       _reactor=reactor):
+        """
+        Called periodically by DBConnector, this method deletes buildsets
+        that completed more than C{horizon} seconds ago, along with their
+        build requests, builds and any sourcestamps no other buildset uses.
+        """
+        removed = dict((table_name, 0) for table_name in self.PRUNED_TABLES)
+        if not horizon:
+            defer.returnValue(removed)
+
+        now = _reactor.seconds()
+        older_than = now - horizon
+        deadline = now + time_budget
+
+        # each batch is deleted in its own short transaction, so that other
+        # queries can run in between
+        while True:
+            batch_removed = yield self.db.pool.do(
+                self._pruneBuildsetsBatch_thd, older_than, batch_size)
+            for table_name, count in batch_removed.iteritems():
+                removed[table_name] += count
+            if batch_removed['buildsets'] < batch_size:
+                break
+            if _reactor.seconds() >= deadline:
+                break
+
+        defer.returnValue(removed)
+
+    def _pruneBuildsetsBatch_thd(self, conn, older_than, batch_size):
+        # This method must be run in a db.pool thread, and deletes up to
+        # batch_size buildsets, returning the number of rows deleted from
+        # each table
+        bs_tbl = self.db.model.buildsets
+        br_tbl = self.db.model.buildrequests
+        ss_tbl = self.db.model.sourcestamps
+        removed = dict((table_name, 0) for table_name in self.PRUNED_TABLES)
+
+        def delete(table_name, column_name, ids):
+            if not ids:
+                return
+            table = self.db.model.metadata.tables[table_name]
+            res = conn.execute(
+                table.delete(table.c[column_name].in_(ids)))
+            removed[table_name] += res.rowcount
+
+        transaction = conn.begin()
+
+        q = sa.select([bs_tbl.c.id, bs_tbl.c.sourcestampsetid],
+                      whereclause=((bs_tbl.c.complete == 1) &
+                                   (bs_tbl.c.complete_at < older_than)),
+                      order_by=[bs_tbl.c.id],
+                      limit=batch_size)
+        rows = conn.execute(q).fetchall()
+        bsids = [row.id for row in rows]
+        sssetids = set([row.sourcestampsetid for row in rows
+                        if row.sourcestampsetid is not None])
+        if not bsids:
+            transaction.commit()
+            return removed
+
+        q = sa.select([br_tbl.c.id],
+                      whereclause=br_tbl.c.buildsetid.in_(bsids))
+        brids = [row.id for row in conn.execute(q)]
+
+        delete('builds', 'brid', brids)
+        delete('buildrequest_claims', 'brid', brids)
+        delete('buildrequests', 'id', brids)
+        delete('buildset_properties', 'buildsetid', bsids)
+        delete('buildsets', 'id', bsids)
+
+        # sourcestamp sets can be shared, e.g., by rebuilds, so only remove
+        # those that no remaining buildset refers to
+        if sssetids:
+            q = sa.select([bs_tbl.c.sourcestampsetid],
+                          whereclause=bs_tbl.c.sourcestampsetid.in_(sssetids))
+            sssetids -= set([row.sourcestampsetid for row in conn.execute(q)])
+        sssetids = sorted(sssetids)
+
+        ssids, patchids = [], set()
+        if sssetids:
+            q = sa.select([ss_tbl.c.id, ss_tbl.c.patchid],
+                          whereclause=ss_tbl.c.sourcestampsetid.in_(sssetids))
+            for row in conn.execute(q):
+                ssids.append(row.id)
+                if row.patchid is not None:
+                    patchids.add(row.patchid)
+
+        delete('sourcestamp_changes', 'sourcestampid', ssids)
+        delete('sourcestamps', 'id', ssids)
+
+        # likewise, keep any patches still used by other sourcestamps
+        if patchids:
+            q = sa.select([ss_tbl.c.patchid],
+                          whereclause=ss_tbl.c.patchid.in_(patchids))
+            patchids -= set([row.patchid for row in conn.execute(q)])
+        delete('patches', 'id', sorted(patchids))
+        delete('sourcestampsets', 'id', sssetids)
+
+        transaction.commit()
+        return removed
+
     def _row2dict(self, row):
         def mkdt(epoch):
             if epoch:
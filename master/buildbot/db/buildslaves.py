@@ -34,7 +34,7 @@ class BuildslavesConnectorComponent(base.DBConnectorComponent):
                         'name': row.name
                     })
             return dicts
-        d = self.db.pool.do(thd)
+        d = self.db.read_pool.do(thd)
         return d
 
     def getBuildslaveByName(self, name):
@@ -34,6 +34,9 @@ class ChDict(dict):
 class ChangesConnectorComponent(base.DBConnectorComponent):
     # Documentation is in developer/database.rst
 
+    # number of changeids to include in a single IN clause
+    BULK_BATCH_SIZE = 100
+
     def addChange(self, author=None, files=None, comments=None, is_dir=0,
                   revision=None, when_timestamp=None, branch=None,
                   category=None, revlink='', properties={}, repository='', codebase='',
@@ -131,6 +134,38 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
         d = self.db.pool.do(thd)
         return d
 
+    def getChanges(self, changeids):
+        changeids = sorted(set(changeids))
+
+        def thd(conn):
+            changes_tbl = self.db.model.changes
+            rows = []
+            remaining = changeids
+            while remaining:
+                batch, remaining = (remaining[:self.BULK_BATCH_SIZE],
+                                    remaining[self.BULK_BATCH_SIZE:])
+                q = changes_tbl.select(
+                    whereclause=changes_tbl.c.changeid.in_(batch))
+                rows.extend(conn.execute(q).fetchall())
+            return self._chdicts_from_change_rows_thd(conn, rows)
+        d = self.db.pool.do(thd)
+        d.addCallback(self._cacheChdicts)
+        return d
+
+    def getChangesInRange(self, lo, hi):
+        assert lo <= hi
+
+        def thd(conn):
+            changes_tbl = self.db.model.changes
+            q = changes_tbl.select(
+                whereclause=((changes_tbl.c.changeid >= lo) &
+                             (changes_tbl.c.changeid <= hi)))
+            rows = conn.execute(q).fetchall()
+            return self._chdicts_from_change_rows_thd(conn, rows)
+        d = self.db.pool.do(thd)
+        d.addCallback(self._cacheChdicts)
+        return d
+
     def getChangeUids(self, changeid):
         assert changeid >= 0
 
@@ -154,22 +189,23 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             rp = conn.execute(q)
             changeids = [row.changeid for row in rp]
             rp.close()
-            return list(reversed(changeids))
-        d = self.db.pool.do(thd)
-
-        # then turn those into changes, using the cache
-        def get_changes(changeids):
-            return defer.gatherResults([self.getChange(changeid)
-                                        for changeid in changeids])
-        d.addCallback(get_changes)
+            if not changeids:
+                return []
+
+            # every change above the oldest of those is one of the most
+            # recent, so fetch them all (and their ancillary data) at once
+            q = changes_tbl.select(
+                whereclause=(changes_tbl.c.changeid >= min(changeids)))
+            rows = conn.execute(q).fetchall()
+            return self._chdicts_from_change_rows_thd(conn, rows)
+        d = self.db.read_pool.do(thd)
+        d.addCallback(self._cacheChdicts)
         return d
 
     def getLatestChangeid(self):
         def thd(conn):
             changes_tbl = self.db.model.changes
-            q = sa.select([changes_tbl.c.changeid],
-                          order_by=sa.desc(changes_tbl.c.changeid),
-                          limit=1)
+            q = sa.select([sa.func.max(changes_tbl.c.changeid)])
             return conn.scalar(q)
         d = self.db.pool.do(thd)
         return d
@@ -211,33 +247,44 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                         table.delete(table.c.changeid.in_(batch)))
         return self.db.pool.do(thd)
 
+    def _cacheChdicts(self, chdicts):
+        # prime the chdicts cache with the results of a bulk fetch, so that
+        # subsequent calls to getChange are served from memory
+        cache = self.getChange.cache
+        for chdict in chdicts:
+            cache.put(chdict['changeid'], chdict)
+        return chdicts
+
     def _chdict_from_change_row_thd(self, conn, ch_row):
         # This method must be run in a db.pool thread, and returns a chdict
         # given a row from the 'changes' table
+        return self._chdicts_from_change_rows_thd(conn, [ch_row])[0]
+
+    def _chdicts_from_change_rows_thd(self, conn, ch_rows):
+        # This method must be run in a db.pool thread, and returns a list of
+        # chdicts, ordered by changeid, given rows from the 'changes' table.
+        # The ancillary data for all of the changes is fetched with a fixed
+        # number of queries per batch of changeids, rather than per change.
         change_files_tbl = self.db.model.change_files
         change_properties_tbl = self.db.model.change_properties
 
-        chdict = ChDict(
-            changeid=ch_row.changeid,
-            author=ch_row.author,
-            files=[],  # see below
-            comments=ch_row.comments,
-            is_dir=ch_row.is_dir,
-            revision=ch_row.revision,
-            when_timestamp=epoch2datetime(ch_row.when_timestamp),
-            branch=ch_row.branch,
-            category=ch_row.category,
-            revlink=ch_row.revlink,
-            properties={},  # see below
-            repository=ch_row.repository,
-            codebase=ch_row.codebase,
-            project=ch_row.project)
-
-        query = change_files_tbl.select(
-            whereclause=(change_files_tbl.c.changeid == ch_row.changeid))
-        rows = conn.execute(query)
-        for r in rows:
-            chdict['files'].append(r.filename)
+        chdicts = {}
+        for ch_row in ch_rows:
+            chdicts[ch_row.changeid] = ChDict(
+                changeid=ch_row.changeid,
+                author=ch_row.author,
+                files=[],  # see below
+                comments=ch_row.comments,
+                is_dir=ch_row.is_dir,
+                revision=ch_row.revision,
+                when_timestamp=epoch2datetime(ch_row.when_timestamp),
+                branch=ch_row.branch,
+                category=ch_row.category,
+                revlink=ch_row.revlink,
+                properties={},  # see below
+                repository=ch_row.repository,
+                codebase=ch_row.codebase,
+                project=ch_row.project)
 
         # and properties must be given without a source, so strip that, but
         # be flexible in case users have used a development version where the
@@ -251,14 +298,25 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                 v, s = vs, "Change"
             return v, s
 
-        query = change_properties_tbl.select(
-            whereclause=(change_properties_tbl.c.changeid == ch_row.changeid))
-        rows = conn.execute(query)
-        for r in rows:
-            try:
-                v, s = split_vs(json.loads(r.property_value))
-                chdict['properties'][r.property_name] = (v, s)
-            except ValueError:
-                pass
-
-        return chdict
+        remaining = sorted(chdicts)
+        while remaining:
+            batch, remaining = (remaining[:self.BULK_BATCH_SIZE],
+                                remaining[self.BULK_BATCH_SIZE:])
+
+            query = change_files_tbl.select(
+                whereclause=change_files_tbl.c.changeid.in_(batch))
+            rows = conn.execute(query)
+            for r in rows:
+                chdicts[r.changeid]['files'].append(r.filename)
+
+            query = change_properties_tbl.select(
+                whereclause=change_properties_tbl.c.changeid.in_(batch))
+            rows = conn.execute(query)
+            for r in rows:
+                try:
+                    v, s = split_vs(json.loads(r.property_value))
+                    chdicts[r.changeid]['properties'][r.property_name] = (v, s)
+                except ValueError:
+                    pass
+
+        return [chdicts[changeid] for changeid in sorted(chdicts)]
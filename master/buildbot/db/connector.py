@@ -29,6 +29,7 @@ from buildbot.db import sourcestamps
 from buildbot.db import sourcestampsets
 from buildbot.db import state
 from buildbot.db import users
+from buildbot.process import metrics
 from twisted.application import internet
 from twisted.application import service
 from twisted.internet import defer
@@ -62,6 +63,12 @@ class DBConnector(config.ReconfigurableServiceMixin, service.MultiService):
     # periodic cleanup actions on this schedule.
     CLEANUP_PERIOD = 3600
 
+    # Defaults for the janitor, which prunes old buildsets during cleanup:
+    # the number of buildsets deleted per transaction, and the number of
+    # seconds after which a cleanup stops starting new batches.
+    JANITOR_BATCH_SIZE = 100
+    JANITOR_TIME_BUDGET = 10
+
     def __init__(self, master, basedir):
         service.MultiService.__init__(self)
         self.setName('db')
@@ -74,7 +81,9 @@ class DBConnector(config.ReconfigurableServiceMixin, service.MultiService):
 
         # set up components
         self._engine = None  # set up in reconfigService
+        self._read_engine = None  # set up in reconfigService
         self.pool = None  # set up in reconfigService
+        self.read_pool = None  # set up in reconfigService
         self.model = model.Model(self)
         self.changes = changes.ChangesConnectorComponent(self)
         self.schedulers = schedulers.SchedulersConnectorComponent(self)
@@ -91,15 +100,49 @@ class DBConnector(config.ReconfigurableServiceMixin, service.MultiService):
                                                    self._doCleanup)
         self.cleanup_timer.setServiceParent(self)
 
+        self.checkpoint_timer = None  # set up in setup, if necessary
+
     def setup(self, check_version=True, verbose=True):
-        db_url = self.configured_url = self.master.config.db['db_url']
+        db_config = self.master.config.db
+        db_url = self.configured_url = db_config['db_url']
 
         log.msg("Setting up database with URL %r" % (db_url,))
 
-        # set up the engine and pool
+        # set up the engine and pool; this pool handles all writes, and any
+        # reads that must see them immediately
         self._engine = enginestrategy.create_engine(db_url,
                                                     basedir=self.basedir)
-        self.pool = pool.DBThreadPool(self._engine, verbose=verbose)
+        self.pool = pool.DBThreadPool(
+            self._engine, verbose=verbose,
+            pool_size=db_config.get('db_write_pool_size'))
+
+        # the SQLite performance profile asks for WAL checkpoints to be
+        # scheduled, rather than run during a commit
+        checkpoint_interval = getattr(self._engine,
+                                      'wal_checkpoint_interval', None)
+        if checkpoint_interval and not self.checkpoint_timer:
+            self.checkpoint_timer = internet.TimerService(
+                checkpoint_interval, self._doCheckpoint)
+            self.checkpoint_timer.setServiceParent(self)
+
+        # set up a separate pool for read-only queries, so that long reads
+        # (e.g., from the web status) do not delay claims and inserts.  The
+        # reads may go to a replica.  An engine that can only support one
+        # connection (e.g., in-memory SQLite) must use a single pool.
+        read_url = db_config.get('db_read_url')
+        if read_url:
+            log.msg("Setting up read-only database with URL %r" % (read_url,))
+            self._read_engine = enginestrategy.create_engine(
+                read_url, basedir=self.basedir)
+        else:
+            self._read_engine = self._engine
+        if (self._read_engine is self._engine
+                and self._engine.optimal_thread_pool_size == 1):
+            self.read_pool = self.pool
+        else:
+            self.read_pool = pool.DBThreadPool(
+                self._read_engine, verbose=verbose, name='DBThreadPool-read',
+                pool_size=db_config.get('db_read_pool_size'))
 
         # make sure the db is up to date, unless specifically asked not to
         if check_version:
@@ -120,8 +163,25 @@ class DBConnector(config.ReconfigurableServiceMixin, service.MultiService):
         # double-check -- the master ensures this in config checks
         assert self.configured_url == new_config.db['db_url']
 
-        return config.ReconfigurableServiceMixin.reconfigService(self,
-                                                                 new_config)
+        # the slow query threshold can change without restarting the pools
+        threshold = new_config.db.get('slow_query_threshold')
+        for p in self.pool, self.read_pool:
+            if p:
+                p.slow_query_threshold = threshold
+
+        d = self.state.setFlushInterval(
+            new_config.db.get('state_flush_interval'))
+        d.addCallback(lambda _:
+                      config.ReconfigurableServiceMixin.reconfigService(
+                          self, new_config))
+        return d
+
+    def stopService(self):
+        # write out any state held by the write-behind cache
+        d = self.state.flushState()
+        d.addErrback(log.err, 'while flushing state')
+        d.addCallback(lambda _: service.MultiService.stopService(self))
+        return d
 
     def _doCleanup(self):
         """
@@ -135,4 +195,50 @@ class DBConnector(config.ReconfigurableServiceMixin, service.MultiService):
 
         d = self.changes.pruneChanges(self.master.config.changeHorizon)
         d.addErrback(log.err, 'while pruning changes')
+        d.addCallback(lambda _: self._doJanitor())
+        return d
+
+    def _doJanitor(self):
+        """
+        Remove buildsets, and the rows that depend on them, that completed
+        longer ago than the configured horizon.
+
+        @returns: Deferred
+        """
+        db_config = self.master.config.db
+        horizon = db_config.get('janitor_horizon')
+        if not horizon:
+            return defer.succeed(None)
+
+        d = self.buildsets.pruneBuildsets(
+            horizon,
+            batch_size=db_config.get('janitor_batch_size') or
+            self.JANITOR_BATCH_SIZE,
+            time_budget=db_config.get('janitor_time_budget') or
+            self.JANITOR_TIME_BUDGET)
+
+        @d.addCallback
+        def report(removed):
+            total = sum(removed.values())
+            metrics.MetricCountEvent.log('DBConnector.janitor.rows_removed',
+                                         total, absolute=True)
+            if total:
+                log.msg("database janitor removed %d rows (%s)" % (
+                    total, ', '.join('%s: %d' % (table_name, removed[table_name])
+                                     for table_name in sorted(removed)
+                                     if removed[table_name])))
+        d.addErrback(log.err, 'while pruning buildsets')
+        return d
+
+    def _doCheckpoint(self):
+        """
+        Checkpoint the SQLite write-ahead log, without waiting for readers or
+        writers.
+
+        @returns: Deferred
+        """
+        def thd(conn):
+            conn.execute("pragma wal_checkpoint(PASSIVE)")
+        d = self.pool.do(thd)
+        d.addErrback(log.err, 'while checkpointing the database')
         return d
@@ -20,6 +20,7 @@ special cases that Buildbot needs.  Those include:
  - pool_recycle for MySQL
  - %(basedir) substitution
  - optimal thread pool size calculation
+ - the optional SQLite performance profile
 
 """
 
@@ -32,6 +33,7 @@ from buildbot.util import sautils
 from sqlalchemy.engine import strategies
 from sqlalchemy.engine import url
 from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import SingletonThreadPool
 from twisted.python import log
 
 # from http://www.mail-archive.com/sqlalchemy@googlegroups.com/msg15079.html
@@ -69,12 +71,49 @@ class BuildbotEngineStrategy(strategies.ThreadLocalEngineStrategy):
 
     name = 'buildbot'
 
+    # settings for the SQLite performance profile, enabled by adding
+    # performance=1 to the database URL.  The pragmas are run on every new
+    # connection; since they only pay off for long-lived connections, each
+    # thread keeps its own connection open.
+    SQLITE_PERFORMANCE_PRAGMAS = [
+        # safe with WAL: a power loss may lose the last few transactions, but
+        # cannot corrupt the database
+        "pragma synchronous = NORMAL",
+        "pragma cache_size = 16384",  # pages
+        "pragma mmap_size = 268435456",  # bytes; ignored before SQLite 3.7.17
+        "pragma temp_store = MEMORY",
+        # the checkpoint scheduler does most checkpoints; this is a backstop
+        "pragma wal_autocheckpoint = 10000",
+    ]
+    # threads per DBThreadPool, and connections kept open by the engine
+    SQLITE_PERFORMANCE_THREADS = 5
+    SQLITE_PERFORMANCE_CONNECTIONS = 20
+    # seconds SQLite's busy handler will keep retrying a locked database,
+    # with increasing sleeps, before giving up; override with busy_timeout=N
+    SQLITE_PERFORMANCE_BUSY_TIMEOUT = 30
+    # seconds between scheduled WAL checkpoints
+    SQLITE_CHECKPOINT_INTERVAL = 60
+
     def special_case_sqlite(self, u, kwargs):
         """For sqlite, percent-substitute %(basedir)s and use a full
         path to the basedir.  If using a memory database, force the
-        pool size to be 1."""
+        pool size to be 1.  If the performance profile is requested, keep
+        a connection open per thread and set a busy timeout."""
         max_conns = None
 
+        performance = u.query.pop('performance', '0')
+        performance = performance.lower() in ('1', 'true', 'yes')
+        # busy_timeout only applies to the performance profile, but it must
+        # not be passed on to sqlite3.connect either way
+        busy_timeout = u.query.pop('busy_timeout',
+                                   self.SQLITE_PERFORMANCE_BUSY_TIMEOUT)
+        if performance and u.database:
+            kwargs['poolclass'] = SingletonThreadPool
+            kwargs['pool_size'] = self.SQLITE_PERFORMANCE_CONNECTIONS
+            kwargs['connect_args'] = dict(timeout=float(busy_timeout))
+            kwargs['sqlite_performance'] = True
+            max_conns = self.SQLITE_PERFORMANCE_THREADS
+
         # when given a database path, stick the basedir in there
         if u.database:
 
@@ -105,8 +144,14 @@ class BuildbotEngineStrategy(strategies.ThreadLocalEngineStrategy):
         """Special setup for sqlite engines"""
         # try to enable WAL logging
         if u.database:
+            pragmas = ["pragma checkpoint_fullfsync = off"]
+            if getattr(engine, 'sqlite_performance', False):
+                log.msg("using the SQLite performance profile")
+                pragmas.extend(self.SQLITE_PERFORMANCE_PRAGMAS)
+
             def connect_listener(connection, record):
-                connection.execute("pragma checkpoint_fullfsync = off")
+                for pragma in pragmas:
+                    connection.execute(pragma)
 
             if sautils.sa_version() < (0, 7, 0):
                 class CheckpointFullfsyncDisabler(object):
@@ -213,6 +258,7 @@ class BuildbotEngineStrategy(strategies.ThreadLocalEngineStrategy):
 
         # remove the basedir as it may confuse sqlalchemy
         basedir = kwargs.pop('basedir')
+        sqlite_performance = kwargs.pop('sqlite_performance', False)
 
         # calculate the maximum number of connections from the pool parameters,
         # if it hasn't already been specified
@@ -229,6 +275,12 @@ class BuildbotEngineStrategy(strategies.ThreadLocalEngineStrategy):
         # keep the basedir
         engine.buildbot_basedir = basedir
 
+        # with the SQLite performance profile, checkpoints are scheduled by
+        # DBConnector rather than run by whichever commit fills the WAL
+        engine.sqlite_performance = sqlite_performance
+        if sqlite_performance:
+            engine.wal_checkpoint_interval = self.SQLITE_CHECKPOINT_INTERVAL
+
         if u.drivername.startswith('sqlite'):
             self.set_up_sqlite_engine(u, engine)
         elif u.drivername.startswith('mysql'):
@@ -0,0 +1,40 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import sqlalchemy as sa
+
+
+def upgrade(migrate_engine):
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    # composite indexes matching the shapes of the most frequent queries
+
+    # unclaimed, incomplete build requests for a builder, as fetched by the
+    # build request distributor
+    buildrequests = sa.Table('buildrequests', metadata, autoload=True)
+    sa.Index('buildrequests_buildername_complete',
+             buildrequests.c.buildername, buildrequests.c.complete).create()
+
+    # buildsets completed before a given time, as pruned by the janitor
+    buildsets = sa.Table('buildsets', metadata, autoload=True)
+    sa.Index('buildsets_complete_complete_at',
+             buildsets.c.complete, buildsets.c.complete_at).create()
+
+    # sourcestamps for a change, as deleted when changes are pruned
+    sourcestamp_changes = sa.Table('sourcestamp_changes', metadata,
+                                   autoload=True)
+    sa.Index('sourcestamp_changes_changeid',
+             sourcestamp_changes.c.changeid).create()
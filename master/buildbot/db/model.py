@@ -367,9 +367,13 @@ class Model(base.DBConnectorComponent):
     sa.Index('buildrequests_buildsetid', buildrequests.c.buildsetid)
     sa.Index('buildrequests_buildername', buildrequests.c.buildername)
     sa.Index('buildrequests_complete', buildrequests.c.complete)
+    sa.Index('buildrequests_buildername_complete', buildrequests.c.buildername,
+             buildrequests.c.complete)
     sa.Index('builds_number', builds.c.number)
     sa.Index('builds_brid', builds.c.brid)
     sa.Index('buildsets_complete', buildsets.c.complete)
+    sa.Index('buildsets_complete_complete_at', buildsets.c.complete,
+             buildsets.c.complete_at)
     sa.Index('buildsets_submitted_at', buildsets.c.submitted_at)
     sa.Index('buildset_properties_buildsetid',
              buildset_properties.c.buildsetid)
@@ -387,6 +391,7 @@ class Model(base.DBConnectorComponent):
              scheduler_changes.c.changeid, unique=True)
     sa.Index('sourcestamp_changes_sourcestampid',
              sourcestamp_changes.c.sourcestampid)
+    sa.Index('sourcestamp_changes_changeid', sourcestamp_changes.c.changeid)
     sa.Index('sourcestamps_sourcestampsetid', sourcestamps.c.sourcestampsetid,
              unique=False)
     sa.Index('users_identifier', users.c.identifier, unique=True)
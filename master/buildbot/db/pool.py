@@ -17,6 +17,7 @@ import inspect
 import os
 import shutil
 import sqlalchemy as sa
+import sys
 import tempfile
 import time
 import traceback
@@ -83,10 +84,27 @@ def timed_do_fn(f):
     return wrap
 
 
+def _caller_name():
+    # Describe the function that called into this module, as
+    # "module.function"; for connector components, this gives names like
+    # "changes.getChange".  Frames in this module (including timed_do_fn)
+    # are skipped.
+    frame = sys._getframe(1)
+    while frame and frame.f_globals.get('__name__') == __name__:
+        frame = frame.f_back
+    if not frame:
+        return 'unknown'
+    module = frame.f_globals.get('__name__', '?').rsplit('.', 1)[-1]
+    return "%s.%s" % (module, frame.f_code.co_name)
+
+
 class DBThreadPool(threadpool.ThreadPool):
 
     running = False
 
+    # if not None, queries that run for at least this many seconds are logged
+    slow_query_threshold = None
+
     # Some versions of SQLite incorrectly cache metadata about which tables are
     # and are not present on a per-connection basis.  This cache can be flushed
     # by querying the sqlite_master table.  We currently assume all versions of
@@ -95,7 +113,8 @@ class DBThreadPool(threadpool.ThreadPool):
     # in bug #1810.
     __broken_sqlite = None
 
-    def __init__(self, engine, verbose=False):
+    def __init__(self, engine, verbose=False, name='DBThreadPool',
+                 pool_size=None):
         # verbose is used by upgrade scripts, and if it is set we should print
         # messages about versions and other warnings
         log_msg = log.msg
@@ -104,20 +123,25 @@ class DBThreadPool(threadpool.ThreadPool):
                 print m
             log_msg = _log_msg
 
-        pool_size = 5
-
         # If the engine has an C{optimal_thread_pool_size} attribute, then the
         # maxthreads of the thread pool will be set to that value.  This is
         # most useful for SQLite in-memory connections, where exactly one
-        # connection (and thus thread) should be used.
-        if hasattr(engine, 'optimal_thread_pool_size'):
-            pool_size = engine.optimal_thread_pool_size
+        # connection (and thus thread) should be used.  An explicit pool_size
+        # can make the pool smaller, but not larger, than that.
+        optimal_pool_size = getattr(engine, 'optimal_thread_pool_size', None)
+        if pool_size is None:
+            pool_size = optimal_pool_size or 5
+        elif optimal_pool_size:
+            pool_size = min(pool_size, optimal_pool_size)
 
         threadpool.ThreadPool.__init__(self,
                                        minthreads=1,
                                        maxthreads=pool_size,
-                                       name='DBThreadPool')
+                                       name=name)
         self.engine = engine
+
+        # number of jobs submitted to this pool that have not yet finished
+        self.outstanding = 0
         if engine.dialect.name == 'sqlite':
             vers = self.get_sqlite_version()
             if vers < (3, 7):
@@ -222,13 +246,55 @@ class DBThreadPool(threadpool.ThreadPool):
             break
         return rv
 
+    def __defer(self, with_engine, callable, args, kwargs):
+        # run __thd in the pool, reporting the depth of the queue, the time
+        # each job waited for a thread, and the time it took to run; the
+        # latter two are also reported per calling method
+        caller = _caller_name()
+        queued_at = time.time()
+        times = []
+
+        def thd():
+            times.append(time.time())
+            try:
+                return self.__thd(with_engine, callable, args, kwargs)
+            finally:
+                times.append(time.time())
+
+        self.outstanding += 1
+        metrics.MetricCountEvent.log("%s.queue_depth" % (self.name,),
+                                     self.outstanding, absolute=True)
+        d = threads.deferToThreadPool(reactor, self, thd)
+
+        def done(res):
+            self.outstanding -= 1
+            metrics.MetricCountEvent.log("%s.queue_depth" % (self.name,),
+                                         self.outstanding, absolute=True)
+            if len(times) == 2:
+                started_at, finished_at = times
+                self._report(caller, started_at - queued_at,
+                             finished_at - started_at)
+            return res
+        d.addBoth(done)
+        return d
+
+    def _report(self, caller, wait, elapsed):
+        metrics.MetricTimeEvent.log("%s.wait" % (self.name,), wait)
+        metrics.MetricHistogramEvent.log(
+            "DBConnector.%s.wait" % (caller,), wait)
+        metrics.MetricHistogramEvent.log(
+            "DBConnector.%s.execute" % (caller,), elapsed)
+        threshold = self.slow_query_threshold
+        if threshold is not None and elapsed >= threshold:
+            log.msg("slow database query: %s took %.3fs (after waiting "
+                    "%.3fs for a %s thread)"
+                    % (caller, elapsed, wait, self.name))
+
     def do(self, callable, *args, **kwargs):
-        return threads.deferToThreadPool(reactor, self,
-                                         self.__thd, False, callable, args, kwargs)
+        return self.__defer(False, callable, args, kwargs)
 
     def do_with_engine(self, callable, *args, **kwargs):
-        return threads.deferToThreadPool(reactor, self,
-                                         self.__thd, True, callable, args, kwargs)
+        return self.__defer(True, callable, args, kwargs)
 
     def detect_bug1810(self):
         # detect buggy SQLite implementations; call only for a known-sqlite
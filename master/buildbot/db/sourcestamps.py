@@ -38,49 +38,65 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
                        patch_comment="", patch_subdir=None, changeids=[]):
         def thd(conn):
             transaction = conn.begin()
-
-            # handle inserting a patch
-            patchid = None
-            if patch_body is not None:
-                ins = self.db.model.patches.insert()
-                r = conn.execute(ins, dict(
-                    patchlevel=patch_level,
-                    patch_base64=base64.b64encode(patch_body),
-                    patch_author=patch_author,
-                    patch_comment=patch_comment,
-                    subdir=patch_subdir))
-                patchid = r.inserted_primary_key[0]
-
-            # insert the sourcestamp itself
-            tbl = self.db.model.sourcestamps
-            self.check_length(tbl.c.branch, branch)
-            self.check_length(tbl.c.revision, revision)
-            self.check_length(tbl.c.repository, repository)
-            self.check_length(tbl.c.project, project)
-
-            r = conn.execute(tbl.insert(), dict(
-                branch=branch,
-                revision=revision,
-                patchid=patchid,
-                repository=repository,
-                codebase=codebase,
-                project=project,
-                sourcestampsetid=sourcestampsetid))
-            ssid = r.inserted_primary_key[0]
-
-            # handle inserting change ids
-            if changeids:
-                ins = self.db.model.sourcestamp_changes.insert()
-                conn.execute(ins, [
-                    dict(sourcestampid=ssid, changeid=changeid)
-                    for changeid in changeids])
-
+            ssid = self._addSourceStamp_thd(
+                conn, branch=branch, revision=revision,
+                repository=repository, project=project,
+                sourcestampsetid=sourcestampsetid, codebase=codebase,
+                patch_body=patch_body, patch_level=patch_level,
+                patch_author=patch_author, patch_comment=patch_comment,
+                patch_subdir=patch_subdir, changeids=changeids)
             transaction.commit()
 
             # and return the new ssid
             return ssid
         return self.db.pool.do(thd)
 
+    def _addSourceStamp_thd(self, conn, branch, revision, repository,
+                            project, sourcestampsetid, codebase='',
+                            patch_body=None, patch_level=0, patch_author="",
+                            patch_comment="", patch_subdir=None,
+                            changeids=[]):
+        # add a sourcestamp in the caller's transaction; this is also used by
+        # BuildsetsConnectorComponent.addBuildsets
+
+        # handle inserting a patch
+        patchid = None
+        if patch_body is not None:
+            ins = self.db.model.patches.insert()
+            r = conn.execute(ins, dict(
+                patchlevel=patch_level,
+                patch_base64=base64.b64encode(patch_body),
+                patch_author=patch_author,
+                patch_comment=patch_comment,
+                subdir=patch_subdir))
+            patchid = r.inserted_primary_key[0]
+
+        # insert the sourcestamp itself
+        tbl = self.db.model.sourcestamps
+        self.check_length(tbl.c.branch, branch)
+        self.check_length(tbl.c.revision, revision)
+        self.check_length(tbl.c.repository, repository)
+        self.check_length(tbl.c.project, project)
+
+        r = conn.execute(tbl.insert(), dict(
+            branch=branch,
+            revision=revision,
+            patchid=patchid,
+            repository=repository,
+            codebase=codebase,
+            project=project,
+            sourcestampsetid=sourcestampsetid))
+        ssid = r.inserted_primary_key[0]
+
+        # handle inserting change ids
+        if changeids:
+            ins = self.db.model.sourcestamp_changes.insert()
+            conn.execute(ins, [
+                dict(sourcestampid=ssid, changeid=changeid)
+                for changeid in changeids])
+
+        return ssid
+
     @base.cached("sssetdicts")
     @defer.inlineCallbacks
     def getSourceStamps(self, sourcestampsetid):
@@ -18,6 +18,9 @@ import sqlalchemy.exc
 
 from buildbot.db import base
 from buildbot.util import json
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.python import log
 
 
 class _IdNotFoundError(Exception):
@@ -31,6 +34,22 @@ class ObjDict(dict):
 class StateConnectorComponent(base.DBConnectorComponent):
     # Documentation is in developer/database.rst
 
+    # seconds for which writes are held in memory before being flushed to
+    # the database, or None to write immediately; see setFlushInterval
+    flush_interval = None
+
+    _reactor = reactor
+
+    def __init__(self, connector):
+        base.DBConnectorComponent.__init__(self, connector)
+        # value_json for each (objectid, name) read or written, used only when
+        # flush_interval is set
+        self._cache = {}
+        # value_json for each (objectid, name) not yet written
+        self._pending = {}
+        self._flush_call = None
+        self._flush_lock = defer.DeferredLock()
+
     def getObjectId(self, name, class_name):
         # defer to a cached method that only takes one parameter (a tuple)
         return self._getObjectId((name, class_name)
@@ -87,6 +106,11 @@ class StateConnectorComponent(base.DBConnectorComponent):
         pass
 
     def getState(self, objectid, name, default=Thunk):
+        key = (objectid, name)
+        if self.flush_interval is not None and key in self._cache:
+            return defer.succeed(
+                self._decodeState(objectid, name, self._cache[key], default))
+
         def thd(conn):
             object_state_tbl = self.db.model.object_state
 
@@ -98,58 +122,147 @@ class StateConnectorComponent(base.DBConnectorComponent):
             res.close()
 
             if not row:
-                if default is self.Thunk:
-                    raise KeyError("no such state value '%s' for object %d" %
-                                   (name, objectid))
-                return default
-            try:
-                return json.loads(row.value_json)
-            except:
-                raise TypeError("JSON error loading state value '%s' for %d" %
-                                (name, objectid))
-        return self.db.pool.do(thd)
+                return None
+            return row.value_json
+        d = self.db.pool.do(thd)
+
+        @d.addCallback
+        def decode(value_json):
+            if self.flush_interval is not None and value_json is not None:
+                # a write made while the query ran takes precedence
+                value_json = self._cache.setdefault(key, value_json)
+            return self._decodeState(objectid, name, value_json, default)
+        return d
+
+    def _decodeState(self, objectid, name, value_json, default):
+        if value_json is None:
+            if default is self.Thunk:
+                raise KeyError("no such state value '%s' for object %d" %
+                               (name, objectid))
+            return default
+        try:
+            return json.loads(value_json)
+        except:
+            raise TypeError("JSON error loading state value '%s' for %d" %
+                            (name, objectid))
 
     def setState(self, objectid, name, value):
-        def thd(conn):
-            object_state_tbl = self.db.model.object_state
-
-            try:
-                value_json = json.dumps(value)
-            except:
-                raise TypeError("Error encoding JSON for %r" % (value,))
-
-            self.check_length(object_state_tbl.c.name, name)
-
-            def update():
-                q = object_state_tbl.update(
-                    whereclause=((object_state_tbl.c.objectid == objectid)
-                                 & (object_state_tbl.c.name == name)))
-                res = conn.execute(q, value_json=value_json)
+        try:
+            value_json = json.dumps(value)
+        except:
+            return defer.fail(TypeError("Error encoding JSON for %r" %
+                                        (value,)))
+
+        if self.flush_interval is None:
+            return self.db.pool.do(self._setState_thd, objectid, name,
+                                   value_json)
+
+        # write-behind: remember the value, and write it with any others
+        # when the flush timer fires
+        self.check_length(self.db.model.object_state.c.name, name)
+        key = (objectid, name)
+        self._cache[key] = self._pending[key] = value_json
+        if not self._flush_call:
+            self._flush_call = self._reactor.callLater(self.flush_interval,
+                                                       self._doFlush)
+        return defer.succeed(None)
+
+    def _setState_thd(self, conn, objectid, name, value_json):
+        object_state_tbl = self.db.model.object_state
+
+        self.check_length(object_state_tbl.c.name, name)
+
+        def update():
+            q = object_state_tbl.update(
+                whereclause=((object_state_tbl.c.objectid == objectid)
+                             & (object_state_tbl.c.name == name)))
+            res = conn.execute(q, value_json=value_json)
+
+            # check whether that worked
+            return res.rowcount > 0
+
+        def insert():
+            conn.execute(object_state_tbl.insert(),
+                         objectid=objectid,
+                         name=name,
+                         value_json=value_json)
+
+        # try updating; if that fails, try inserting; if that fails, then
+        # we raced with another instance to insert, so let that instance
+        # win.
+
+        if update():
+            return
+
+        self._test_timing_hook(conn)
+
+        try:
+            insert()
+        except (sqlalchemy.exc.IntegrityError, sqlalchemy.exc.ProgrammingError):
+            pass  # someone beat us to it - oh well
+
+    def setFlushInterval(self, flush_interval):
+        """
+        Configure write-behind caching of state.  If C{flush_interval} is
+        None, every read and write goes to the database.  Otherwise, reads
+        are served from memory and writes are held for up to
+        C{flush_interval} seconds, then written together.
+
+        @returns: Deferred, firing when any pending writes are flushed
+        """
+        self.flush_interval = flush_interval
+        if flush_interval is None:
+            d = self.flushState()
+
+            @d.addCallback
+            def clear(_):
+                if self.flush_interval is None:
+                    self._cache.clear()
+            return d
+        return defer.succeed(None)
+
+    def flushState(self):
+        """
+        Write any pending state values to the database, in a single
+        transaction.
+
+        @returns: Deferred
+        """
+        if self._flush_call:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        return self._flush_lock.run(self._flushState)
+
+    def _doFlush(self):
+        self._flush_call = None
+        d = self.flushState()
+        d.addErrback(log.err, 'while flushing state')
+        return d
+
+    def _flushState(self):
+        if not self._pending:
+            return defer.succeed(None)
+        pending, self._pending = self._pending, {}
 
-                # check whether that worked
-                return res.rowcount > 0
-
-            def insert():
-                conn.execute(object_state_tbl.insert(),
-                             objectid=objectid,
-                             name=name,
-                             value_json=value_json)
-
-            # try updating; if that fails, try inserting; if that fails, then
-            # we raced with another instance to insert, so let that instance
-            # win.
-
-            if update():
-                return
-
-            self._test_timing_hook(conn)
-
-            try:
-                insert()
-            except (sqlalchemy.exc.IntegrityError, sqlalchemy.exc.ProgrammingError):
-                pass  # someone beat us to it - oh well
-
-        return self.db.pool.do(thd)
+        def thd(conn):
+            transaction = conn.begin()
+            for (objectid, name), value_json in sorted(pending.iteritems()):
+                self._setState_thd(conn, objectid, name, value_json)
+            transaction.commit()
+        d = self.db.pool.do(thd)
+
+        @d.addErrback
+        def retry(f):
+            # keep the values for the next flush, unless they have been
+            # overwritten since
+            for key, value_json in pending.iteritems():
+                self._pending.setdefault(key, value_json)
+            if self.flush_interval is not None and not self._flush_call:
+                self._flush_call = self._reactor.callLater(
+                    self.flush_interval, self._doFlush)
+            return f
+        return d
 
     def _test_timing_hook(self, conn):
         # called so tests can simulate another process inserting a database row
@@ -386,6 +386,11 @@ class IBuilderStatus(Interface):
         longer available. Older builds are likely to have less information
         stored: Logs are the first to go, then Steps."""
 
+    def getBuildAsync(number):
+        """Like getBuild, but return a Deferred that fires with the
+        IBuildStatus object (or None). A build that is not in memory is read
+        from disk in a thread rather than blocking the reactor."""
+
     def getEvent(number):
         """Return an IStatusEvent object for a recent Event. Builders
         connecting and disconnecting are events, as are ping attempts.
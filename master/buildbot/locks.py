@@ -14,10 +14,13 @@
 # Copyright Buildbot Team Members
 
 
+from collections import deque
+
 from buildbot import util
 from buildbot.util import subscription
 from buildbot.util.eventual import eventually
 from twisted.internet import defer
+from twisted.internet import reactor
 from twisted.python import log
 
 if False:  # for debugging
@@ -35,14 +38,26 @@ class BaseLock:
     We maintain the wait queue in FIFO order, and ensure that counting waiters
     in the queue behind exclusive waiters cannot acquire the lock. This ensures
     that exclusive waiters are not starved.
+
+    When the lock is released, it is handed to the waiters at the head of the
+    queue that can now hold it: they leave the queue, their access is reserved
+    until they claim it, and only they are woken.  Everyone else stays asleep.
     """
     description = "<BaseLock>"
+    metricName = "Lock"
+    _reactor = reactor
 
     def __init__(self, name, maxCount=1):
         # Name of the lock
         self.name = name
-        # Current queue, tuples (waiter, LockAccess, deferred)
-        self.waiting = []
+        # Current queue, entries [waiter, LockAccess, deferred, time queued]
+        # in FIFO order; entries for waiters that stopped waiting are skipped
+        self.queue = deque()
+        # waiter -> its entry in the queue
+        self.waiting = {}
+        # waiters the lock was handed to, which have not claimed it yet,
+        # waiter -> (LockAccess, time queued)
+        self.reserved = {}
         # Current owners, tuples (owner, LockAccess)
         self.owners = []
         # maximal number of counting owners
@@ -56,13 +71,16 @@ class BaseLock:
         return self.description
 
     def _getOwnersCount(self):
-        """ Return the number of current exclusive and counting owners.
+        """ Return the number of current exclusive and counting owners,
+            including waiters the lock has been handed to.
 
             @return: Tuple (number exclusive owners, number counting owners)
         """
         num_excl, num_counting = 0, 0
-        for owner in self.owners:
-            if owner[1].mode == 'exclusive':
+        accesses = [owner[1] for owner in self.owners] + \
+            [reserved[0] for reserved in self.reserved.itervalues()]
+        for access in accesses:
+            if access.mode == 'exclusive':
                 num_excl = num_excl + 1
             else:  # mode == 'counting'
                 num_counting = num_counting + 1
@@ -71,28 +89,24 @@ class BaseLock:
             or (num_excl == 0 and num_counting <= self.maxCount)
         return num_excl, num_counting
 
+    def _canHold(self, num_excl, num_counting, access):
+        if access.mode == 'counting':
+            return num_excl == 0 and num_counting < self.maxCount
+        else:
+            return num_excl == 0 and num_counting == 0
+
     def isAvailable(self, requester, access):
         """ Return a boolean whether the lock is available for claiming """
         debuglog("%s isAvailable(%s, %s): self.owners=%r"
                  % (self, requester, access, self.owners))
+        if requester in self.reserved:
+            return True
+        # the lock is handed to waiters as soon as they can hold it, so
+        # while anyone is waiting, nobody else may claim the lock
+        if self.waiting:
+            return False
         num_excl, num_counting = self._getOwnersCount()
-
-        # Find all waiters ahead of the requester in the wait queue
-        for idx, waiter in enumerate(self.waiting):
-            if waiter[0] == requester:
-                w_index = idx
-                break
-        else:
-            w_index = len(self.waiting)
-        ahead = self.waiting[:w_index]
-
-        if access.mode == 'counting':
-            # Wants counting access
-            return num_excl == 0 and num_counting + len(ahead) < self.maxCount \
-                and all([w[1].mode == 'counting' for w in ahead])
-        else:
-            # Wants exclusive access
-            return num_excl == 0 and num_counting == 0 and len(ahead) == 0
+        return self._canHold(num_excl, num_counting, access)
 
     def claim(self, owner, access):
         """ Claim the lock (lock must be available) """
@@ -102,8 +116,13 @@ class BaseLock:
 
         assert isinstance(access, LockAccess)
         assert access.mode in ['counting', 'exclusive']
-        self.waiting = [w for w in self.waiting if w[0] != owner]
+        now = util.now(self._reactor)
+        if owner in self.reserved:
+            queued_at = self.reserved.pop(owner)[1]
+        else:
+            queued_at = now
         self.owners.append((owner, access))
+        self._reportWait(now - queued_at)
         debuglog(" %s is claimed '%s'" % (self, access.mode))
 
     def subscribeToReleases(self, callback):
@@ -121,31 +140,41 @@ class BaseLock:
             debuglog("%s already released" % self)
             return
         self.owners.remove(entry)
-        # who can we wake up?
-        # After an exclusive access, we may need to wake up several waiting.
-        # Break out of the loop when the first waiting client should not be awakened.
+        self._handOff()
+
+        # notify any listeners
+        self.release_subs.deliver()
+
+    def _handOff(self):
+        # Hand the lock to the waiters at the head of the queue that can hold
+        # it now.  After an exclusive access, that may be several counting
+        # waiters.  Stop at the first waiter that cannot hold the lock, so
+        # nobody jumps ahead of it.
         num_excl, num_counting = self._getOwnersCount()
-        for i, (w_owner, w_access, d) in enumerate(self.waiting):
+        while self.queue:
+            entry = self.queue[0]
+            w_owner, w_access, d, queued_at = entry
+            if self.waiting.get(w_owner) is not entry:
+                # this waiter stopped waiting
+                self.queue.popleft()
+                continue
+            if not self._canHold(num_excl, num_counting, w_access):
+                break
             if w_access.mode == 'counting':
-                if num_excl > 0 or num_counting == self.maxCount:
-                    break
-                else:
-                    num_counting = num_counting + 1
+                num_counting = num_counting + 1
             else:
-                # w_access.mode == 'exclusive'
-                if num_excl > 0 or num_counting > 0:
-                    break
-                else:
-                    num_excl = num_excl + 1
-
-            # If the waiter has a deferred, wake it up and clear the deferred
-            # from the wait queue entry to indicate that it has been woken.
-            if d:
-                self.waiting[i] = (w_owner, w_access, None)
-                eventually(d.callback, self)
+                num_excl = num_excl + 1
 
-        # notify any listeners
-        self.release_subs.deliver()
+            self.queue.popleft()
+            del self.waiting[w_owner]
+            self.reserved[w_owner] = (w_access, queued_at)
+            eventually(self._wake, d)
+        self._reportQueueLength()
+
+    def _wake(self, d):
+        # the waiter may have given up and fired the deferred itself
+        if not d.called:
+            d.callback(self)
 
     def waitUntilMaybeAvailable(self, owner, access):
         """Fire when the lock *might* be available. The caller will need to
@@ -153,6 +182,11 @@ class BaseLock:
         used to avoid deadlocks. If we were interested in a stronger form,
         this would be named 'waitUntilAvailable', and the deferred would fire
         after the lock had been claimed.
+
+        The deferred fires only once the lock has been handed to C{owner}, so
+        unless C{owner} also waits for other locks, the lock will be
+        available.  An owner that takes several locks must call
+        L{releaseReservation} on the others before it waits for one of them.
         """
         debuglog("%s waitUntilAvailable(%s)" % (self, owner))
         assert isinstance(access, LockAccess)
@@ -161,28 +195,58 @@ class BaseLock:
         d = defer.Deferred()
 
         # Are we already in the wait queue?
-        w = [i for i, w in enumerate(self.waiting) if w[0] == owner]
-        if w:
-            self.waiting[w[0]] = (owner, access, d)
+        entry = self.waiting.get(owner)
+        if entry:
+            entry[1:3] = [access, d]
         else:
-            self.waiting.append((owner, access, d))
+            entry = [owner, access, d, util.now(self._reactor)]
+            self.waiting[owner] = entry
+            self.queue.append(entry)
+            self._reportQueueLength()
         return d
 
     def stopWaitingUntilAvailable(self, owner, access, d):
         debuglog("%s stopWaitingUntilAvailable(%s)" % (self, owner))
         assert isinstance(access, LockAccess)
-        assert (owner, access, d) in self.waiting
-        self.waiting = [w for w in self.waiting if w[0] != owner]
+        if owner in self.reserved:
+            # the lock was already handed to this waiter; pass it on
+            del self.reserved[owner]
+        else:
+            assert self.waiting[owner][1:3] == [access, d]
+            del self.waiting[owner]
+        self._handOff()
+
+    def releaseReservation(self, owner):
+        """Give the lock to the next waiters if it was handed to C{owner},
+        which has not claimed it yet.  An owner that cannot claim all of its
+        locks must not keep any of them while it waits, or two owners taking
+        the same locks in opposite orders could each wait for the other
+        forever."""
+        debuglog("%s releaseReservation(%s)" % (self, owner))
+        if owner in self.reserved:
+            del self.reserved[owner]
+            self._handOff()
 
     def isOwner(self, owner, access):
         return (owner, access) in self.owners
 
+    def _reportWait(self, wait):
+        # buildbot.process.metrics imports buildbot.config, which imports us
+        from buildbot.process import metrics
+        metrics.MetricHistogramEvent.log("%s.wait" % (self.metricName,), wait)
+
+    def _reportQueueLength(self):
+        from buildbot.process import metrics
+        metrics.MetricCountEvent.log("%s.queue_length" % (self.metricName,),
+                                     len(self.waiting), absolute=True)
+
 
 class RealMasterLock(BaseLock):
 
     def __init__(self, lockid):
         BaseLock.__init__(self, lockid.name, lockid.maxCount)
         self.description = "<MasterLock(%s, %s)>" % (self.name, self.maxCount)
+        self.metricName = "MasterLock.%s" % (self.name,)
 
     def getLock(self, slave):
         return self
@@ -211,6 +275,7 @@ class RealSlaveLock:
             desc = "<SlaveLock(%s, %s)[%s] %d>" % (self.name, maxCount,
                                                    slavename, id(lock))
             lock.description = desc
+            lock.metricName = "SlaveLock.%s.%s" % (self.name, slavename)
             self.locks[slavename] = lock
         return self.locks[slavename]
 
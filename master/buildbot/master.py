@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 
+import itertools
 import os
 import signal
 import socket
@@ -35,6 +36,7 @@ from buildbot import interfaces
 from buildbot import monkeypatches
 from buildbot.changes import changes
 from buildbot.changes.manager import ChangeManager
+from buildbot.db import buildrequests
 from buildbot.db import connector
 from buildbot.process import cache
 from buildbot.process import debug
@@ -48,6 +50,7 @@ from buildbot.status.master import Status
 from buildbot.status.results import FAILURE
 from buildbot.status.results import SUCCESS
 from buildbot.status.results import WARNINGS
+from buildbot.util import batch
 from buildbot.util import check_functional_environment
 from buildbot.util import epoch2datetime
 from buildbot.util import subscription
@@ -117,6 +120,12 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         self._complete_buildset_subs = \
             subscription.SubscriptionPoint("buildset_completion")
 
+        # buildsets added at about the same time, e.g., by a Trigger step
+        # that fires several schedulers, go into the database together; see
+        # addBuildsets
+        self._addBuildsetsBatcher = batch.Batcher(self._addBuildsetsBatch)
+        self._buildsetBatchKeys = itertools.count()
+
         # local cache for this master's object ID
         self._object_id = None
 
@@ -548,6 +557,71 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         d.addCallback(notify)
         return d
 
+    def addBuildsets(self, buildsets):
+        """
+        Add several buildsets to the buildmaster and act on them.  Each
+        buildset is described by a dictionary as expected by
+        L{buildbot.db.buildsets.BuildsetsConnectorComponent.addBuildsets},
+        so new sourcestamps can be added along with their buildset.
+
+        Buildsets added by calls made at about the same time are added to the
+        database in a single transaction, and then all of their subscribers
+        are notified.  If that transaction fails, the buildsets of each call
+        are added in a transaction of their own, so that a bad buildset only
+        fails the call that added it.  Returns a list of (bsid, brids)
+        tuples, one for each buildset, via a Deferred.
+        """
+        key = self._buildsetBatchKeys.next()
+        d = self._addBuildsetsBatcher({key: buildsets})
+        # a failure is passed on to the errbacks
+        d.addCallback(lambda results: results[key])
+        return d
+
+    @defer.inlineCallbacks
+    def _addBuildsetsBatch(self, buildsets_by_key):
+        # the keys increase with each call, so this keeps the buildsets in
+        # the order they were added
+        keys = sorted(buildsets_by_key)
+        outcomes = {}
+        try:
+            results = yield self.db.buildsets.addBuildsets(
+                [bs for k in keys for bs in buildsets_by_key[k]])
+        except Exception:
+            if len(keys) == 1:
+                raise
+            # one call's bad buildset, such as one with an over-long reason,
+            # must not fail the other calls
+            log.msg("adding the buildsets of %d calls failed; adding those "
+                    "of each call separately" % (len(keys),))
+            for k in keys:
+                try:
+                    outcomes[k] = yield self.db.buildsets.addBuildsets(
+                        buildsets_by_key[k])
+                except Exception:
+                    outcomes[k] = failure.Failure()
+        else:
+            for k in keys:
+                n = len(buildsets_by_key[k])
+                outcomes[k], results = results[:n], results[n:]
+
+        added = [(bsid_brids, kwargs) for k in keys
+                 if not isinstance(outcomes[k], failure.Failure)
+                 for bsid_brids, kwargs in zip(outcomes[k],
+                                               buildsets_by_key[k])]
+        log.msg("added buildsets %s to database"
+                % (", ".join(str(bsid) for (bsid, _), _ in added),))
+
+        # note that buildset additions are only reported on this master
+        for (bsid, _), kwargs in added:
+            self._new_buildset_subs.deliver(bsid=bsid, **kwargs)
+        # only deliver messages immediately if we're not polling
+        if not self.config.db['db_poll_interval']:
+            for (bsid, brids), _ in added:
+                for bn, brid in brids.iteritems():
+                    self.buildRequestAdded(bsid=bsid, brid=brid,
+                                           buildername=bn)
+        defer.returnValue(outcomes)
+
     def subscribeToBuildsets(self, callback):
         """
         Request that C{callback(bsid=bsid, ssid=ssid, reason=reason,
@@ -646,6 +720,9 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
     _last_processed_change = None
 
+    # maximum number of changes to fetch from the database at once
+    CHANGE_POLL_BATCH_SIZE = 100
+
     @defer.inlineCallbacks
     def pollDatabaseChanges(self):
         # Older versions of Buildbot had each scheduler polling the database
@@ -682,21 +759,46 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
             timer.stop()
             return
 
-        while True:
-            changeid = self._last_processed_change + 1
-            chdict = yield self.db.changes.getChange(changeid)
+        # find out how far behind we are, so that an idle poll costs only
+        # this one query
+        latest = yield self.db.changes.getLatestChangeid()
+        if latest is None:
+            latest = self._last_processed_change
+        lag = max(latest - self._last_processed_change, 0)
+        metrics.MetricCountEvent.log(
+            "BuildMaster.pollDatabaseChanges.lag", lag, absolute=True)
+
+        delivered = 0
+        while self._last_processed_change < latest:
+            lo = self._last_processed_change + 1
+            hi = min(lo + self.CHANGE_POLL_BATCH_SIZE - 1, latest)
+            chdicts = yield self.db.changes.getChangesInRange(lo, hi)
+
+            # only deliver the contiguous run of changes following the last
+            # one processed; a gap may be a change that another master is
+            # still inserting, so stop there and pick it up on the next poll
+            batch = []
+            for chdict in chdicts:
+                if chdict['changeid'] != lo + len(batch):
+                    break
+                batch.append(chdict)
+
+            changelist = yield defer.gatherResults([
+                changes.Change.fromChdict(self, chdict)
+                for chdict in batch])
+
+            for change in changelist:
+                self._change_subs.deliver(change)
+                self._last_processed_change = change.number
+                need_setState = True
+            delivered += len(changelist)
 
-            # if there's no such change, we've reached the end and can
-            # stop polling
-            if not chdict:
+            if self._last_processed_change != hi:
                 break
 
-            change = yield changes.Change.fromChdict(self, chdict)
-
-            self._change_subs.deliver(change)
-
-            self._last_processed_change = changeid
-            need_setState = True
+        metrics.MetricCountEvent.log(
+            "BuildMaster.pollDatabaseChanges.batch_size", delivered,
+            absolute=True)
 
         # write back the updated state, if it's changed
         if need_setState:
@@ -705,6 +807,7 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         timer.stop()
 
     _last_unclaimed_brids_set = None
+    _last_unclaimed_brid_watermark = None
     _last_claim_cleanup = 0
 
     @defer.inlineCallbacks
@@ -735,10 +838,37 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
                     "producing builds for which no builder is running?"
                     % len(last_unclaimed))
 
+        # _last_unclaimed_brid_watermark is the highest brid seen by the last
+        # poll.  If the checksum of the unclaimed requests at or below that
+        # brid still matches _last_unclaimed_brids_set, nothing old has been
+        # claimed or unclaimed, so only newer requests need be fetched.
+        # Otherwise, fall back to fetching all unclaimed requests.
+        watermark = self._last_unclaimed_brid_watermark
+        rescan = True
+        if watermark is not None:
+            checksum = yield self.db.buildrequests.\
+                getUnclaimedBuildRequestsChecksum(max_brid=watermark)
+            if checksum == buildrequests.checksumBuildRequestIds(
+                    last_unclaimed):
+                rescan = False
+            else:
+                metrics.MetricCountEvent.log(
+                    "BuildMaster.pollDatabaseBuildRequests.rescans")
+
         # get the current set of unclaimed buildrequests
-        now_unclaimed_brdicts = \
-            yield self.db.buildrequests.getBuildRequests(claimed=False)
-        now_unclaimed = set([brd['brid'] for brd in now_unclaimed_brdicts])
+        if rescan:
+            now_unclaimed_brdicts = \
+                yield self.db.buildrequests.getBuildRequests(claimed=False)
+            now_unclaimed = set()
+        else:
+            now_unclaimed_brdicts = \
+                yield self.db.buildrequests.getBuildRequests(
+                    claimed=False, min_brid=watermark + 1)
+            now_unclaimed = set(last_unclaimed)
+        now_unclaimed.update([brd['brid'] for brd in now_unclaimed_brdicts])
+
+        self._last_unclaimed_brid_watermark = max(
+            [watermark or 0] + [brd['brid'] for brd in now_unclaimed_brdicts])
 
         # and store that for next time
         self._last_unclaimed_brids_set = now_unclaimed
@@ -0,0 +1,99 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from buildbot import util
+from buildbot.process import metrics
+from twisted.internet import reactor
+
+
+class WorkspaceAffinity(object):
+
+    """
+    A C{canStartBuild} function that sends builds of the same branch to the
+    slave that last built it, where the workdir is likely to be up to date.
+
+    Builds are keyed by builder name and the codebase, repository and branch
+    of each of the request's sourcestamps.  If another slave is offered for a
+    key while the slave that last built it is connected to the builder, the
+    other slave is refused, for at most C{maxWait} seconds after the request
+    was submitted; after that, the build may go to any slave.
+
+    The builder calls L{buildStarted} once a build has actually started, and
+    only then is the slave remembered and the build counted as a hit or a
+    miss; a slave that is accepted here may still fail to start the build.
+    """
+
+    def __init__(self, maxWait=300):
+        self.maxWait = maxWait
+        # (buildername, branches) -> name of the slave that last built it
+        self.lastSlaves = {}
+        # (buildername, branches) -> timer to look at the builder again
+        self.timers = {}
+        # counts of builds that went to the preferred slave, and that did not
+        self.hits = 0
+        self.misses = 0
+        # for testing
+        self._reactor = reactor
+
+    def getKey(self, builder, breq):
+        branches = sorted((codebase, ss.repository, ss.branch)
+                          for codebase, ss in breq.sources.iteritems())
+        return (builder.name, tuple(branches))
+
+    def __call__(self, builder, slavebuilder, breq):
+        key = self.getKey(builder, breq)
+        slavename = slavebuilder.slave.slavename
+        lastSlave = self.lastSlaves.get(key)
+
+        if lastSlave == slavename:
+            return True
+
+        # if the preferred slave is still attached to the builder, wait for
+        # it, up to maxWait seconds after the request was submitted
+        preferred = [sb for sb in builder.slaves
+                     if sb.slave and sb.slave.slavename == lastSlave]
+        if preferred:
+            waited = util.now(self._reactor) - (breq.submittedAt or 0)
+            if waited < self.maxWait:
+                self._retryAfter(builder, key, self.maxWait - waited)
+                return False
+
+        return True
+
+    def buildStarted(self, builder, slavebuilder, breqs):
+        """Called by the builder once a build of C{breqs} has started on
+        C{slavebuilder}."""
+        slavename = slavebuilder.slave.slavename
+        keys = [self.getKey(builder, breq) for breq in breqs]
+        if self.lastSlaves.get(keys[0]) == slavename:
+            self.hits += 1
+            metrics.MetricCountEvent.log('WorkspaceAffinity.hits', 1)
+        else:
+            # this build started with a cold or stale workdir
+            self.misses += 1
+            metrics.MetricCountEvent.log('WorkspaceAffinity.misses', 1)
+        for key in keys:
+            self.lastSlaves[key] = slavename
+
+    def _retryAfter(self, builder, key, delay):
+        # make sure the request gets another look once its wait is over, even
+        # if the preferred slave stays busy
+        if key in self.timers and self.timers[key].active():
+            return
+
+        def retry():
+            del self.timers[key]
+            builder.botmaster.maybeStartBuildsForBuilder(builder.name)
+        self.timers[key] = self._reactor.callLater(delay, retry)
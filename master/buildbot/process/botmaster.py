@@ -29,6 +29,7 @@ from buildbot import util
 from buildbot.process import metrics
 from buildbot.process.builder import Builder
 from buildbot.process.buildrequestdistributor import BuildRequestDistributor
+from buildbot.util import batch
 
 
 class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
@@ -75,6 +76,16 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
         self.brd = BuildRequestDistributor(self)
         self.brd.setServiceParent(self)
 
+        # builds, and the build requests they satisfy, that finish at about
+        # the same time are marked complete in the database together; see
+        # Builder.buildFinished
+        self.finishBuildsBatcher = batch.Batcher(
+            lambda bids: self.master.db.builds.finishBuildsBatch(bids.keys()))
+        self.completeBuildRequestsBatcher = batch.Batcher(
+            lambda brid_results:
+            self.master.db.buildrequests.completeBuildRequestsBatch(
+                brid_results))
+
     def cleanShutdown(self, _reactor=reactor):
         """Shut down the entire process, once all currently-running builds are
         complete."""
@@ -148,6 +159,7 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
     def startService(self):
         def buildRequestAdded(notif):
+            self.brd.buildRequestAdded(notif)
             self.maybeStartBuildsForBuilder(notif['buildername'])
         self.buildrequest_sub = \
             self.master.subscribeToBuildRequests(buildRequestAdded)
@@ -164,6 +176,8 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # reconfigure builders
         yield self.reconfigServiceBuilders(new_config)
 
+        self.brd.max_concurrency = new_config.distributorConcurrency
+
         # call up
         yield config.ReconfigurableServiceMixin.reconfigService(self,
                                                                 new_config)
@@ -280,7 +294,10 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
         for b in self.builders.values():
             b.builder_status.addPointEvent(["master", "shutdown"])
             b.builder_status.saveYourself()
-        return service.MultiService.stopService(self)
+        d = defer.gatherResults([self.finishBuildsBatcher.flush(),
+                                 self.completeBuildRequestsBatcher.flush()])
+        d.addCallback(lambda _: service.MultiService.stopService(self))
+        return d
 
     def getLockByID(self, lockid):
         """Convert a Lock identifier into an actual Lock instance.
@@ -304,6 +321,16 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
         lock = self.getLockByID(access.lockid)
         return lock
 
+    def getBuilderQueueSummaries(self):
+        """
+        Get a summary of every builder's queue of unclaimed build requests,
+        from a cache shared by all builders.
+
+        @returns: dictionary mapping builder name to a dictionary with keys
+        C{oldest_submitted_at} and C{count}, via Deferred
+        """
+        return self.brd.unclaimedBuildRequests.getQueueSummaries()
+
     def maybeStartBuildsForBuilder(self, buildername):
         """
         Call this when something suggests that a particular builder may now
@@ -297,6 +297,9 @@ class Build(properties.PropertiesMixin):
         for lock, access in self.locks:
             if not lock.isAvailable(self, access):
                 log.msg("Build %s waiting for lock %s" % (self, lock))
+                for other, _ in self.locks:
+                    if other is not lock:
+                        other.releaseReservation(self)
                 d = lock.waitUntilMaybeAvailable(self, access)
                 d.addCallback(self.acquireLocks)
                 self._acquiringLock = (lock, access, d)
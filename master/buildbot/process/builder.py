@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 
+import hashlib
 import weakref
 
 from twisted.application import internet
@@ -26,14 +27,18 @@ from zope.interface import implements
 
 from buildbot import config
 from buildbot import interfaces
+from buildbot import util
 from buildbot.process import buildrequest
+from buildbot.process import metrics
 from buildbot.process import slavebuilder
 from buildbot.process.build import Build
 from buildbot.process.properties import Properties
 from buildbot.process.slavebuilder import BUILDING
 from buildbot.status.builder import RETRY
+from buildbot.status.builder import SUCCESS
 from buildbot.status.buildrequest import BuildRequestStatus
 from buildbot.status.progress import Expectations
+from buildbot.util import json
 
 
 def enforceChosenSlave(bldr, slavebuilder, breq):
@@ -45,6 +50,29 @@ def enforceChosenSlave(bldr, slavebuilder, breq):
     return True
 
 
+def leastLoadedSlave(bldr, slavebuilders):
+    """
+    A C{nextSlave} function that picks the slave running the fewest builds,
+    then the one with the lowest reported load per CPU, then the one with
+    the most free memory and disk.  Slaves that have not reported their
+    resources come after those that have.
+    """
+    def key(sb):
+        slave = sb.slave
+        running = len([s for s in slave.slavebuilders.values()
+                       if s.isBusy()])
+        resources = slave.resources or {}
+        load = resources.get('load')
+        if load is not None and resources.get('cpus'):
+            load = float(load) / resources['cpus']
+        return (running, load is None, load,
+                -(resources.get('free_memory') or 0),
+                -(resources.get('free_disk') or 0))
+    if not slavebuilders:
+        return None
+    return min(slavebuilders, key=key)
+
+
 class Builder(config.ReconfigurableServiceMixin,
               pb.Referenceable,
               service.MultiService):
@@ -52,6 +80,10 @@ class Builder(config.ReconfigurableServiceMixin,
     # reconfigure builders before slaves
     reconfig_priority = 196
 
+    # properties that say why or by whom a build was requested, rather than
+    # what it builds; these are left out of build fingerprints
+    buildAvoidanceIgnoredProperties = ('owner', 'reason', 'scheduler')
+
     def __init__(self, name, _addServices=True):
         service.MultiService.__init__(self)
         self.name = name
@@ -76,6 +108,13 @@ class Builder(config.ReconfigurableServiceMixin,
         self.config = None
         self.builder_status = None
 
+        # fingerprint -> (time finished, build number) of recent successful
+        # builds, for build avoidance
+        self.buildFingerprints = {}
+        # builds started before the last reconfig, whose fingerprints are not
+        # recorded
+        self.oldConfigBuilds = set()
+
         if _addServices:
             self.reclaim_svc = internet.TimerService(10 * 60,
                                                      self.reclaimAllBuilds)
@@ -102,6 +141,12 @@ class Builder(config.ReconfigurableServiceMixin,
                 tags=builder_config.tags,
                 description=builder_config.description)
 
+        # the fingerprints do not cover the builder's configuration, so the
+        # builds made with the old one, even those still running, must not
+        # stand in for builds made with the new one
+        if builder_config is not self.config:
+            self.buildFingerprints.clear()
+            self.oldConfigBuilds = set(self.building)
         self.config = builder_config
 
         self.builder_status.setDescription(builder_config.description)
@@ -132,14 +177,19 @@ class Builder(config.ReconfigurableServiceMixin,
 
         @returns: datetime instance or None, via Deferred
         """
-        unclaimed = yield self.master.db.buildrequests.getBuildRequests(
-            buildername=self.name, claimed=False)
+        summaries = yield self.botmaster.getBuilderQueueSummaries()
+        summary = summaries.get(self.name)
+        defer.returnValue(summary and summary['oldest_submitted_at'])
 
-        if unclaimed:
-            unclaimed = sorted([brd['submitted_at'] for brd in unclaimed])
-            defer.returnValue(unclaimed[0])
-        else:
-            defer.returnValue(None)
+    @defer.inlineCallbacks
+    def getUnclaimedBuildRequestCount(self):
+        """Returns the number of unclaimed build requests for this builder.
+
+        @returns: integer, via Deferred
+        """
+        summaries = yield self.botmaster.getBuilderQueueSummaries()
+        summary = summaries.get(self.name)
+        defer.returnValue(summary['count'] if summary else 0)
 
     def reclaimAllBuilds(self):
         brids = set()
@@ -416,6 +466,14 @@ class Builder(config.ReconfigurableServiceMixin,
         # let status know
         self.master.status.build_started(req.id, self.name, bs)
 
+        # let a canStartBuild function that follows where builds run know
+        buildStarted = getattr(self.config.canStartBuild, 'buildStarted', None)
+        if buildStarted:
+            try:
+                buildStarted(self, slavebuilder, buildrequests)
+            except:
+                log.err(failure.Failure(), 'while calling buildStarted:')
+
         # start the build. This will first set up the steps, then tell the
         # BuildStatus that it has started, which will announce it to the world
         # (through our BuilderStatus object, which is its parent).  Finally it
@@ -455,17 +513,29 @@ class Builder(config.ReconfigurableServiceMixin,
 
         # mark the builds as finished, although since nothing ever reads this
         # table, it's not too important that it complete successfully
-        d = self.master.db.builds.finishBuilds(bids)
+        d = self.master.botmaster.finishBuildsBatcher(dict.fromkeys(bids))
         d.addErrback(log.err, 'while marking builds as finished (ignored)')
 
         results = build.build_status.getResults()
         self.building.remove(build)
+        oldConfig = build in self.oldConfigBuilds
+        self.oldConfigBuilds.discard(build)
         if results == RETRY:
             self._resubmit_buildreqs(build).addErrback(log.err)
         else:
+            if (results == SUCCESS and self.config.buildAvoidanceHorizon
+                    and not oldConfig):
+                self._recordBuildFingerprint(build)
             brids = [br.id for br in build.requests]
-            db = self.master.db
-            d = db.buildrequests.completeBuildRequests(brids, results)
+            d = self.master.botmaster.completeBuildRequestsBatcher(
+                dict((brid, results) for brid in brids))
+
+            @d.addCallback
+            def check(completed):
+                if not all(completed.values()):
+                    log.msg("tried to complete %d buildrequests, "
+                            "but only completed %d" %
+                            (len(brids), sum(completed.values())))
             d.addCallback(
                 lambda _: self._maybeBuildsetsComplete(build.requests))
             # nothing in particular to do with this deferred, so just log it if
@@ -485,7 +555,14 @@ class Builder(config.ReconfigurableServiceMixin,
 
     def _resubmit_buildreqs(self, build):
         brids = [br.id for br in build.requests]
-        return self.master.db.buildrequests.unclaimBuildRequests(brids)
+        d = self.master.db.buildrequests.unclaimBuildRequests(brids)
+
+        # let the master know the requests can be claimed again
+        @d.addCallback
+        def notify(_):
+            for br in build.requests:
+                self.master.buildRequestAdded(br.bsid, br.id, self.name)
+        return d
 
     def setExpectations(self, progress):
         """Mark the build as successful and update expectations for the next
@@ -519,12 +596,105 @@ class Builder(config.ReconfigurableServiceMixin,
             defer.returnValue(False)
             return
 
+        # if these requests were built recently, reuse that build's results
+        if self.config.buildAvoidanceHorizon:
+            number = self._findEquivalentBuild(breqs)
+            if number is not None:
+                reused = yield self._reuseBuild(number, breqs)
+                defer.returnValue(reused)
+                return
+
         # If the build fails from here on out (e.g., because a slave has failed),
         # it will be handled outside of this function. TODO: test that!
 
         build_started = yield self._startBuildFor(slavebuilder, breqs)
         defer.returnValue(build_started)
 
+    # build avoidance
+
+    def getBuildFingerprint(self, breqs):
+        """
+        Return a fingerprint of what a build of C{breqs} would build: the
+        builder, the sourcestamps, including any patch, and the properties,
+        except those in C{buildAvoidanceIgnoredProperties} and the builder's
+        C{buildAvoidanceIgnoreProperties}.  Returns None if the requests do
+        not all have the same fingerprint, or if any sourcestamp does not name
+        a revision, since then the same inputs may not give the same code.
+        """
+        ignored = set(self.buildAvoidanceIgnoredProperties)
+        ignored.update(self.config.buildAvoidanceIgnoreProperties)
+
+        fingerprints = set()
+        for breq in breqs:
+            sources = []
+            for codebase, ss in sorted(breq.sources.iteritems()):
+                if ss.revision is None:
+                    return None
+                sources.append((codebase, ss.repository, ss.project,
+                                ss.branch, ss.revision, ss.patch))
+            props = sorted((name, value)
+                           for name, (value, source)
+                           in breq.properties.properties.iteritems()
+                           if name not in ignored)
+            blob = json.dumps([self.name, sources, props], default=repr)
+            fingerprints.add(hashlib.sha1(blob).hexdigest())
+
+        if len(fingerprints) != 1:
+            return None
+        return fingerprints.pop()
+
+    def _findEquivalentBuild(self, breqs):
+        # return the number of a recent successful build with the same
+        # fingerprint as these requests, or None
+        fingerprint = self.getBuildFingerprint(breqs)
+        if fingerprint is None:
+            return None
+        found = self.buildFingerprints.get(fingerprint)
+        if found and util.now() - found[0] < self.config.buildAvoidanceHorizon:
+            metrics.MetricCountEvent.log('BuildAvoidance.hits', 1)
+            return found[1]
+        metrics.MetricCountEvent.log('BuildAvoidance.misses', 1)
+        return None
+
+    def _recordBuildFingerprint(self, build):
+        fingerprint = self.getBuildFingerprint(build.requests)
+        if fingerprint is None:
+            return
+        now = util.now()
+        horizon = self.config.buildAvoidanceHorizon
+        for fp, (finished, _) in self.buildFingerprints.items():
+            if now - finished >= horizon:
+                del self.buildFingerprints[fp]
+        self.buildFingerprints[fingerprint] = (now, build.build_status.number)
+
+    @defer.inlineCallbacks
+    def _reuseBuild(self, number, breqs):
+        # complete the requests as successful, and link them to the earlier
+        # build with a row in the builds table
+        log.msg("reusing build %d of builder %s for requests %s"
+                % (number, self.name, [br.id for br in breqs]))
+        try:
+            bids = []
+            for req in breqs:
+                bid = yield self.master.db.builds.addBuild(req.id, number)
+                bids.append(bid)
+        except Exception:
+            log.err(failure.Failure(), 'while adding rows to build table:')
+            defer.returnValue(False)
+            return
+
+        d = self.master.botmaster.finishBuildsBatcher(dict.fromkeys(bids))
+        d.addErrback(log.err, 'while marking builds as finished (ignored)')
+
+        d = self.master.botmaster.completeBuildRequestsBatcher(
+            dict((br.id, SUCCESS) for br in breqs))
+        d.addCallback(lambda _: self._maybeBuildsetsComplete(breqs))
+        d.addErrback(log.err, 'while marking build requests as completed')
+
+        # the slave was not used, so it can take another request
+        self.botmaster.maybeStartBuildsForBuilder(self.name)
+        defer.returnValue(True)
+
     # a few utility functions to make the maybeStartBuild a bit shorter and
     # easier to read
 
@@ -548,6 +718,10 @@ class Builder(config.ReconfigurableServiceMixin,
 
     def _defaultMergeRequestFn(self, req1, req2):
         return req1.canBeMergedWith(req2)
+    # requests are compatible exactly when their merge keys are equal, so
+    # the distributor can group them by key
+    _defaultMergeRequestFn.getMergeKey = \
+        lambda builder, req: req.getMergeKey()
 
 
 class BuilderControl:
@@ -25,6 +25,23 @@ from twisted.python import log
 from zope.interface import implements
 
 
+def mergeRequestsByKey(getMergeKey):
+    """
+    Make a C{mergeRequests} function from C{getMergeKey(builder, req)}, which
+    returns a hashable key for a request, or None if the request cannot be
+    merged.  Requests with equal keys are merged.
+
+    The build request distributor groups requests by their keys in a single
+    pass, instead of comparing every pair of requests.  C{getMergeKey} must
+    return its result directly, not via a Deferred.
+    """
+    def mergeRequests(builder, req1, req2):
+        key = getMergeKey(builder, req1)
+        return key is not None and key == getMergeKey(builder, req2)
+    mergeRequests.getMergeKey = getMergeKey
+    return mergeRequests
+
+
 class BuildRequest(object):
 
     """
@@ -188,6 +205,20 @@ class BuildRequest(object):
                 return False
         return True
 
+    def getMergeKey(self):
+        """
+        Returns a hashable key such that two requests can be merged (as
+        defined by L{canBeMergedWith}) if and only if their keys are equal, or
+        None if this request cannot be merged with any other.
+        """
+        keys = []
+        for codebase, source in self.sources.iteritems():
+            key = source.getMergeKey()
+            if key is None:
+                return None
+            keys.append((codebase, key))
+        return tuple(sorted(keys))
+
     def mergeSourceStampsWith(self, others):
         """ Returns one merged sourcestamp for every codebase """
         # get all codebases from all requests
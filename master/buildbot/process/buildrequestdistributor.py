@@ -19,6 +19,7 @@ from twisted.internet import defer
 from twisted.python import log
 from twisted.python.failure import Failure
 
+from buildbot import util
 from buildbot.db.buildrequests import AlreadyClaimedError
 from buildbot.process import metrics
 from buildbot.process.buildrequest import BuildRequest
@@ -50,6 +51,9 @@ class BuildChooserBase(object):
         self.master = master
         self.breqCache = {}
         self.unclaimedBrdicts = None
+        # UnclaimedBuildRequests instance to read unclaimed brdicts from, if
+        # any; this is set by the BuildRequestDistributor
+        self.unclaimedBuildRequests = None
 
     @defer.inlineCallbacks
     def chooseNextBuild(self):
@@ -88,10 +92,14 @@ class BuildChooserBase(object):
         # the self.unclaimedBrdicts to None before calling."""
 
         if self.unclaimedBrdicts is None:
-            brdicts = yield self.master.db.buildrequests.getBuildRequests(
-                buildername=self.bldr.name, claimed=False)
-            # sort by submitted_at, so the first is the oldest
-            brdicts.sort(key=lambda brd: brd['submitted_at'])
+            if self.unclaimedBuildRequests:
+                brdicts = yield self.unclaimedBuildRequests.\
+                    getUnclaimedBrdicts(self.bldr.name)
+            else:
+                brdicts = yield self.master.db.buildrequests.getBuildRequests(
+                    buildername=self.bldr.name, claimed=False)
+                # sort by submitted_at, so the first is the oldest
+                brdicts.sort(key=lambda brd: brd['submitted_at'])
             self.unclaimedBrdicts = brdicts
         defer.returnValue(self.unclaimedBrdicts)
 
@@ -183,6 +191,7 @@ class BasicBuildChooser(BuildChooserBase):
         self.nextBuild = self.bldr.config.nextBuild
 
         self.mergeRequestsFn = self.bldr.getMergeRequestsFn()
+        self.mergeGroups = None
 
     @defer.inlineCallbacks
     def popNextBuild(self):
@@ -233,6 +242,20 @@ class BasicBuildChooser(BuildChooserBase):
             defer.returnValue(mergedRequests)
             return
 
+        # if the function can give a key for each request, then group the
+        # requests by key rather than comparing each pair
+        getMergeKey = getattr(self.mergeRequestsFn, 'getMergeKey', None)
+        if getMergeKey:
+            mergeGroups = yield self._getMergeGroups(getMergeKey)
+            key = getMergeKey(self.bldr, breq)
+            if key is not None:
+                unclaimed = set(brdict['brid']
+                                for brdict in self.unclaimedBrdicts)
+                mergedRequests.extend(req for req in mergeGroups.pop(key, [])
+                                      if req.id in unclaimed)
+            defer.returnValue(mergedRequests)
+            return
+
         # we'll need BuildRequest objects, so get those first
         unclaimedBreqs = yield self._getUnclaimedBuildRequests()
 
@@ -244,6 +267,20 @@ class BasicBuildChooser(BuildChooserBase):
 
         defer.returnValue(mergedRequests)
 
+    @defer.inlineCallbacks
+    def _getMergeGroups(self, getMergeKey):
+        # Group the unclaimed requests by merge key, in a single pass.  This
+        # is done once for the life of the chooser; requests that are later
+        # claimed are filtered out by the caller.
+        if self.mergeGroups is None:
+            unclaimedBreqs = yield self._getUnclaimedBuildRequests()
+            self.mergeGroups = {}
+            for req in unclaimedBreqs:
+                key = getMergeKey(self.bldr, req)
+                if key is not None:
+                    self.mergeGroups.setdefault(key, []).append(req)
+        defer.returnValue(self.mergeGroups)
+
     @defer.inlineCallbacks
     def _getNextUnclaimedBuildRequest(self):
         # ensure the cache is there
@@ -315,6 +352,167 @@ class BasicBuildChooser(BuildChooserBase):
         return self.bldr.canStartBuild(slave, breq)
 
 
+class UnclaimedBuildRequests(object):
+
+    """
+    An in-memory view of the unclaimed build requests for each builder, so
+    that build choosers need not query the database every time they are
+    created.
+
+    A builder's view is read from the database the first time it is needed,
+    and is then kept up to date by L{buildRequestAdded},
+    L{buildRequestsClaimed} and L{invalidate}.  Requests claimed by other
+    masters are not announced, so each view is re-read after
+    C{refresh_interval} seconds; until then, claiming such a request fails
+    with L{AlreadyClaimedError}, and the caller should invalidate the view.
+
+    This also caches a summary of every builder's queue, read with a single
+    query, for use when prioritizing builders.
+    """
+
+    # seconds after which a builder's view is re-read from the database
+    refresh_interval = 60
+
+    # for testing
+    _reactor = None
+
+    def __init__(self, master):
+        self.master = master
+        # buildername -> (time fetched, {brid: brdict})
+        self._views = {}
+        # buildername -> list of Deferreds for requests being added
+        self._adding = {}
+        # names of builders whose view was invalidated while being fetched
+        self._stale = set()
+        # (time fetched, summaries) for all builders' queues, or None
+        self._summaries = None
+        # Deferreds waiting for the summaries being fetched, if any
+        self._summariesWaiters = None
+        # incremented whenever the summaries are invalidated
+        self._summariesGeneration = 0
+
+    @defer.inlineCallbacks
+    def getUnclaimedBrdicts(self, buildername):
+        """
+        Get the unclaimed build requests for a builder, oldest first.  The
+        caller may modify the list.
+
+        @returns: list of brdicts, via Deferred
+        """
+        # let any requests that have been announced make it into the view
+        while self._adding.get(buildername):
+            yield defer.DeferredList(list(self._adding[buildername]))
+
+        now = util.now(self._reactor)
+        view = self._views.get(buildername)
+        if view is None or now - view[0] >= self.refresh_interval:
+            self._views.pop(buildername, None)
+            self._stale.discard(buildername)
+            brdicts = yield self.master.db.buildrequests.getBuildRequests(
+                buildername=buildername, claimed=False)
+            view = (now, dict((brd['brid'], brd) for brd in brdicts))
+            if buildername in self._stale:
+                self._stale.discard(buildername)
+            else:
+                self._views[buildername] = view
+
+        brdicts = view[1].values()
+        # sort by submitted_at, so the first is the oldest
+        brdicts.sort(key=lambda brd: (brd['submitted_at'], brd['brid']))
+        defer.returnValue(brdicts)
+
+    def getQueueSummaries(self):
+        """
+        Get a summary of every builder's queue of unclaimed build requests,
+        as returned by the C{getUnclaimedBuildRequestSummaries} database
+        method.  The result must not be modified.
+
+        @returns: dictionary keyed by builder name, via Deferred
+        """
+        now = util.now(self._reactor)
+        if self._summaries and now - self._summaries[0] < self.refresh_interval:
+            return defer.succeed(self._summaries[1])
+
+        # share a single query among all callers
+        d = defer.Deferred()
+        if self._summariesWaiters is not None:
+            self._summariesWaiters.append(d)
+            return d
+        self._summariesWaiters = [d]
+        generation = self._summariesGeneration
+        fetch = defer.maybeDeferred(
+            self.master.db.buildrequests.getUnclaimedBuildRequestSummaries)
+
+        @fetch.addBoth
+        def fetched(res):
+            waiters, self._summariesWaiters = self._summariesWaiters, None
+            if isinstance(res, Failure):
+                for waiter in waiters:
+                    waiter.errback(res)
+                return
+            if generation == self._summariesGeneration:
+                self._summaries = (now, res)
+            for waiter in waiters:
+                waiter.callback(res)
+        return d
+
+    def _invalidateSummaries(self):
+        self._summaries = None
+        self._summariesGeneration += 1
+
+    def buildRequestAdded(self, buildername, brid):
+        """
+        Add a new, or newly unclaimed, build request to the builder's view.
+        """
+        self._invalidateSummaries()
+        if buildername not in self._views:
+            # the view will be read in full when it is needed; but if it is
+            # being read right now, that read may miss this request
+            self._stale.add(buildername)
+            return
+
+        adding = self._adding.setdefault(buildername, [])
+        d = self.master.db.buildrequests.getBuildRequest(brid)
+        adding.append(d)
+
+        @d.addCallback
+        def add(brdict):
+            view = self._views.get(buildername)
+            if view and brdict and not brdict['claimed']:
+                view[1][brid] = brdict
+
+        @d.addErrback
+        def failed(f):
+            log.err(f, "while adding build request %d" % (brid,))
+            self.invalidate(buildername)
+
+        @d.addBoth
+        def done(_):
+            adding.remove(d)
+            if not adding and self._adding.get(buildername) is adding:
+                del self._adding[buildername]
+
+    def buildRequestsClaimed(self, buildername, brids):
+        """
+        Remove build requests that this master has claimed from the
+        builder's view.
+        """
+        self._invalidateSummaries()
+        view = self._views.get(buildername)
+        if view:
+            for brid in brids:
+                view[1].pop(brid, None)
+
+    def invalidate(self, buildername):
+        """
+        Discard the builder's view, so that it is read from the database the
+        next time it is needed.
+        """
+        self._invalidateSummaries()
+        self._views.pop(buildername, None)
+        self._stale.add(buildername)
+
+
 class BuildRequestDistributor(service.Service):
 
     """
@@ -330,6 +528,13 @@ class BuildRequestDistributor(service.Service):
 
     BuildChooser = BasicBuildChooser
 
+    # number of builders whose builds may be started at the same time; this
+    # is set from the distributorConcurrency configuration by the botmaster
+    max_concurrency = 1
+
+    # for testing
+    _reactor = None
+
     def __init__(self, botmaster):
         self.botmaster = botmaster
         self.master = botmaster.master
@@ -343,8 +548,17 @@ class BuildRequestDistributor(service.Service):
         self.activity_lock = defer.DeferredLock()
         self.active = False
 
+        # builders currently being processed by the activity loop, mapping
+        # name to a Deferred that fires when the builder is finished
+        self._active_builders = {}
+        # Deferred that the activity loop is waiting on, if any
+        self._wakeup = None
+
         self._pendingMSBOCalls = []
 
+        # unclaimed build requests for each builder
+        self.unclaimedBuildRequests = UnclaimedBuildRequests(self.master)
+
     @defer.inlineCallbacks
     def stopService(self):
         # Lots of stuff happens asynchronously here, so we need to let it all
@@ -359,6 +573,10 @@ class BuildRequestDistributor(service.Service):
         if self._pendingMSBOCalls:
             yield defer.DeferredList(self._pendingMSBOCalls)
 
+        # and wait for any builders that are still being processed
+        if self._active_builders:
+            yield defer.DeferredList(self._active_builders.values())
+
     def maybeStartBuildsOn(self, new_builders):
         """
         Try to start any builds that can be started right now.  This function
@@ -380,6 +598,14 @@ class BuildRequestDistributor(service.Service):
             return x
         d.addErrback(log.err, "while strting builds on %s" % (new_builders,))
 
+    def buildRequestAdded(self, notif):
+        """
+        Called with the notification for a new, or newly unclaimed, build
+        request, before builds are started on its builder.
+        """
+        self.unclaimedBuildRequests.buildRequestAdded(notif['buildername'],
+                                                      notif['brid'])
+
     def _maybeStartBuildsOn(self, new_builders):
         new_builders = set(new_builders)
         existing_pending = set(self._pending_builders)
@@ -402,9 +628,11 @@ class BuildRequestDistributor(service.Service):
                         list(existing_pending | new_builders))
 
                 # start the activity loop, if we aren't already
-                # working on that.
+                # working on that; otherwise, let it look at the new builders
                 if not self.active:
                     self._activityLoop()
+                else:
+                    self._wake()
             except Exception:
                 log.err(Failure(),
                         "while attempting to start builds on %s" % self.name)
@@ -417,13 +645,17 @@ class BuildRequestDistributor(service.Service):
         timer = metrics.Timer("BuildRequestDistributor._defaultSorter()")
         timer.start()
         # perform an asynchronous schwarzian transform, transforming None
-        # into sys.maxint so that it sorts to the end
+        # into sys.maxint so that it sorts to the end.  Builders whose oldest
+        # requests are equally old are sorted by name, rather than by
+        # comparing the builders themselves, which would depend on where
+        # they are in memory.
 
         def xform(bldr):
             d = defer.maybeDeferred(lambda:
                                     bldr.getOldestRequestTime())
             d.addCallback(lambda time:
-                          (((time is None) and None or time), bldr))
+                          (((time is None) and None or time), bldr.name,
+                           bldr))
             return d
         xformed = yield defer.gatherResults(
             [xform(bldr) for bldr in builders])
@@ -439,7 +671,7 @@ class BuildRequestDistributor(service.Service):
         xformed.sort(cmp=nonecmp)
 
         # and reverse the transform
-        rv = [xf[1] for xf in xformed]
+        rv = [xf[2] for xf in xformed]
         timer.stop()
         defer.returnValue(rv)
 
@@ -482,27 +714,28 @@ class BuildRequestDistributor(service.Service):
         while True:
             yield self.activity_lock.acquire()
 
-            # lock pending_builders, pop an element from it, and release
+            # lock pending_builders, pop the builders that can be started now,
+            # and release
             yield self.pending_builders_lock.acquire()
 
             # bail out if we shouldn't keep looping
-            if not self.running or not self._pending_builders:
+            if not self.running or (not self._pending_builders
+                                    and not self._active_builders):
                 self.pending_builders_lock.release()
                 self.activity_lock.release()
                 break
 
-            bldr_name = self._pending_builders.pop(0)
+            bldrs = self._popStartableBuilders()
+            self._wakeup = defer.Deferred()
             self.pending_builders_lock.release()
 
-            # get the actual builder object
-            bldr = self.botmaster.builders.get(bldr_name)
-            try:
-                if bldr:
-                    yield self._maybeStartBuildsOnBuilder(bldr)
-            except Exception:
-                log.err(Failure(),
-                        "from maybeStartBuild for builder '%s'" % (bldr_name,))
+            for bldr in bldrs:
+                self._startBuilder(bldr)
 
+            # wait until a builder finishes or more builders are added
+            if self._active_builders and self._wakeup:
+                yield self._wakeup
+            self._wakeup = None
             self.activity_lock.release()
 
         timer.stop()
@@ -510,6 +743,67 @@ class BuildRequestDistributor(service.Service):
         self.active = False
         self._quiet()
 
+    def _wake(self):
+        d, self._wakeup = self._wakeup, None
+        if d:
+            d.callback(None)
+
+    def _popStartableBuilders(self):
+        # Remove and return the builders from the front of the (sorted)
+        # pending list that can be started now.  A builder is skipped if the
+        # concurrency limit is reached, or if it shares a slave or lock with a
+        # builder that is active or ahead of it in the list, so that such
+        # builders are still handled in priority order.
+        startable = []
+        remaining = []
+        blocked = set()
+        for bldr_name in self._active_builders:
+            blocked.update(self._builderResources(bldr_name))
+
+        for bldr_name in self._pending_builders:
+            bldr = self.botmaster.builders.get(bldr_name)
+            if not bldr:
+                continue
+            resources = self._builderResources(bldr_name)
+            if (len(self._active_builders) + len(startable)
+                    < self.max_concurrency and not resources & blocked):
+                startable.append(bldr)
+            else:
+                remaining.append(bldr_name)
+            blocked.update(resources)
+
+        self._pending_builders = remaining
+        return startable
+
+    def _builderResources(self, bldr_name):
+        resources = set([('builder', bldr_name)])
+        # with one builder at a time there is nothing to contend for
+        if self.max_concurrency <= 1:
+            return resources
+        bldr = self.botmaster.builders.get(bldr_name)
+        cfg = bldr and bldr.config
+        if cfg:
+            resources.update(('slave', slavename)
+                             for slavename in cfg.slavenames)
+            resources.update(('lock', getattr(lock, 'lockid', lock))
+                             for lock in cfg.locks)
+        return resources
+
+    def _startBuilder(self, bldr):
+        started = util.now(self._reactor)
+        d = defer.maybeDeferred(self._maybeStartBuildsOnBuilder, bldr)
+        d.addErrback(log.err,
+                     "from maybeStartBuild for builder '%s'" % (bldr.name,))
+        self._active_builders[bldr.name] = d
+
+        @d.addCallback
+        def done(_):
+            metrics.MetricHistogramEvent.log(
+                'BuildRequestDistributor.%s' % (bldr.name,),
+                util.now(self._reactor) - started)
+            del self._active_builders[bldr.name]
+            self._wake()
+
     @defer.inlineCallbacks
     def _maybeStartBuildsOnBuilder(self, bldr):
         # create a chooser to give us our next builds
@@ -527,23 +821,30 @@ class BuildRequestDistributor(service.Service):
             try:
                 yield self.master.db.buildrequests.claimBuildRequests(brids)
             except AlreadyClaimedError:
-                # some brids were already claimed, so start over
+                # some brids were already claimed, so start over with a fresh
+                # view of the unclaimed requests
+                self.unclaimedBuildRequests.invalidate(bldr.name)
                 bc = self.createBuildChooser(bldr, self.master)
                 continue
+            self.unclaimedBuildRequests.buildRequestsClaimed(bldr.name, brids)
 
             d = bldr.maybeStartBuild(slave, breqs)
             @defer.inlineCallbacks
             def checkBuildStart(buildStarted, slavename, buildername, brids):
                 if not buildStarted:
                     yield self.master.db.buildrequests.unclaimBuildRequests(brids)
+                    self.unclaimedBuildRequests.invalidate(buildername)
                     # and try starting builds again.  If we still have a working slave,
                     # then this may re-claim the same buildrequests
                     self.botmaster.maybeStartBuildsForBuilder(buildername)
             d.addCallback(checkBuildStart, slave.slave.slavename, bldr.name, brids)
 
     def createBuildChooser(self, bldr, master):
-        # just instantiate the build chooser requested
-        return self.BuildChooser(bldr, master)
+        # just instantiate the build chooser requested, and let it use our
+        # view of the unclaimed build requests
+        bc = self.BuildChooser(bldr, master)
+        bc.unclaimedBuildRequests = self.unclaimedBuildRequests
+        return bc
 
     def _quiet(self):
         # shim for tests
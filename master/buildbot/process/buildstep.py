@@ -359,6 +359,9 @@ class BuildStep(object, properties.PropertiesMixin):
             if not lock.isAvailable(self, access):
                 self._step_status.setWaitingForLocks(True)
                 log.msg("step %s waiting for lock %s" % (self, lock))
+                for other, _ in self.locks:
+                    if other is not lock:
+                        other.releaseReservation(self)
                 d = lock.waitUntilMaybeAvailable(self, access)
                 d.addCallback(self.acquireLocks)
                 self._acquiringLock = (lock, access, d)
@@ -43,6 +43,7 @@ from twisted.internet import reactor
 from twisted.internet.task import LoopingCall
 from twisted.python import log
 
+import bisect
 import gc
 import os
 import sys
@@ -75,6 +76,13 @@ class MetricTimeEvent(MetricEvent):
         self.timer = timer
         self.elapsed = elapsed
 
+
+class MetricHistogramEvent(MetricEvent):
+
+    def __init__(self, histogram, value):
+        self.histogram = histogram
+        self.value = value
+
 ALARM_OK, ALARM_WARN, ALARM_CRIT = range(3)
 ALARM_TEXT = ["OK", "WARN", "CRIT"]
 
@@ -174,6 +182,50 @@ class AveragingFiniteList(FiniteList):
         return self.average
 
 
+class Histogram(object):
+
+    """
+    A distribution of values, counted in fixed buckets.  The bucket bounds
+    suit durations in seconds.  Percentiles are estimated as the upper bound
+    of the bucket containing them.
+    """
+
+    BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+              1, 2, 5, 10, 20, 50)
+
+    def __init__(self):
+        # the last bucket counts values above all of the bounds
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        if not self.count:
+            return 0
+        return float(self.sum) / self.count
+
+    def percentile(self, pct):
+        target = self.count * pct / 100.0
+        seen = 0
+        for bound, count in zip(self.BOUNDS, self.buckets):
+            seen += count
+            if count and seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def asDict(self):
+        return dict(count=self.count, sum=self.sum, max=self.max,
+                    buckets=zip(self.BOUNDS + (None,), self.buckets))
+
+
 class MetricHandler(object):
 
     def __init__(self, metrics):
@@ -267,6 +319,38 @@ class MetricTimeHandler(MetricHandler):
         return dict(timers=retval)
 
 
+class MetricHistogramHandler(MetricHandler):
+    _histograms = None
+
+    def reset(self):
+        self._histograms = defaultdict(Histogram)
+
+    def handle(self, eventDict, metric):
+        self._histograms[metric.histogram].add(metric.value)
+
+    def keys(self):
+        return self._histograms.keys()
+
+    def get(self, histogram):
+        return self._histograms[histogram]
+
+    def report(self):
+        retval = []
+        for name in sorted(self.keys()):
+            h = self.get(name)
+            retval.append("Histogram %s: count=%i mean=%.3g p50=%.3g "
+                          "p95=%.3g p99=%.3g max=%.3g"
+                          % (name, h.count, h.mean, h.percentile(50),
+                             h.percentile(95), h.percentile(99), h.max))
+        return "\n".join(retval)
+
+    def asDict(self):
+        retval = {}
+        for name in sorted(self.keys()):
+            retval[name] = self.get(name).asDict()
+        return dict(histograms=retval)
+
+
 class MetricAlarmHandler(MetricHandler):
     _alarms = None
 
@@ -422,6 +506,8 @@ class MetricLogObserver(config.ReconfigurableServiceMixin,
         # Register our default handlers
         self.registerHandler(MetricCountEvent, MetricCountHandler(self))
         self.registerHandler(MetricTimeEvent, MetricTimeHandler(self))
+        self.registerHandler(MetricHistogramEvent,
+                             MetricHistogramHandler(self))
         self.registerHandler(MetricAlarmEvent, MetricAlarmHandler(self))
 
         # Make sure our changes poller is behaving
@@ -229,7 +229,6 @@ class BaseScheduler(service.MultiService, ComparableMixin, StateMixin):
 
     # starting builds
 
-    @defer.inlineCallbacks
     def addBuildsetForLatest(self, reason='', external_idstring=None,
                              branch=None, repository='', project='',
                              builderNames=None, properties=None):
@@ -255,32 +254,26 @@ class BaseScheduler(service.MultiService, ComparableMixin, StateMixin):
         @type properties: L{buildbot.process.properties.Properties}
         @returns: (buildset ID, buildrequest IDs) via Deferred
         """
-        # Define setid for this set of changed repositories
-        setid = yield self.master.db.sourcestampsets.addSourceStampSet()
-
         # add a sourcestamp for each codebase
+        sourcestamps = []
         for codebase, cb_info in self.codebases.iteritems():
             ss_repository = cb_info.get('repository', repository)
             ss_branch = cb_info.get('branch', branch)
             ss_revision = cb_info.get('revision', None)
-            yield self.master.db.sourcestamps.addSourceStamp(
+            sourcestamps.append(dict(
                 codebase=codebase,
                 repository=ss_repository,
                 branch=ss_branch,
                 revision=ss_revision,
                 project=project,
-                changeids=set(),
-                sourcestampsetid=setid)
+                changeids=set()))
 
-        bsid, brids = yield self.addBuildsetForSourceStamp(
-            setid=setid, reason=reason,
+        return self.addBuildsetForSourceStamps(
+            sourcestamps, reason=reason,
             external_idstring=external_idstring,
             builderNames=builderNames,
             properties=properties)
 
-        defer.returnValue((bsid, brids))
-
-    @defer.inlineCallbacks
     def addBuildsetForSourceStampDetails(self, reason='', external_idstring=None,
                                          branch=None, repository='', project='', revision=None,
                                          builderNames=None, properties=None):
@@ -302,39 +295,29 @@ class BaseScheduler(service.MultiService, ComparableMixin, StateMixin):
         @type properties: L{buildbot.process.properties.Properties}
         @returns: (buildset ID, buildrequest IDs) via Deferred
         """
-        # Define setid for this set of changed repositories
-        setid = yield self.master.db.sourcestampsets.addSourceStampSet()
-
-        yield self.master.db.sourcestamps.addSourceStamp(
-            branch=branch, revision=revision, repository=repository,
-            project=project, sourcestampsetid=setid)
-
-        rv = yield self.addBuildsetForSourceStamp(
-            setid=setid, reason=reason,
+        sourcestamps = [dict(branch=branch, revision=revision,
+                             repository=repository, project=project)]
+        return self.addBuildsetForSourceStamps(
+            sourcestamps, reason=reason,
             external_idstring=external_idstring,
             builderNames=builderNames,
             properties=properties)
-        defer.returnValue(rv)
 
-    @defer.inlineCallbacks
     def addBuildsetForSourceStampSetDetails(self, reason, sourcestamps,
                                             properties, builderNames=None):
         if sourcestamps is None:
             sourcestamps = {}
 
-        # Define new setid for this set of sourcestamps
-        new_setid = yield self.master.db.sourcestampsets.addSourceStampSet()
-
         # Merge codebases with the passed list of sourcestamps
         # This results in a new sourcestamp for each codebase
+        new_sourcestamps = []
         for codebase in self.codebases:
             ss = self.codebases[codebase].copy()
             # apply info from passed sourcestamps onto the configured default
             # sourcestamp attributes for this codebase.
             ss.update(sourcestamps.get(codebase, {}))
 
-            # add sourcestamp to the new setid
-            yield self.master.db.sourcestamps.addSourceStamp(
+            new_sourcestamps.append(dict(
                 codebase=codebase,
                 repository=ss.get('repository', ''),
                 branch=ss.get('branch', None),
@@ -344,16 +327,15 @@ class BaseScheduler(service.MultiService, ComparableMixin, StateMixin):
                 patch_body=ss.get('patch_body', None),
                 patch_level=ss.get('patch_level', None),
                 patch_author=ss.get('patch_author', None),
-                patch_comment=ss.get('patch_comment', None),
-                sourcestampsetid=new_setid)
+                patch_comment=ss.get('patch_comment', None)))
 
-        rv = yield self.addBuildsetForSourceStamp(
-            setid=new_setid, reason=reason,
+        # note that nothing above waits, so that buildsets added by a Trigger
+        # step for several schedulers are added to the database together
+        return self.addBuildsetForSourceStamps(
+            new_sourcestamps, reason=reason,
             properties=properties,
             builderNames=builderNames)
 
-        defer.returnValue(rv)
-
     def getCodebaseDict(self, codebase):
         # Hook for subclasses to change codebase parameters when a codebase does
         # not have a change associated with it.
@@ -367,17 +349,15 @@ class BaseScheduler(service.MultiService, ComparableMixin, StateMixin):
         def get_last_change_for_codebase(codebase):
             return max(changesByCodebase[codebase], key=lambda change: change["changeid"])
 
-        # Define setid for this set of changed repositories
-        setid = yield self.master.db.sourcestampsets.addSourceStampSet()
-
         # Changes are retrieved from database and grouped by their codebase
         for changeid in changeids:
             chdict = yield self.master.db.changes.getChange(changeid)
             # group change by codebase
             changesByCodebase.setdefault(chdict["codebase"], []).append(chdict)
 
+        sourcestamps = []
         for codebase in self.codebases:
-            args = {'codebase': codebase, 'sourcestampsetid': setid}
+            args = {'codebase': codebase}
             if codebase not in changesByCodebase:
                 # codebase has no changes
                 # create a sourcestamp that has no changes
@@ -394,12 +374,12 @@ class BaseScheduler(service.MultiService, ComparableMixin, StateMixin):
                 for key in ['repository', 'branch', 'revision', 'project']:
                     args[key] = lastChange[key]
 
-            yield self.master.db.sourcestamps.addSourceStamp(**args)
+            sourcestamps.append(args)
 
-        # add one buildset, this buildset is connected to the sourcestamps by the setid
-        bsid, brids = yield self.addBuildsetForSourceStamp(setid=setid,
-                                                           reason=reason, external_idstring=external_idstring,
-                                                           builderNames=builderNames, properties=properties)
+        # add one buildset, with a new set of the sourcestamps
+        bsid, brids = yield self.addBuildsetForSourceStamps(
+            sourcestamps, reason=reason, external_idstring=external_idstring,
+            builderNames=builderNames, properties=properties)
 
         defer.returnValue((bsid, brids))
 
@@ -428,19 +408,8 @@ class BaseScheduler(service.MultiService, ComparableMixin, StateMixin):
         assert (ssid is None and setid is not None) \
             or (ssid is not None and setid is None), "pass a single sourcestamp OR set not both"
 
-        # combine properties
-        if properties:
-            properties.updateFromProperties(self.properties)
-        else:
-            properties = self.properties
-
-        # apply the default builderNames
-        if not builderNames:
-            builderNames = self.builderNames
-
-        # translate properties object into a dict as required by the
-        # addBuildset method
-        properties_dict = properties.asDict()
+        properties_dict, builderNames = \
+            self._getBuildsetArgs(properties, builderNames)
 
         if setid is None:
             if ssid is not None:
@@ -455,3 +424,54 @@ class BaseScheduler(service.MultiService, ComparableMixin, StateMixin):
                                            builderNames=builderNames,
                                            external_idstring=external_idstring)
         defer.returnValue(rv)
+
+    def addBuildsetForSourceStamps(self, sourcestamps, reason='',
+                                   external_idstring=None, properties=None,
+                                   builderNames=None):
+        """
+        Add a buildset for a new set of sourcestamps.  The sourcestamps are
+        added along with the buildset, in the same database transaction as
+        any other buildsets added at the same time (see
+        L{BuildMaster.addBuildsets}).
+
+        This method will add any properties provided to the scheduler
+        constructor to the buildset.
+
+        @param sourcestamps: the sourcestamps to build, each a dictionary of
+            keyword arguments to
+            L{SourceStampsConnectorComponent.addSourceStamp}, without
+            C{sourcestampsetid}
+        @param reason: reason for this buildset
+        @type reason: unicode string
+        @param external_idstring: external identifier for this buildset, or None
+        @param properties: a properties object containing initial properties for
+            the buildset
+        @type properties: L{buildbot.process.properties.Properties}
+        @param builderNames: builders to name in the buildset (defaults to
+            C{self.builderNames})
+        @returns: (buildset ID, buildrequest IDs) via Deferred
+        """
+        properties_dict, builderNames = \
+            self._getBuildsetArgs(properties, builderNames)
+
+        d = self.master.addBuildsets([dict(
+            sourcestamps=sourcestamps, reason=reason,
+            properties=properties_dict, builderNames=builderNames,
+            external_idstring=external_idstring)])
+        d.addCallback(lambda results: results[0])
+        return d
+
+    def _getBuildsetArgs(self, properties, builderNames):
+        # combine properties
+        if properties:
+            properties.updateFromProperties(self.properties)
+        else:
+            properties = self.properties
+
+        # apply the default builderNames
+        if not builderNames:
+            builderNames = self.builderNames
+
+        # translate properties object into a dict as required by the
+        # addBuildset method
+        return properties.asDict(), builderNames
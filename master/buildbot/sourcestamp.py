@@ -207,6 +207,18 @@ class SourceStamp(util.ComparableMixin, styles.Versioned):
 
         return False
 
+    def getMergeKey(self):
+        """Return a hashable key such that two SourceStamps can be merged
+        (as defined by L{canBeMergedWith}) if and only if their keys are
+        equal."""
+        if self.patch:
+            # patched sourcestamps only merge with themselves
+            return ('patch', id(self))
+        key = (self.codebase, self.repository, self.branch, self.project)
+        if self.changes:
+            return key + (True,)
+        return key + (False, self.revision)
+
     def mergeWith(self, others):
         """Generate a SourceStamp for the merger of me and all the other
         SourceStamps. This is called by a Build when it starts, to figure
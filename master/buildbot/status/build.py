@@ -13,24 +13,20 @@
 #
 # Copyright Buildbot Team Members
 
-from __future__ import with_statement
-
-import os
 import re
-import shutil
 
 from buildbot import interfaces
 from buildbot import sourcestamp
 from buildbot import util
 from buildbot.process import properties
 from buildbot.status.buildstep import BuildStepStatus
-from cPickle import dump
+from cPickle import dumps
+from cPickle import loads
 from twisted.internet import defer
 from twisted.internet import reactor
 from twisted.persisted import styles
 from twisted.python import components
 from twisted.python import log
-from twisted.python import runtime
 from zope.interface import implements
 
 
@@ -40,7 +36,7 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
     persistenceVersion = 4
     persistenceForgets = ('wasUpgraded', )
 
-    sources = None
+    sources = []
     reason = None
     changes = []
     blamelist = []
@@ -199,6 +195,8 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
         return eta - util.now()
 
     def getCurrentStep(self):
+        if '_currentStepNumber' in self.__dict__:
+            self._loadSteps()
         return self.currentStep
 
     # Once you know the build has finished, the following methods are legal.
@@ -389,6 +387,14 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
                   'master']:
             if k in d:
                 del d[k]
+        # the steps (and their logs) make up most of a build, so they are
+        # pickled separately and only unpickled when someone asks for them;
+        # a build whose steps were never loaded keeps its original pickle.
+        if 'steps' in d:
+            steps = d.pop('steps')
+            d['_pickledSteps'] = dumps(steps, -1)
+            if d.get('currentStep') in steps:
+                d['_currentStepNumber'] = steps.index(d.pop('currentStep'))
         return d
 
     def __setstate__(self, d):
@@ -397,11 +403,40 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
         self.updates = {}
         self.finishedWatchers = []
 
+    def __getattr__(self, name):
+        # only called for attributes that are not set; see __getstate__
+        if name == 'steps' and '_pickledSteps' in self.__dict__:
+            self._loadSteps()
+            return self.__dict__['steps']
+        raise AttributeError(name)
+
+    def _loadSteps(self):
+        steps = loads(self.__dict__.pop('_pickledSteps'))
+        self.steps = steps
+        if '_currentStepNumber' in self.__dict__:
+            self.currentStep = steps[self.__dict__.pop('_currentStepNumber')]
+
+        versioneds = styles.versionedsToUpgrade
+        styles.doUpgrade()
+        if 'builder' not in self.__dict__:
+            # setProcessObjects will finish the job
+            return
+
+        for step in steps:
+            step.setProcessObjects(self, self.master)
+        # as in BuilderStatus.setupLoadedBuild
+        if True in [hasattr(o, 'wasUpgraded') for o in versioneds.values()]:
+            log.msg("re-writing upgraded build pickle")
+            self.saveYourself()
+        self.checkLogfiles()
+
     def setProcessObjects(self, builder, master):
         self.builder = builder
         self.master = master
-        for step in self.steps:
-            step.setProcessObjects(self, master)
+        # steps that are still pickled are set up when they are loaded
+        if 'steps' in self.__dict__:
+            for step in self.steps:
+                step.setProcessObjects(self, master)
 
     def upgradeToVersion1(self):
         if hasattr(self, "sourceStamp"):
@@ -438,30 +473,13 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
     def checkLogfiles(self):
         # check that all logfiles exist, and remove references to any that
         # have been deleted (e.g., by purge())
+        if 'steps' not in self.__dict__:
+            return  # checked when the steps are loaded
         for s in self.steps:
             s.checkLogfiles()
 
     def saveYourself(self):
-        filename = os.path.join(self.builder.basedir, "%d" % self.number)
-        if os.path.isdir(filename):
-            # leftover from 0.5.0, which stored builds in directories
-            shutil.rmtree(filename, ignore_errors=True)
-        tmpfilename = filename + ".tmp"
-        try:
-            with open(tmpfilename, "wb") as f:
-                dump(self, f, -1)
-            if runtime.platformType == 'win32':
-                # windows cannot rename a file on top of an existing one, so
-                # fall back to delete-first. There are ways this can fail and
-                # lose the builder's history, so we avoid using it in the
-                # general (non-windows) case
-                if os.path.exists(filename):
-                    os.unlink(filename)
-            os.rename(tmpfilename, filename)
-        except:
-            log.msg("unable to save build %s-#%d" % (self.builder.name,
-                                                     self.number))
-            log.err()
+        self.builder.getStatusWriter().saveBuild(self)
 
     def asDict(self):
         result = {}
@@ -18,20 +18,20 @@ from __future__ import with_statement
 
 import itertools
 import os
-import re
-
-from cPickle import dump
-from cPickle import load
 
 from buildbot import interfaces
 from buildbot import util
+from buildbot.status import buildhistory
+from buildbot.status import persistence
 from buildbot.status.build import BuildStatus
 from buildbot.status.buildrequest import BuildRequestStatus
 from buildbot.status.event import Event
 from buildbot.util.lru import LRUCache
+from twisted.internet import defer
+from twisted.internet import threads
 from twisted.persisted import styles
+from twisted.python import failure
 from twisted.python import log
-from twisted.python import runtime
 from zope.interface import implements
 
 # user modules expect these symbols to be present here
@@ -75,6 +75,13 @@ class BuilderStatus(styles.Versioned):
     tags = None
     currentBigState = "offline"  # or idle/waiting/interlocked/building
     basedir = None  # filled in by our parent
+    buildStore = None  # opened on first use; see getBuildStore
+    statusWriter = None  # filled in by our parent; see getStatusWriter
+
+    # when getBuildAsync has to load a build, also load this many of the
+    # builds before it, since a page walking back through the history is
+    # likely to want them next
+    buildPrefetch = 4
 
     def __init__(self, buildername, tags, master, description):
         self.name = buildername
@@ -93,6 +100,7 @@ class BuilderStatus(styles.Versioned):
         self.nextBuild = None
         self.watchers = []
         self.buildCache = LRUCache(self.cacheMiss)
+        self.buildLoads = {}
 
     # persistence
 
@@ -104,6 +112,9 @@ class BuilderStatus(styles.Versioned):
         d = styles.Versioned.__getstate__(self)
         d['watchers'] = []
         del d['buildCache']
+        del d['buildLoads']
+        d.pop('buildStore', None)
+        d.pop('statusWriter', None)
         for b in self.currentBuilds:
             b.saveYourself()
             # TODO: push a 'hey, build was interrupted' event
@@ -121,6 +132,7 @@ class BuilderStatus(styles.Versioned):
         # upgradeToVersion1 and such will be called after this finishes.
         styles.Versioned.__setstate__(self, d)
         self.buildCache = LRUCache(self.cacheMiss)
+        self.buildLoads = {}
         self.currentBuilds = []
         self.watchers = []
         self.slavenames = []
@@ -142,17 +154,41 @@ class BuilderStatus(styles.Versioned):
             del self.category
         self.wasUpgraded = True
 
+    def getBuildStore(self):
+        """Return the store holding our saved BuildStatus instances, opening
+        it the first time it is needed.  The kind of store is chosen by
+        c['buildHistoryStore'] when it is opened."""
+        if self.buildStore is None:
+            self.buildStore = buildhistory.makeStore(
+                self.master.config.buildHistoryStore, self.basedir)
+        return self.buildStore
+
+    def getStatusWriter(self):
+        """Return the writer that saves our pickles, and those of our builds.
+        Without one from our parent (as in tests), a writer that saves them
+        immediately is used."""
+        if self.statusWriter is None:
+            self.statusWriter = persistence.StatusWriter()
+        return self.statusWriter
+
     def determineNextBuildNumber(self):
-        """Scan our directory of saved BuildStatus instances to determine
+        """Look in our store of saved BuildStatus instances to determine
         what our self.nextBuildNumber should be. Set it one larger than the
         highest-numbered build we discover. This is called by the top-level
         Status object shortly after we are created or loaded from disk.
         """
-        existing_builds = [int(f)
-                           for f in os.listdir(self.basedir)
-                           if re.match(r"^\d+$", f)]
-        if existing_builds:
-            self.nextBuildNumber = max(existing_builds) + 1
+        store = self.getBuildStore()
+        last = store.getLastBuildNumber()
+        if not isinstance(store, buildhistory.PickleDirectoryStore):
+            # build pickles left in the directory, such as those that could
+            # not be copied into the store, still own their numbers and
+            # logfiles
+            lastPickle = buildhistory.PickleDirectoryStore(
+                self.basedir).getLastBuildNumber()
+            if last is None or lastPickle > last:
+                last = lastPickle
+        if last is not None:
+            self.nextBuildNumber = last + 1
         else:
             self.nextBuildNumber = 0
 
@@ -162,19 +198,7 @@ class BuilderStatus(styles.Versioned):
                 # interrupted build, need to save it anyway.
                 # BuildStatus.saveYourself will mark it as interrupted.
                 b.saveYourself()
-        filename = os.path.join(self.basedir, "builder")
-        tmpfilename = filename + ".tmp"
-        try:
-            with open(tmpfilename, "wb") as f:
-                dump(self, f, -1)
-            if runtime.platformType == 'win32':
-                # windows cannot rename a file on top of an existing one
-                if os.path.exists(filename):
-                    os.unlink(filename)
-            os.rename(tmpfilename, filename)
-        except:
-            log.msg("unable to save builder %s" % self.name)
-            log.err()
+        self.getStatusWriter().saveBuilder(self)
 
     # build cache management
 
@@ -188,32 +212,98 @@ class BuilderStatus(styles.Versioned):
         return self.buildCache.get(number)
 
     def loadBuildFromFile(self, number):
-        filename = self.makeBuildFilename(number)
-        try:
-            log.msg("Loading builder %s's build %d from on-disk pickle"
-                    % (self.name, number))
-            with open(filename, "rb") as f:
-                build = load(f)
-            build.setProcessObjects(self, self.master)
-
-            # (bug #1068) if we need to upgrade, we probably need to rewrite
-            # this pickle, too.  We determine this by looking at the list of
-            # Versioned objects that have been unpickled, and (after doUpgrade)
-            # checking to see if any of them set wasUpgraded.  The Versioneds'
-            # upgradeToVersionNN methods all set this.
-            versioneds = styles.versionedsToUpgrade
-            styles.doUpgrade()
-            if True in [hasattr(o, 'wasUpgraded') for o in versioneds.values()]:
-                log.msg("re-writing upgraded build pickle")
-                build.saveYourself()
-
-            # check that logfiles exist
-            build.checkLogfiles()
-            return build
-        except IOError:
-            raise IndexError("no such build %d" % number)
-        except EOFError:
-            raise IndexError("corrupted build pickle %d" % number)
+        log.msg("Loading builder %s's build %d from on-disk pickle"
+                % (self.name, number))
+        # raises IndexError if there is no such build
+        build = self.getBuildStore().loadBuild(number)
+        return self.setupLoadedBuild(build)
+
+    def setupLoadedBuild(self, build):
+        """Finish loading a build that has just been unpickled"""
+        build.setProcessObjects(self, self.master)
+
+        # (bug #1068) if we need to upgrade, we probably need to rewrite
+        # this pickle, too.  We determine this by looking at the list of
+        # Versioned objects that have been unpickled, and (after doUpgrade)
+        # checking to see if any of them set wasUpgraded.  The Versioneds'
+        # upgradeToVersionNN methods all set this.
+        versioneds = styles.versionedsToUpgrade
+        styles.doUpgrade()
+        if True in [hasattr(o, 'wasUpgraded') for o in versioneds.values()]:
+            log.msg("re-writing upgraded build pickle")
+            build.saveYourself()
+
+        # check that logfiles exist
+        build.checkLogfiles()
+        return build
+
+    def loadBuildInThread(self, number):
+        """Load a build from our store, reading it in a thread, returning a
+        Deferred that fires with the build, or with None if there is no such
+        build.  Concurrent loads of the same build share a single read.
+
+        Only the read happens in the thread: the build is unpickled on the
+        reactor, because unpickling registers its Versioned objects in
+        C{styles.versionedsToUpgrade}, which C{styles.doUpgrade} empties."""
+        d = defer.Deferred()
+        if number in self.buildLoads:
+            self.buildLoads[number].append(d)
+        else:
+            self.buildLoads[number] = [d]
+            load = threads.deferToThread(self.getBuildStore().readBuild,
+                                         number)
+            load.addBoth(self._buildLoadedInThread, number)
+        return d
+
+    def _buildLoadedInThread(self, result, number):
+        waiters = self.buildLoads.pop(number)
+        build = self.buildCache.weakrefs.get(number)
+        if build is not None:
+            # it was loaded some other way in the meantime; stick with that
+            # copy
+            result = build
+        elif isinstance(result, failure.Failure):
+            if result.check(IndexError):
+                result = None
+        else:
+            try:
+                result = self.setupLoadedBuild(
+                    buildhistory.unpickleBuild(number, result))
+                self.buildCache.put(number, result)
+            except IndexError:
+                result = None
+            except:
+                result = failure.Failure()
+
+        for d in waiters:
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def getBuildAsync(self, number):
+        """Like L{getBuild}, but return a Deferred, and load a build that is
+        not in memory in a thread so that the reactor is not blocked while
+        it is read and unpickled.  A few of the builds before it are loaded
+        in the background, too; see C{buildPrefetch}."""
+        if number < 0:
+            number = self.nextBuildNumber + number
+        if number < 0 or number >= self.nextBuildNumber:
+            return defer.succeed(None)
+
+        if number in self.buildCache.weakrefs:
+            return defer.succeed(self.getBuild(number))
+
+        d = self.loadBuildInThread(number)
+
+        for prefetch in range(number - 1,
+                              max(number - 1 - self.buildPrefetch, -1), -1):
+            if (prefetch in self.buildCache.weakrefs
+                    or prefetch in self.buildLoads):
+                continue
+            self.loadBuildInThread(prefetch).addErrback(
+                log.err, "while prefetching build %d" % prefetch)
+        return d
 
     def cacheMiss(self, number, **kwargs):
         # If kwargs['val'] exists, this is a new value being added to
@@ -256,37 +346,9 @@ class BuilderStatus(styles.Versioned):
         if earliest_build == 0:
             return
 
-        # skim the directory and delete anything that shouldn't be there anymore
-        build_re = re.compile(r"^([0-9]+)$")
-        build_log_re = re.compile(r"^([0-9]+)-.*$")
-        # if the directory doesn't exist, bail out here
-        if not os.path.exists(self.basedir):
-            return
-
-        for filename in os.listdir(self.basedir):
-            num = None
-            mo = build_re.match(filename)
-            is_logfile = False
-            if mo:
-                num = int(mo.group(1))
-            else:
-                mo = build_log_re.match(filename)
-                if mo:
-                    num = int(mo.group(1))
-                    is_logfile = True
-
-            if num is None:
-                continue
-            if num in self.buildCache.cache:
-                continue
-
-            if (is_logfile and num < earliest_log) or num < earliest_build:
-                pathname = os.path.join(self.basedir, filename)
-                log.msg("pruning '%s'" % pathname)
-                try:
-                    os.unlink(pathname)
-                except OSError:
-                    pass
+        # leave the builds we have in memory alone
+        self.getBuildStore().pruneBuilds(earliest_build, earliest_log,
+                                         keep=self.buildCache.cache)
 
     # IBuilderStatus methods
     def getName(self):
@@ -355,14 +417,36 @@ class BuilderStatus(styles.Versioned):
     def getBuildByRevision(self, rev):
         number = self.nextBuildNumber - 1
         while number > 0:
-            build = self.getBuildByNumber(number)
-            got_revision = build.getAllGotRevisions().get("")
-
-            if rev == got_revision:
-                return build
+            summary = self.getBuildSummary(number)
+            if summary is not None and summary['revisions'].get("") == rev:
+                return self.getBuildByNumber(number)
             number -= 1
         return None
 
+    def getBuildSummary(self, number):
+        """Return the summary of build C{number} (as made by
+        L{buildhistory.summarizeBuild}), or None if there is no such build.
+        The summary is read from the build-history index when the build was
+        saved with one, so that the build itself need not be loaded."""
+        if number < 0:
+            number = self.nextBuildNumber + number
+        if number < 0 or number >= self.nextBuildNumber:
+            return None
+
+        build = self.buildCache.cache.get(number)
+        if build is None:
+            for b in self.currentBuilds:
+                if b.number == number:
+                    build = b
+        if build is None:
+            summary = self.getBuildStore().getSummary(number)
+            if summary is not None:
+                return summary
+            build = self.getBuild(number)
+            if build is None:
+                return None
+        return buildhistory.summarizeBuild(build)
+
     def getBuild(self, number, revision=None):
         if revision is not None:
             return self.getBuildByRevision(revision)
@@ -383,10 +467,6 @@ class BuilderStatus(styles.Versioned):
         except IndexError:
             return None
 
-    def _getBuildBranches(self, build):
-        return set([ss.branch
-                    for ss in build.getSourceStamps()])
-
     def generateFinishedBuilds(self, branches=[],
                                num_builds=None,
                                max_buildnum=None,
@@ -401,25 +481,29 @@ class BuilderStatus(styles.Versioned):
                 break
             if Nb > max_search:
                 break
-            build = self.getBuild(-Nb)
-            if build is None:
+            # filter on the build's summary, so that only the builds we
+            # return need to be loaded
+            summary = self.getBuildSummary(-Nb)
+            if summary is None:
                 continue
             if max_buildnum is not None:
-                if build.getNumber() > max_buildnum:
+                if summary['number'] > max_buildnum:
                     continue
-            if not build.isFinished():
+            if summary['finished'] is None:
                 continue
             if finished_before is not None:
-                start, end = build.getTimes()
-                if end >= finished_before:
+                if summary['finished'] >= finished_before:
                     continue
             # if we were asked to filter on branches, and none of the
             # sourcestamps match, skip this build
-            if branches and not branches & self._getBuildBranches(build):
+            if branches and not branches & set(summary['branches']):
                 continue
             if results is not None:
-                if build.getResults() not in results:
+                if summary['results'] not in results:
                     continue
+            build = self.getBuild(-Nb)
+            if build is None:
+                continue
             if filter_fn is not None:
                 if not filter_fn(build):
                     continue
@@ -447,21 +531,28 @@ class BuilderStatus(styles.Versioned):
         e = self.getEvent(eventIndex)
         branches = set(branches)
         for Nb in range(1, self.nextBuildNumber + 1):
-            b = self.getBuild(-Nb)
-            if not b:
+            summary = self.getBuildSummary(-Nb)
+            if not summary:
                 # HACK: If this is the first build we are looking at, it is
                 # possible it's in progress but locked before it has written a
                 # pickle; in this case keep looking.
                 if Nb == 1:
                     continue
                 break
-            if b.getTimes()[0] < minTime:
+            if summary['started'] < minTime:
                 break
             # if we were asked to filter on branches, and none of the
             # sourcestamps match, skip this build
-            if branches and not branches & self._getBuildBranches(b):
+            if branches and not branches & set(summary['branches']):
+                continue
+            if categories and not self.matchesAnyTag(tags=categories):
                 continue
-            if categories and not b.getBuilder().matchesAnyTag(tags=categories):
+            # every committer is in the blamelist, so only builds with one of
+            # them in the blamelist need to be loaded to check their changes
+            if committers and not set(committers) & set(summary['blamelist']):
+                continue
+            b = self.getBuild(-Nb)
+            if not b:
                 continue
             if committers and not [True for c in b.getChanges() if c.who in committers]:
                 continue
@@ -0,0 +1,631 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Build history stores: where a BuilderStatus keeps its finished builds.
+
+A store maps build numbers to pickled BuildStatus instances.  The stores do
+not know about the status hierarchy: the BuilderStatus that owns a store is
+responsible for setting up and upgrading the builds it loads.  Builds are
+saved in two steps: L{serializeBuild} pickles a build on the reactor, and
+the store's C{writeBuilds} writes a batch of serialized builds.  They are
+loaded in two steps, too: the store's C{readBuild} reads a pickled build, and
+L{unpickleBuild} unpickles it on the reactor, since unpickling registers
+Versioned objects for the reactor's C{styles.doUpgrade}.  Only C{readBuild}
+and C{writeBuilds} may be called from a thread other than the reactor's.
+"""
+
+from __future__ import with_statement
+
+import os
+import re
+import shutil
+import threading
+
+from cPickle import UnpicklingError
+from cPickle import dump
+from cPickle import dumps
+from cPickle import load
+from cPickle import loads
+
+from buildbot import util
+from twisted.persisted import styles
+from twisted.python import log
+from twisted.python import runtime
+
+
+def summarizeBuild(build):
+    """Return the summary of C{build} that is kept in a build-history index:
+    a dictionary with keys C{number}, C{started}, C{finished}, C{results},
+    C{text}, C{branches} (of its sourcestamps), C{revisions} (the
+    C{got_revision} of each codebase), C{slavename} and C{blamelist}.  This
+    is enough to filter builds without loading them."""
+    started, finished = build.getTimes()
+    return dict(number=build.getNumber(),
+                started=started,
+                finished=finished,
+                results=build.getResults(),
+                text=build.getText(),
+                branches=[ss.branch for ss in build.getSourceStamps()],
+                revisions=build.getAllGotRevisions(),
+                slavename=build.getSlavename(),
+                blamelist=build.getResponsibleUsers())
+
+
+def _summarizeSavedBuild(build):
+    summary = summarizeBuild(build)
+    if not summary['finished']:
+        # an unfinished build is saved as finished now; see
+        # BuildStatus.__getstate__
+        summary['finished'] = util.now()
+    return summary
+
+
+def unpickleBuild(number, data):
+    """Unpickle build C{number} from C{data}, as read by a store's
+    C{readBuild}, raising IndexError if it is corrupted."""
+    try:
+        return loads(data)
+    except (EOFError, UnpicklingError):
+        raise IndexError("corrupted build pickle %d" % number)
+
+
+def getBuildLogfiles(build):
+    """Return the builder-relative filenames of C{build}'s logfiles"""
+    return [l.filename
+            for step in build.getSteps()
+            for l in step.getLogs()
+            if l.filename]
+
+
+def serializeBuild(build):
+    """Return C{build} serialized for a store's C{writeBuilds}: a tuple
+    C{(number, pickle, logfiles, summary)}"""
+    return (build.number, dumps(build, -1), getBuildLogfiles(build),
+            _summarizeSavedBuild(build))
+
+
+def _replace(tmpfilename, filename):
+    if runtime.platformType == 'win32':
+        # windows cannot rename a file on top of an existing one, so
+        # fall back to delete-first. There are ways this can fail and
+        # lose the builder's history, so we avoid using it in the
+        # general (non-windows) case
+        if os.path.exists(filename):
+            os.unlink(filename)
+    os.rename(tmpfilename, filename)
+
+
+def writeFile(filename, data):
+    """Replace C{filename} with a file containing C{data}, so that a crash
+    leaves either the old or the new file"""
+    tmpfilename = filename + ".tmp"
+    with open(tmpfilename, "wb") as f:
+        f.write(data)
+    _replace(tmpfilename, filename)
+
+
+def _readRecords(filename):
+    """Return the pickled records in C{filename}, discarding (and truncating
+    the file to remove) a partly-written record at its end."""
+    records = []
+    with open(filename, "rb") as f:
+        good = 0
+        while True:
+            try:
+                records.append(load(f))
+            except EOFError:
+                break
+            except (UnpicklingError, ValueError, TypeError,
+                    AttributeError, IndexError):
+                break
+            good = f.tell()
+        f.seek(0, 2)
+        truncated = f.tell() > good
+    if truncated:
+        log.msg("discarding incomplete record at the end of %s" % filename)
+        with open(filename, "r+b") as f:
+            f.truncate(good)
+    return records
+
+
+def _removeLogfiles(basedir, filenames):
+    for filename in filenames:
+        pathname = os.path.join(basedir, filename)
+        for suffix in ('', '.bz2', '.gz'):
+            try:
+                os.unlink(pathname + suffix)
+            except OSError:
+                pass
+
+
+class PickleDirectoryStore(object):
+
+    """I keep each build in a pickle of its own, named after the build
+    number, in the builder's directory.  This is the traditional layout, and
+    the logfiles of a build live alongside it.
+
+    The summaries of the builds are appended, as pickled C{('summary',
+    number, summary)} and C{('drop', numbers)} records, to a separate file
+    that is read when a summary is first needed.  Builds saved before this
+    file existed have no summary."""
+
+    summariesFilename = "summaries.idx"
+
+    # rewrite the summaries file once it holds more than this many dropped
+    # summaries, and more dropped summaries than live ones
+    summaryCompactionMinimum = 1000
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+        self.summaries = None
+        self.deadSummaries = 0
+        self._summaryFile = None
+        # held while the summaries are read or changed, so builds can be
+        # written in a thread
+        self._lock = threading.Lock()
+
+    def makeBuildFilename(self, number):
+        return os.path.join(self.basedir, "%d" % number)
+
+    def getBuildNumbers(self):
+        if not os.path.isdir(self.basedir):
+            return []
+        return sorted(int(f)
+                      for f in os.listdir(self.basedir)
+                      if re.match(r"^\d+$", f))
+
+    def getLastBuildNumber(self):
+        numbers = self.getBuildNumbers()
+        if numbers:
+            return numbers[-1]
+        return None
+
+    def readBuild(self, number):
+        try:
+            with open(self.makeBuildFilename(number), "rb") as f:
+                return f.read()
+        except IOError:
+            raise IndexError("no such build %d" % number)
+
+    def loadBuild(self, number):
+        return unpickleBuild(number, self.readBuild(number))
+
+    def _summariesFilename(self):
+        return os.path.join(self.basedir, self.summariesFilename)
+
+    def _getSummaries(self):
+        with self._lock:
+            if self.summaries is None:
+                self.summaries = {}
+                filename = self._summariesFilename()
+                if os.path.exists(filename):
+                    for record in _readRecords(filename):
+                        self._applySummaryRecord(record)
+        return self.summaries
+
+    def _applySummaryRecord(self, record):
+        if record[0] == 'summary':
+            number, summary = record[1:]
+            if number in self.summaries:
+                self.deadSummaries += 1
+            self.summaries[number] = summary
+        elif record[0] == 'drop':
+            for number in record[1]:
+                if self.summaries.pop(number, None) is not None:
+                    self.deadSummaries += 1
+
+    def _appendSummaryRecords(self, records):
+        self._getSummaries()
+        with self._lock:
+            if self._summaryFile is None:
+                self._summaryFile = open(self._summariesFilename(), "ab")
+            for record in records:
+                dump(record, self._summaryFile, -1)
+            self._summaryFile.flush()
+            for record in records:
+                self._applySummaryRecord(record)
+
+    def _compactSummaries(self):
+        filename = self._summariesFilename()
+        tmpfilename = filename + ".tmp"
+        with self._lock:
+            with open(tmpfilename, "wb") as f:
+                for number in sorted(self.summaries):
+                    dump(('summary', number, self.summaries[number]), f, -1)
+            self.close()
+            _replace(tmpfilename, filename)
+            self.deadSummaries = 0
+
+    def getSummary(self, number):
+        return self._getSummaries().get(number)
+
+    def saveBuild(self, build):
+        self.writeBuilds([serializeBuild(build)])
+
+    def writeBuilds(self, builds):
+        for number, data, logfiles, summary in builds:
+            filename = self.makeBuildFilename(number)
+            if os.path.isdir(filename):
+                # leftover from 0.5.0, which stored builds in directories
+                shutil.rmtree(filename, ignore_errors=True)
+            writeFile(filename, data)
+        self._appendSummaryRecords([('summary', number, summary)
+                                    for number, _, _, summary in builds])
+
+    def removeBuild(self, number):
+        try:
+            os.unlink(self.makeBuildFilename(number))
+        except OSError:
+            pass
+        if number in self._getSummaries():
+            self._appendSummaryRecords([('drop', [number])])
+
+    def pruneBuilds(self, earliest_build, earliest_log, keep=()):
+        # skim the directory and delete anything that shouldn't be there
+        # anymore
+        build_re = re.compile(r"^([0-9]+)$")
+        build_log_re = re.compile(r"^([0-9]+)-.*$")
+        # if the directory doesn't exist, bail out here
+        if not os.path.exists(self.basedir):
+            return
+
+        summaries = self._getSummaries()
+        dropped = []
+        for filename in os.listdir(self.basedir):
+            num = None
+            mo = build_re.match(filename)
+            is_logfile = False
+            if mo:
+                num = int(mo.group(1))
+            else:
+                mo = build_log_re.match(filename)
+                if mo:
+                    num = int(mo.group(1))
+                    is_logfile = True
+
+            if num is None:
+                continue
+            if num in keep:
+                continue
+
+            if (is_logfile and num < earliest_log) or num < earliest_build:
+                pathname = os.path.join(self.basedir, filename)
+                log.msg("pruning '%s'" % pathname)
+                try:
+                    os.unlink(pathname)
+                except OSError:
+                    pass
+                if not is_logfile and num in summaries:
+                    dropped.append(num)
+
+        if dropped:
+            self._appendSummaryRecords([('drop', sorted(dropped))])
+        if (self.deadSummaries > len(self.summaries)
+                and self.deadSummaries > self.summaryCompactionMinimum):
+            self._compactSummaries()
+
+    def close(self):
+        if self._summaryFile is not None:
+            self._summaryFile.close()
+            self._summaryFile = None
+
+
+class IndexedBuildStore(object):
+
+    """I keep all of a builder's builds appended to a single data file, and
+    an index of them in a second, also append-only, file.
+
+    Each index record is a pickled tuple; the index is read into memory when
+    the store is opened, and the last record for a build number wins:
+
+     - C{('data', generation)} names the data file, C{builds-<generation>.dat}
+     - C{('build', number, offset, length, logfiles, summary)} locates a build
+       in the data file, and carries its logfile names and summary
+     - C{('drop', numbers, buildsPrunedBefore, logsPrunedBefore)} removes
+       builds, and records how far pruning has progressed
+
+    Builds are written to the data file, and synced to disk, before their
+    index records, so a crash can only lose the last, partly-written,
+    records.  Pruning drops builds
+    from the index; once more than half of the data file belongs to dropped
+    or rewritten builds, the live builds are copied into a new data file and
+    index, and the new index is renamed into place."""
+
+    indexFilename = "builds.idx"
+
+    # don't bother compacting data files smaller than this
+    compactionMinimum = 1024 * 1024
+
+    def __init__(self, basedir, indexFilename=None):
+        self.basedir = basedir
+        if indexFilename is not None:
+            self.indexFilename = indexFilename
+        self._data = self._index = None
+        # held while the data file or the index is changed, and while a
+        # build is read from the data file, so builds can be loaded in a
+        # thread
+        self._lock = threading.Lock()
+        self._open()
+
+    def _dataFilename(self, generation):
+        return os.path.join(self.basedir, "builds-%d.dat" % generation)
+
+    def _indexFilename(self):
+        return os.path.join(self.basedir, self.indexFilename)
+
+    def _open(self):
+        # number -> (offset, length, logfiles, summary)
+        self.index = {}
+        self.generation = 0
+        self.liveBytes = 0
+        self.deadBytes = 0
+        self.buildsPrunedBefore = 0
+        self.logsPrunedBefore = 0
+
+        filename = self._indexFilename()
+        if os.path.exists(filename):
+            for record in _readRecords(filename):
+                self._applyRecord(record)
+        else:
+            with open(filename, "wb") as f:
+                dump(('data', self.generation), f, -1)
+
+        datafile = self._dataFilename(self.generation)
+        self._data = open(datafile, "a+b")
+        self._data.seek(0, 2)
+        size = self._data.tell()
+        for number, entry in self.index.items():
+            if entry[0] + entry[1] > size:
+                log.msg("build %d is missing from %s; forgetting it"
+                        % (number, datafile))
+                self._forget(number)
+
+        # remove data files left behind by an interrupted compaction
+        for generation in (self.generation - 1, self.generation + 1):
+            if os.path.exists(self._dataFilename(generation)):
+                os.unlink(self._dataFilename(generation))
+
+        self._index = open(filename, "ab")
+
+    def _applyRecord(self, record):
+        kind = record[0]
+        if kind == 'build':
+            number, offset, length, logfiles, summary = record[1:]
+            self._forget(number)
+            self.index[number] = (offset, length, logfiles, summary)
+            self.liveBytes += length
+        elif kind == 'drop':
+            numbers, self.buildsPrunedBefore, self.logsPrunedBefore = \
+                record[1:]
+            for number in numbers:
+                self._forget(number)
+        elif kind == 'data':
+            self.generation = record[1]
+
+    def _appendRecord(self, record):
+        with self._lock:
+            dump(record, self._index, -1)
+            self._index.flush()
+            self._applyRecord(record)
+
+    def _forget(self, number):
+        entry = self.index.pop(number, None)
+        if entry is not None:
+            self.liveBytes -= entry[1]
+            self.deadBytes += entry[1]
+
+    def getBuildNumbers(self):
+        return sorted(self.index)
+
+    def getLastBuildNumber(self):
+        if self.index:
+            return max(self.index)
+        return None
+
+    def readBuild(self, number):
+        with self._lock:
+            try:
+                offset, length = self.index[number][:2]
+            except KeyError:
+                raise IndexError("no such build %d" % number)
+            self._data.seek(offset)
+            return self._data.read(length)
+
+    def loadBuild(self, number):
+        return unpickleBuild(number, self.readBuild(number))
+
+    def getSummary(self, number):
+        entry = self.index.get(number)
+        if entry is None:
+            return None
+        return entry[3]
+
+    def saveBuild(self, build):
+        self.writeBuilds([serializeBuild(build)])
+
+    def writeBuilds(self, builds):
+        with self._lock:
+            self._data.seek(0, 2)
+            records = []
+            for number, data, logfiles, summary in builds:
+                records.append(('build', number, self._data.tell(), len(data),
+                                logfiles, summary))
+                self._data.write(data)
+            # one sync for the whole batch; the builds must be on disk before
+            # the index records pointing to them
+            self._data.flush()
+            os.fsync(self._data.fileno())
+            for record in records:
+                dump(record, self._index, -1)
+            self._index.flush()
+            os.fsync(self._index.fileno())
+            for record in records:
+                self._applyRecord(record)
+
+    def removeBuild(self, number):
+        if number in self.index:
+            self._appendRecord(('drop', [number], self.buildsPrunedBefore,
+                                self.logsPrunedBefore))
+
+    def pruneBuilds(self, earliest_build, earliest_log, keep=()):
+        # only the builds between the last prune and the new horizons need
+        # to be considered; builds in C{keep} are left for a later prune
+        log_mark = earliest_log
+        for number in xrange(self.logsPrunedBefore, earliest_log):
+            entry = self.index.get(number)
+            if entry is None:
+                continue
+            if number in keep:
+                log_mark = min(log_mark, number)
+                continue
+            _removeLogfiles(self.basedir, entry[2])
+
+        build_mark = earliest_build
+        dropped = []
+        for number in xrange(self.buildsPrunedBefore, earliest_build):
+            if number not in self.index:
+                continue
+            if number in keep:
+                build_mark = min(build_mark, number)
+                continue
+            dropped.append(number)
+
+        build_mark = max(build_mark, self.buildsPrunedBefore)
+        log_mark = max(log_mark, self.logsPrunedBefore)
+        if (dropped or build_mark != self.buildsPrunedBefore
+                or log_mark != self.logsPrunedBefore):
+            if dropped:
+                log.msg("pruning builds %d-%d from %s"
+                        % (dropped[0], dropped[-1], self.basedir))
+            self._appendRecord(('drop', dropped, build_mark, log_mark))
+
+        if (self.deadBytes > self.liveBytes
+                and self.deadBytes > self.compactionMinimum):
+            self.compact()
+
+    def compact(self):
+        """Copy the live builds into a new data file and index, dropping the
+        space used by pruned and rewritten builds."""
+        generation = self.generation + 1
+        datafile = self._dataFilename(generation)
+        indexfile = self._indexFilename()
+        tmpindexfile = indexfile + ".tmp"
+        log.msg("compacting build history in %s" % self.basedir)
+
+        with self._lock:
+            with open(datafile, "wb") as data:
+                with open(tmpindexfile, "wb") as index:
+                    dump(('data', generation), index, -1)
+                    dump(('drop', [], self.buildsPrunedBefore,
+                          self.logsPrunedBefore), index, -1)
+                    for number in sorted(self.index):
+                        offset, length, logfiles, summary = self.index[number]
+                        self._data.seek(offset)
+                        newoffset = data.tell()
+                        data.write(self._data.read(length))
+                        dump(('build', number, newoffset, length, logfiles,
+                              summary), index, -1)
+                    # both files must be on disk before the new index replaces
+                    # the old one
+                    data.flush()
+                    os.fsync(data.fileno())
+                    index.flush()
+                    os.fsync(index.fileno())
+
+            self.close()
+            _replace(tmpindexfile, indexfile)
+            self._open()
+
+    def close(self):
+        for f in (self._data, self._index):
+            if f is not None:
+                f.close()
+        self._data = self._index = None
+
+
+storeClasses = {
+    'pickle': PickleDirectoryStore,
+    'indexed': IndexedBuildStore,
+}
+
+
+def migrateBuilds(source, dest, remove=False, batchSize=100):
+    """Copy every build in store C{source} to store C{dest}, removing each
+    from C{source} once it is copied if C{remove} is true.  Builds are
+    written C{batchSize} at a time.  Builds that cannot be loaded are logged
+    and skipped.  Returns the number of builds copied."""
+    batch = []
+
+    def write():
+        dest.writeBuilds(batch)
+        if remove:
+            for serialized in batch:
+                source.removeBuild(serialized[0])
+        del batch[:]
+
+    copied = 0
+    for number in source.getBuildNumbers():
+        try:
+            build = source.loadBuild(number)
+        except IndexError:
+            log.msg("skipping unreadable build %d in %s"
+                    % (number, source.basedir))
+            continue
+        # pickles from older versions must be upgraded before they are
+        # saved again, or they will be marked as current without being so
+        styles.doUpgrade()
+        batch.append(serializeBuild(build))
+        if len(batch) >= batchSize:
+            write()
+        copied += 1
+    if batch:
+        write()
+    return copied
+
+
+def makeStore(kind, basedir):
+    """Open a build-history store of the given kind in C{basedir}.  The
+    first time an indexed store is opened in a directory that already holds
+    build pickles, the pickles are copied into it (and left in place)."""
+    if kind == 'indexed':
+        indexfile = os.path.join(basedir, IndexedBuildStore.indexFilename)
+        if not os.path.exists(indexfile):
+            pickles = PickleDirectoryStore(basedir)
+            if pickles.getLastBuildNumber() is not None:
+                _migrateToIndexed(pickles, basedir)
+    return storeClasses[kind](basedir)
+
+
+def _migrateToIndexed(pickles, basedir):
+    # the builds are copied under a temporary index, which is renamed into
+    # place once they are all copied, so an interrupted copy is started
+    # again rather than taken for a complete history
+    indexfile = os.path.join(basedir, IndexedBuildStore.indexFilename)
+    tmpindex = IndexedBuildStore.indexFilename + ".migrating"
+    for filename in os.listdir(basedir):
+        if filename == tmpindex or re.match(r"^builds-\d+\.dat$", filename):
+            log.msg("removing %s, left by an interrupted copy of the build "
+                    "history" % os.path.join(basedir, filename))
+            os.unlink(os.path.join(basedir, filename))
+
+    log.msg("copying build pickles in %s into an indexed build history; "
+            "run contrib/migrate_build_history.py with the master stopped "
+            "to copy large histories ahead of time" % basedir)
+    store = IndexedBuildStore(basedir, indexFilename=tmpindex)
+    migrateBuilds(pickles, store)
+    os.fsync(store._index.fileno())
+    store.close()
+    _replace(os.path.join(basedir, tmpindex), indexfile)
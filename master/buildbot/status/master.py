@@ -25,6 +25,7 @@ from buildbot.changes import changes
 from buildbot.status import builder
 from buildbot.status import buildrequest
 from buildbot.status import buildset
+from buildbot.status import persistence
 from buildbot.util import bbcollections
 from buildbot.util.eventual import eventually
 from cPickle import load
@@ -55,6 +56,9 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         self._build_request_sub = None
         self._change_sub = None
 
+        # saves builder and build pickles in the background
+        self.statusWriter = persistence.StatusWriter()
+
     # service management
 
     def startService(self):
@@ -72,6 +76,7 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
             self.master.subscribeToChanges(
                 self.changeAdded)
 
+        self.statusWriter.start()
         return service.MultiService.startService(self)
 
     @defer.inlineCallbacks
@@ -112,7 +117,11 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
             self._change_sub.unsubscribe()
             self._change_sub = None
 
-        return service.MultiService.stopService(self)
+        # anything saved after this (such as the builders, when the botmaster
+        # stops) is written immediately
+        d = self.statusWriter.stop()
+        d.addCallback(lambda _: service.MultiService.stopService(self))
+        return d
 
     # clean shutdown
 
@@ -382,6 +391,7 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         builder_status.basedir = os.path.join(self.basedir, basedir)
         builder_status.name = name  # it might have been updated
         builder_status.status = self
+        builder_status.statusWriter = self.statusWriter
 
         if not os.path.isdir(builder_status.basedir):
             os.makedirs(builder_status.basedir)
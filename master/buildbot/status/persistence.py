@@ -0,0 +1,127 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+
+from buildbot.status import buildhistory
+from buildbot.util import batch
+from cPickle import dumps
+from twisted.internet import defer
+from twisted.internet import threads
+from twisted.python import log
+
+
+class StatusWriter(object):
+
+    """
+    I save BuildStatus and BuilderStatus pickles without making the reactor
+    wait for the disk.
+
+    Objects to save are queued, and those queued while a batch is being
+    written are saved together in the next batch.  Each batch is pickled on
+    the reactor, since the status objects belong to it, and then written in
+    a thread: builds by their builder's build-history store, which writes
+    all of a batch's builds at once, and builder pickles to a temporary file
+    that is renamed into place.
+
+    Until L{start} is called, and once L{stop} has flushed the queue,
+    objects are saved immediately.
+    """
+
+    def __init__(self):
+        self.batcher = batch.Batcher(self._writeBatch)
+        self.running = False
+        # for tests
+        self._deferToThread = threads.deferToThread
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        """Write everything that is queued, and save immediately from then
+        on.  Returns a Deferred that fires once the queue is written."""
+        d = self.batcher.flush()
+
+        @d.addCallback
+        def stopped(_):
+            self.running = False
+        return d
+
+    def saveBuild(self, build):
+        """Save C{build} in its builder's build-history store, returning a
+        Deferred that fires once it is written.  Errors are logged."""
+        return self._save(('build', build.builder.basedir, build.number),
+                          build)
+
+    def saveBuilder(self, builder_status):
+        """Save C{builder_status} to the C{builder} pickle in its directory,
+        returning a Deferred that fires once it is written.  Errors are
+        logged."""
+        return self._save(('builder', builder_status.basedir),
+                          builder_status)
+
+    def _save(self, key, obj):
+        if self.running:
+            d = self.batcher({key: obj})
+            d.addCallback(lambda _: None)
+            return d
+        self._write(*self._serialize({key: obj}))
+        return defer.succeed(None)
+
+    def _writeBatch(self, items):
+        builds, pickles = self._serialize(items)
+        return self._deferToThread(self._write, builds, pickles)
+
+    def _serialize(self, items):
+        builds = {}  # store -> [serialized build, ..]
+        pickles = []  # [(filename, data), ..]
+        for key in sorted(items):
+            obj = items[key]
+            try:
+                if key[0] == 'build':
+                    store = obj.builder.getBuildStore()
+                    builds.setdefault(store, []).append(
+                        buildhistory.serializeBuild(obj))
+                else:
+                    pickles.append((os.path.join(obj.basedir, "builder"),
+                                    dumps(obj, -1)))
+            except:
+                self._logFailure(key, obj)
+        return builds, pickles
+
+    def _write(self, builds, pickles):
+        # this runs in a thread, unless we are not running
+        for store, serialized in builds.iteritems():
+            try:
+                store.writeBuilds(serialized)
+            except:
+                log.msg("unable to save builds %s in %s"
+                        % (", ".join("#%d" % s[0] for s in serialized),
+                           store.basedir))
+                log.err()
+        for filename, data in pickles:
+            try:
+                buildhistory.writeFile(filename, data)
+            except:
+                log.msg("unable to save %s" % filename)
+                log.err()
+
+    def _logFailure(self, key, obj):
+        if key[0] == 'build':
+            log.msg("unable to save build %s-#%d" % (obj.builder.name,
+                                                     obj.number))
+        else:
+            log.msg("unable to save builder %s" % obj.name)
+        log.err()
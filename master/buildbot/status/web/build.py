@@ -354,8 +354,14 @@ class BuildsResource(HtmlResource):
         except ValueError:
             num = None
         if num is not None:
-            build_status = self.builder_status.getBuild(num)
-            if build_status:
-                return StatusResourceBuild(build_status)
+            # load the build without blocking the reactor
+            d = self.builder_status.getBuildAsync(num)
+
+            @d.addCallback
+            def makeResource(build_status):
+                if build_status:
+                    return StatusResourceBuild(build_status)
+                return HtmlResource.getChild(self, path, req)
+            return DeferredResource(d)
 
         return HtmlResource.getChild(self, path, req)
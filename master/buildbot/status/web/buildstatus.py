@@ -15,6 +15,7 @@
 
 from buildbot.status.web.base import HtmlResource
 from buildbot.status.web.base import IBox
+from twisted.internet import defer
 
 
 class BuildStatusStatusResource(HtmlResource):
@@ -22,6 +23,7 @@ class BuildStatusStatusResource(HtmlResource):
     def __init__(self, tags=None):
         HtmlResource.__init__(self)
 
+    @defer.inlineCallbacks
     def content(self, request, ctx):
         """Display a build in the same format as the waterfall page.
         The HTTP GET parameters are the builder name and the build
@@ -34,19 +36,19 @@ class BuildStatusStatusResource(HtmlResource):
         name = request.args.get("builder", [None])[0]
         number = request.args.get("number", [None])[0]
         if not name or not number:
-            return "builder and number parameter missing"
+            defer.returnValue("builder and number parameter missing")
         number = int(number)
 
         # Check if the builder in parameter exists.
         try:
             builder = status.getBuilder(name)
         except:
-            return "unknown builder"
+            defer.returnValue("unknown builder")
 
         # Check if the build in parameter exists.
-        build = builder.getBuild(int(number))
+        build = yield builder.getBuildAsync(int(number))
         if not build:
-            return "unknown build %s" % number
+            defer.returnValue("unknown build %s" % number)
 
         rows = ctx['rows'] = []
 
@@ -66,4 +68,4 @@ class BuildStatusStatusResource(HtmlResource):
         # current one.
         # TODO: Move to template
         data = data.replace('<a ', '<a target="_blank" ')
-        return data
+        defer.returnValue(data)
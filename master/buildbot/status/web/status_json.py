@@ -17,7 +17,6 @@
 """Simple JSON exporter."""
 
 import datetime
-import os
 import re
 import urllib
 
@@ -25,6 +24,7 @@ from twisted.internet import defer
 from twisted.web import html
 from twisted.web import resource
 from twisted.web import server
+from twisted.web.util import DeferredResource
 
 from buildbot.status.web.base import HtmlResource
 from buildbot.status.web.base import path_to_root
@@ -239,6 +239,9 @@ class JsonResource(resource.Resource):
                     node = node[pathElement]
                     request.prepath.append(pathElement)
                     child = child.getChildWithDefault(pathElement, request)
+                    if isinstance(child, DeferredResource):
+                        # wait for children that are loaded asynchronously
+                        child = yield child.d
 
                 # some asDict methods return a Deferred, so handle that
                 # properly
@@ -460,22 +463,33 @@ class AllBuildsJsonResource(JsonResource):
     def getChild(self, path, request):
         # Dynamic childs.
         if isinstance(path, int) or _IS_INT.match(path):
-            build_status = self.builder_status.getBuild(int(path))
-            if build_status:
-                return BuildJsonResource(self.status, build_status)
+            # load the build without blocking the reactor
+            d = self.builder_status.getBuildAsync(int(path))
+
+            @d.addCallback
+            def makeResource(build_status):
+                if build_status:
+                    return BuildJsonResource(self.status, build_status)
+                return JsonResource.getChild(self, path, request)
+            return DeferredResource(d)
         return JsonResource.getChild(self, path, request)
 
+    @defer.inlineCallbacks
     def asDict(self, request):
         results = {}
         # If max > buildCacheSize, it'll trash the cache...
         cache_size = self.builder_status.master.config.caches['Builds']
         max = int(RequestArg(request, 'max', cache_size))
-        for i in range(0, max):
-            child = self.getChildWithDefault(-i, request)
+        # start loading all of the builds before waiting for any of them
+        children = [self.getChildWithDefault(-i, request)
+                    for i in range(0, max)]
+        for child in children:
+            if isinstance(child, DeferredResource):
+                child = yield child.d
             if not isinstance(child, BuildJsonResource):
                 continue
             results[child.build_status.getNumber()] = child.asDict(request)
-        return results
+        defer.returnValue(results)
 
 
 class BuildsJsonResource(AllBuildsJsonResource):
@@ -497,9 +511,8 @@ class BuildsJsonResource(AllBuildsJsonResource):
         # self.children['builds'].asDict(request)
         # TODO(maruel) This list should also need to be cached but how?
         builds = dict([
-            (int(file), None)
-            for file in os.listdir(self.builder_status.basedir)
-            if _IS_INT.match(file)
+            (number, None)
+            for number in self.builder_status.getBuildStore().getBuildNumbers()
         ])
         return builds
 
@@ -655,12 +668,13 @@ class SlaveJsonResource(JsonResource):
             except ValueError:
                 numbuilds = 10
             for i in range(1, numbuilds):
-                build_status = builder_status.getBuild(-i)
-                if not build_status or not build_status.isFinished():
+                # the summary has all we need, so the build isn't loaded
+                summary = builder_status.getBuildSummary(-i)
+                if not summary or summary['finished'] is None:
                     # If not finished, it will appear in runningBuilds.
                     break
-                if build_status.getSlavename() == self.name:
-                    builds.append(build_status.getNumber())
+                if summary['slavename'] == self.name:
+                    builds.append(summary['number'])
             results['builders'][builderName] = builds
         return results
 
@@ -13,6 +13,7 @@
 #
 # Copyright Buildbot Team Members
 
+from buildbot.util import batch
 from twisted.application import service
 
 
@@ -25,6 +26,15 @@ class FakeBotMaster(service.MultiService):
         self.locks = {}
         self.builders = {}
         self.buildsStartedForSlaves = []
+        self.finishBuildsBatcher = batch.Batcher(
+            lambda bids: self.master.db.builds.finishBuildsBatch(bids.keys()))
+        self.completeBuildRequestsBatcher = batch.Batcher(
+            lambda brid_results:
+            self.master.db.buildrequests.completeBuildRequestsBatch(
+                brid_results))
+
+    def getBuilderQueueSummaries(self):
+        return self.master.db.buildrequests.getUnclaimedBuildRequestSummaries()
 
     def getLockByID(self, lockid):
         if lockid not in self.locks:
@@ -24,6 +24,7 @@ import copy
 
 from buildbot.db import buildrequests
 from buildbot.util import datetime2epoch
+from buildbot.util import epoch2datetime
 from buildbot.util import json
 from copy import deepcopy
 from twisted.internet import defer
@@ -433,8 +434,14 @@ class FakeChangesComponent(FakeDBComponent):
         chdicts = [self._chdict(self.changes[id]) for id in ids[-count:]]
         return defer.succeed(chdicts)
 
-    def getChanges(self):
-        chdicts = [self._chdict(v) for v in self.changes.values()]
+    def getChanges(self, changeids):
+        chdicts = [self._chdict(self.changes[id])
+                   for id in sorted(set(changeids)) if id in self.changes]
+        return defer.succeed(chdicts)
+
+    def getChangesInRange(self, lo, hi):
+        chdicts = [self._chdict(self.changes[id])
+                   for id in sorted(self.changes.keys()) if lo <= id <= hi]
         return defer.succeed(chdicts)
 
     def getChangesCount(self):
@@ -714,6 +721,25 @@ class FakeBuildsetsComponent(FakeDBComponent):
         return defer.succeed((bsid,
                               dict([(br.buildername, br.id) for br in br_rows])))
 
+    @defer.inlineCallbacks
+    def addBuildsets(self, buildsets, _reactor=reactor):
+        rv = []
+        for bs in buildsets:
+            sourcestampsetid = bs.get('sourcestampsetid')
+            if sourcestampsetid is None:
+                sourcestampsetid = \
+                    yield self.db.sourcestampsets.addSourceStampSet()
+                for ss in bs['sourcestamps']:
+                    yield self.db.sourcestamps.addSourceStamp(
+                        sourcestampsetid=sourcestampsetid, **ss)
+            bsid_brids = yield self.addBuildset(
+                sourcestampsetid=sourcestampsetid, reason=bs['reason'],
+                properties=bs['properties'],
+                builderNames=bs['builderNames'],
+                external_idstring=bs.get('external_idstring'))
+            rv.append(bsid_brids)
+        defer.returnValue(rv)
+
     def completeBuildset(self, bsid, results, complete_at=None,
                          _reactor=reactor):
         self.buildsets[bsid]['results'] = results
@@ -1001,11 +1027,16 @@ class FakeBuildRequestsComponent(FakeDBComponent):
 
     @defer.inlineCallbacks
     def getBuildRequests(self, buildername=None, complete=None, claimed=None,
-                         bsid=None, branch=None, repository=None):
+                         bsid=None, branch=None, repository=None,
+                         min_brid=None, max_brid=None):
         rv = []
         for br in self.reqs.itervalues():
             if buildername and br.buildername != buildername:
                 continue
+            if min_brid is not None and br.id < min_brid:
+                continue
+            if max_brid is not None and br.id > max_brid:
+                continue
             if complete is not None:
                 if complete and not br.complete:
                     continue
@@ -1038,6 +1069,26 @@ class FakeBuildRequestsComponent(FakeDBComponent):
             rv.append(self._brdictFromRow(br))
         defer.returnValue(rv)
 
+    def getUnclaimedBuildRequestsChecksum(self, max_brid=None):
+        brids = [br.id for br in self.reqs.itervalues()
+                 if not br.complete and br.id not in self.claims
+                 and (max_brid is None or br.id <= max_brid)]
+        return defer.succeed(buildrequests.checksumBuildRequestIds(brids))
+
+    def getUnclaimedBuildRequestSummaries(self):
+        rv = {}
+        for br in self.reqs.itervalues():
+            if br.complete or br.id in self.claims:
+                continue
+            summary = rv.setdefault(br.buildername,
+                                    dict(oldest_submitted_at=None, count=0))
+            submitted_at = epoch2datetime(br.submitted_at)
+            if summary['oldest_submitted_at'] is None or \
+                    submitted_at < summary['oldest_submitted_at']:
+                summary['oldest_submitted_at'] = submitted_at
+            summary['count'] += 1
+        return defer.succeed(rv)
+
     def claimBuildRequests(self, brids, claimed_at=None, _reactor=reactor):
         for brid in brids:
             if brid not in self.reqs or brid in self.claims:
@@ -1053,6 +1104,22 @@ class FakeBuildRequestsComponent(FakeDBComponent):
                                                   objectid=self.MASTER_ID, claimed_at=claimed_at)
         return defer.succeed(None)
 
+    def claimBuildRequestsBatch(self, brids, claimed_at=None,
+                                _reactor=reactor):
+        claimed_at = datetime2epoch(claimed_at)
+        if not claimed_at:
+            claimed_at = _reactor.seconds()
+
+        outcomes = {}
+        for brid in brids:
+            if brid in self.claims:
+                outcomes.setdefault(brid, False)
+                continue
+            self.claims[brid] = BuildRequestClaim(brid=brid,
+                                                  objectid=self.MASTER_ID, claimed_at=claimed_at)
+            outcomes[brid] = True
+        return defer.succeed(outcomes)
+
     def reclaimBuildRequests(self, brids, _reactor):
         for brid in brids:
             if brid in self.claims and self.claims[brid].objectid != self.MASTER_ID:
@@ -1087,6 +1154,24 @@ class FakeBuildRequestsComponent(FakeDBComponent):
             self.reqs[brid].complete_at = complete_at
         return defer.succeed(None)
 
+    def completeBuildRequestsBatch(self, brid_results, complete_at=None,
+                                   _reactor=reactor):
+        if complete_at is not None:
+            complete_at = datetime2epoch(complete_at)
+        else:
+            complete_at = _reactor.seconds()
+
+        outcomes = {}
+        for brid, results in brid_results.iteritems():
+            if brid not in self.reqs or self.reqs[brid].complete == 1:
+                outcomes[brid] = False
+                continue
+            self.reqs[brid].complete = 1
+            self.reqs[brid].results = results
+            self.reqs[brid].complete_at = complete_at
+            outcomes[brid] = True
+        return defer.succeed(outcomes)
+
     def unclaimExpiredRequests(self, old, _reactor=reactor):
         old_epoch = _reactor.seconds() - old
 
@@ -1194,6 +1279,18 @@ class FakeBuildsComponent(FakeDBComponent):
                 b.finish_time = now
         return defer.succeed(None)
 
+    def finishBuildsBatch(self, bids, _reactor=reactor):
+        now = _reactor.seconds()
+        outcomes = {}
+        for bid in bids:
+            b = self.builds.get(bid)
+            if b and b.finish_time is None:
+                b.finish_time = now
+                outcomes[bid] = True
+            else:
+                outcomes.setdefault(bid, False)
+        return defer.succeed(outcomes)
+
 
 class FakeUsersComponent(FakeDBComponent):
 
@@ -580,3 +580,15 @@ class TestAbstractBuildSlave(unittest.TestCase):
         self.assertEqual(buildslave['slaveinfo']['host'], 'TheHost')
         self.assertEqual(buildslave['slaveinfo']['access_uri'], 'TheURI')
         self.assertEqual(buildslave['slaveinfo']['version'], 'TheVersion')
+
+    def test_perspective_reportResources(self):
+        slave = self.createBuildslave()
+        self.assertEqual(slave.resources, None)
+
+        slave.perspective_reportResources(dict(load=1.5, cpus=4,
+                                               free_memory=1024,
+                                               unknown='x'))
+        self.assertEqual(slave.resources,
+                         dict(load=1.5, cpus=4, free_memory=1024,
+                              free_disk=None))
+        self.assertNotEqual(slave.lastMessageReceived, 0)
@@ -51,9 +51,11 @@ global_defaults = dict(
     logCompressionMethod='bz2',
     logMaxTailSize=None,
     logMaxSize=None,
+    buildHistoryStore='pickle',
     properties=properties.Properties(),
     mergeRequests=None,
     prioritizeBuilders=None,
+    distributorConcurrency=1,
     protocols={},
     slavePortnum=None,
     multiMaster=False,
@@ -430,6 +432,15 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
                              dict(logCompressionMethod='foo'))
         self.assertConfigError(self.errors, "must be 'bz2' or 'gz'")
 
+    def test_load_global_buildHistoryStore(self):
+        self.do_test_load_global(dict(buildHistoryStore='indexed'),
+                                 buildHistoryStore='indexed')
+
+    def test_load_global_buildHistoryStore_invalid(self):
+        self.cfg.load_global(self.filename,
+                             dict(buildHistoryStore='sql'))
+        self.assertConfigError(self.errors, "must be 'pickle' or 'indexed'")
+
     def test_load_global_codebaseGenerator(self):
         func = lambda _: "dummy"
         self.do_test_load_global(dict(codebaseGenerator=func),
@@ -483,6 +494,15 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
                              dict(prioritizeBuilders='yes'))
         self.assertConfigError(self.errors, "must be a callable")
 
+    def test_load_global_distributorConcurrency(self):
+        self.do_test_load_global(dict(distributorConcurrency=8),
+                                 distributorConcurrency=8)
+
+    def test_load_global_distributorConcurrency_invalid(self):
+        self.cfg.load_global(self.filename,
+                             dict(distributorConcurrency=0))
+        self.assertConfigError(self.errors, "must be a positive int")
+
     def test_load_global_slavePortnum_int(self):
         self.do_test_load_global(dict(slavePortnum=123),
                                  protocols={'pb': {'port': 'tcp:123'}})
@@ -569,6 +589,57 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
                          dict(db=dict(db_url='abcd', db_poll_interval='ten')))
         self.assertConfigError(self.errors, "must be an int")
 
+    def test_load_db_read_write_pools(self):
+        self.cfg.load_db(self.filename,
+                         dict(db=dict(db_url='abcd', db_read_url='efgh',
+                                      db_read_pool_size=10,
+                                      db_write_pool_size=2)))
+        self.assertResults(db=dict(db_url='abcd', db_poll_interval=None,
+                                   db_read_url='efgh', db_read_pool_size=10,
+                                   db_write_pool_size=2))
+
+    def test_load_db_pool_size_not_int(self):
+        self.cfg.load_db(self.filename,
+                         dict(db=dict(db_url='abcd', db_read_pool_size='ten')))
+        self.assertConfigError(self.errors, "must be a positive int")
+
+    def test_load_db_pool_size_zero(self):
+        self.cfg.load_db(self.filename,
+                         dict(db=dict(db_url='abcd', db_write_pool_size=0)))
+        self.assertConfigError(self.errors, "must be a positive int")
+
+    def test_load_db_janitor(self):
+        self.cfg.load_db(self.filename,
+                         dict(db=dict(db_url='abcd', janitor_horizon=86400,
+                                      janitor_batch_size=50,
+                                      janitor_time_budget=5)))
+        self.assertResults(db=dict(db_url='abcd', db_poll_interval=None,
+                                   janitor_horizon=86400,
+                                   janitor_batch_size=50,
+                                   janitor_time_budget=5))
+
+    def test_load_db_slow_query_threshold(self):
+        self.cfg.load_db(self.filename,
+                         dict(db=dict(db_url='abcd', slow_query_threshold=0.5)))
+        self.assertResults(db=dict(db_url='abcd', db_poll_interval=None,
+                                   slow_query_threshold=0.5))
+
+    def test_load_db_slow_query_threshold_invalid(self):
+        self.cfg.load_db(self.filename,
+                         dict(db=dict(db_url='abcd', slow_query_threshold='1s')))
+        self.assertConfigError(self.errors, "must be a non-negative number")
+
+    def test_load_db_state_flush_interval(self):
+        self.cfg.load_db(self.filename,
+                         dict(db=dict(db_url='abcd', state_flush_interval=2)))
+        self.assertResults(db=dict(db_url='abcd', db_poll_interval=None,
+                                   state_flush_interval=2))
+
+    def test_load_db_janitor_horizon_negative(self):
+        self.cfg.load_db(self.filename,
+                         dict(db=dict(db_url='abcd', janitor_horizon=-1)))
+        self.assertConfigError(self.errors, "must be a positive int")
+
     def test_load_metrics_defaults(self):
         self.cfg.load_metrics(self.filename, {})
         self.assertResults(metrics=None)
@@ -1104,6 +1175,18 @@ class BuilderConfig(ConfigErrorsMixin, unittest.TestCase):
             lambda: config.BuilderConfig(canStartBuild="foo",
                                          name="a", slavenames=['a'], factory=self.factory))
 
+    def test_inv_buildAvoidanceHorizon(self):
+        self.assertRaisesConfigError(
+            "buildAvoidanceHorizon must be a number",
+            lambda: config.BuilderConfig(buildAvoidanceHorizon="foo",
+                                         name="a", slavenames=['a'], factory=self.factory))
+
+    def test_inv_buildAvoidanceIgnoreProperties(self):
+        self.assertRaisesConfigError(
+            "buildAvoidanceIgnoreProperties must be a list",
+            lambda: config.BuilderConfig(buildAvoidanceIgnoreProperties="foo",
+                                         name="a", slavenames=['a'], factory=self.factory))
+
     def test_inv_env(self):
         self.assertRaisesConfigError(
             "builder's env must be a dictionary",
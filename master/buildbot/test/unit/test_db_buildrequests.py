@@ -23,6 +23,7 @@ from buildbot.test.util import db
 from buildbot.test.util import interfaces
 from buildbot.util import UTC
 from buildbot.util import epoch2datetime
+from twisted.internet import defer
 from twisted.internet import task
 from twisted.trial import unittest
 
@@ -139,6 +140,87 @@ class Tests(interfaces.InterfaceTests):
             claimed=False,
             expected=[52])
 
+    def test_getBuildRequests_min_brid(self):
+        return self.do_test_getBuildRequests_claim_args(
+            min_brid=52,
+            expected=[52, 53])
+
+    def test_getBuildRequests_max_brid(self):
+        return self.do_test_getBuildRequests_claim_args(
+            max_brid=51,
+            expected=[50, 51])
+
+    def test_getBuildRequests_unclaimed_min_brid(self):
+        return self.do_test_getBuildRequests_claim_args(
+            claimed=False, min_brid=53,
+            expected=[])
+
+    def do_test_getUnclaimedBuildRequestsChecksum(self, expected, **kwargs):
+        d = self.insertTestData([
+            fakedb.BuildRequest(id=50, buildsetid=self.BSID),
+            fakedb.BuildRequestClaim(brid=50, objectid=self.MASTER_ID,
+                                     claimed_at=self.CLAIMED_AT_EPOCH),
+            fakedb.BuildRequest(id=51, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=52, buildsetid=self.BSID, complete=1),
+            fakedb.BuildRequest(id=53, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=54, buildsetid=self.BSID),
+        ])
+        d.addCallback(lambda _:
+                      self.db.buildrequests.getUnclaimedBuildRequestsChecksum(
+                          **kwargs))
+
+        def check(checksum):
+            self.assertEqual(checksum, expected)
+        d.addCallback(check)
+        return d
+
+    def test_getUnclaimedBuildRequestsChecksum(self):
+        return self.do_test_getUnclaimedBuildRequestsChecksum(
+            (3, 54, 51 + 53 + 54, 51 ** 2 + 53 ** 2 + 54 ** 2))
+
+    def test_getUnclaimedBuildRequestsChecksum_max_brid(self):
+        return self.do_test_getUnclaimedBuildRequestsChecksum(
+            (2, 53, 51 + 53, 51 ** 2 + 53 ** 2), max_brid=53)
+
+    def test_getUnclaimedBuildRequestsChecksum_empty(self):
+        return self.do_test_getUnclaimedBuildRequestsChecksum(
+            (0, 0, 0, 0), max_brid=49)
+
+    def test_checksumBuildRequestIds(self):
+        self.assertEqual(buildrequests.checksumBuildRequestIds([51, 53, 54]),
+                         (3, 54, 51 + 53 + 54, 51 ** 2 + 53 ** 2 + 54 ** 2))
+        # same count and sum, different sets
+        self.assertNotEqual(buildrequests.checksumBuildRequestIds([1, 4]),
+                            buildrequests.checksumBuildRequestIds([2, 3]))
+        self.assertNotEqual(buildrequests.checksumBuildRequestIds([1, 5, 6]),
+                            buildrequests.checksumBuildRequestIds([2, 4, 6]))
+
+    def test_getUnclaimedBuildRequestSummaries(self):
+        d = self.insertTestData([
+            fakedb.BuildRequest(id=50, buildsetid=self.BSID, buildername='bb',
+                                submitted_at=1000),
+            fakedb.BuildRequestClaim(brid=50, objectid=self.MASTER_ID,
+                                     claimed_at=self.CLAIMED_AT_EPOCH),
+            fakedb.BuildRequest(id=51, buildsetid=self.BSID, buildername='bb',
+                                submitted_at=3000),
+            fakedb.BuildRequest(id=52, buildsetid=self.BSID, buildername='bb',
+                                submitted_at=2000),
+            fakedb.BuildRequest(id=53, buildsetid=self.BSID, buildername='cc',
+                                submitted_at=1500),
+            fakedb.BuildRequest(id=54, buildsetid=self.BSID, buildername='dd',
+                                complete=1),
+        ])
+        d.addCallback(lambda _:
+                      self.db.buildrequests.getUnclaimedBuildRequestSummaries())
+
+        def check(summaries):
+            self.assertEqual(summaries, {
+                'bb': dict(oldest_submitted_at=epoch2datetime(2000), count=2),
+                'cc': dict(oldest_submitted_at=epoch2datetime(1500), count=1),
+            })
+        d.addCallback(check)
+        return d
+
     def do_test_getBuildRequests_buildername_arg(self, **kwargs):
         expected = kwargs.pop('expected')
         d = self.insertTestData([
@@ -467,6 +549,47 @@ class Tests(interfaces.InterfaceTests):
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_claimBuildRequestsBatch(self):
+        clock = task.Clock()
+        clock.advance(1300305712)
+        yield self.insertTestData([
+            fakedb.BuildRequest(id=44, buildsetid=self.BSID,
+                                buildername='bldr1'),
+            fakedb.BuildRequest(id=45, buildsetid=self.BSID,
+                                buildername='bldr2'),
+            fakedb.BuildRequest(id=46, buildsetid=self.BSID,
+                                buildername='bldr3'),
+            fakedb.BuildRequestClaim(brid=46, objectid=self.OTHER_MASTER_ID,
+                                     claimed_at=1300103810),
+        ])
+        outcomes = yield self.db.buildrequests.claimBuildRequestsBatch(
+            [44, 45, 46, 44], _reactor=clock)
+        self.assertEqual(outcomes, {44: True, 45: True, 46: False})
+        results = yield self.db.buildrequests.getBuildRequests()
+        self.assertEqual(
+            sorted([(r['brid'], r['claimed_at'], r['mine'])
+                    for r in results]),
+            [(44, epoch2datetime(1300305712), True),
+             (45, epoch2datetime(1300305712), True),
+             (46, epoch2datetime(1300103810), False)])
+
+    @defer.inlineCallbacks
+    def test_claimBuildRequestsBatch_stress(self):
+        yield self.insertTestData(
+            [fakedb.BuildRequest(id=id, buildsetid=self.BSID)
+             for id in xrange(1, 300)] +
+            [fakedb.BuildRequestClaim(brid=id, objectid=self.OTHER_MASTER_ID,
+                                      claimed_at=1300103810)
+             for id in xrange(1, 300, 7)])
+        outcomes = yield self.db.buildrequests.claimBuildRequestsBatch(
+            range(1, 300), claimed_at=epoch2datetime(14000000))
+        self.assertEqual(outcomes,
+                         dict((id, id % 7 != 1) for id in xrange(1, 300)))
+        results = yield self.db.buildrequests.getBuildRequests(claimed='mine')
+        self.assertEqual(sorted(r['brid'] for r in results),
+                         [id for id in xrange(1, 300) if id % 7 != 1])
+
     def do_test_reclaimBuildRequests(self, rows, now, brids, expected=None,
                                      expfailure=None):
         clock = task.Clock()
@@ -643,6 +766,44 @@ class Tests(interfaces.InterfaceTests):
         ], 1300305712,
             expfailure=buildrequests.NotClaimedError)
 
+    @defer.inlineCallbacks
+    def test_completeBuildRequestsBatch(self):
+        clock = task.Clock()
+        clock.advance(1300305712)
+        yield self.insertTestData([
+            fakedb.BuildRequest(id=44, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=45, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=46, buildsetid=self.BSID,
+                                complete=1, results=2,
+                                complete_at=1300104190),
+        ])
+        outcomes = yield self.db.buildrequests.completeBuildRequestsBatch(
+            {44: 0, 45: 2, 46: 0, 47: 0}, _reactor=clock)
+        self.assertEqual(outcomes, {44: True, 45: True, 46: False, 47: False})
+        results = yield self.db.buildrequests.getBuildRequests()
+        self.assertEqual(
+            sorted((r['brid'], r['complete'], r['results'], r['complete_at'])
+                   for r in results),
+            [(44, True, 0, epoch2datetime(1300305712)),
+             (45, True, 2, epoch2datetime(1300305712)),
+             (46, True, 2, epoch2datetime(1300104190))])
+
+    @defer.inlineCallbacks
+    def test_completeBuildRequestsBatch_stress(self):
+        yield self.insertTestData([
+            fakedb.BuildRequest(id=id, buildsetid=self.BSID)
+            for id in range(1, 280)
+        ])
+        outcomes = yield self.db.buildrequests.completeBuildRequestsBatch(
+            dict((id, id % 3) for id in range(1, 280)),
+            complete_at=epoch2datetime(999999))
+        self.assertEqual(outcomes, dict((id, True) for id in range(1, 280)))
+        results = yield self.db.buildrequests.getBuildRequests()
+        self.assertEqual(
+            sorted((r['brid'], r['results'], r['complete_at'])
+                   for r in results),
+            [(id, id % 3, epoch2datetime(999999)) for id in range(1, 280)])
+
     def do_test_unclaimMethod(self, method, expected):
         d = self.insertTestData([
             # 44: a complete build (should not be unclaimed)
@@ -164,3 +164,32 @@ class TestBuildsConnectorComponent(
             return self.db.pool.do(thd)
         d.addCallback(check)
         return d
+
+    def test_finishBuildsBatch(self):
+        clock = task.Clock()
+        clock.advance(1305555555)
+
+        d = self.insertTestData(self.background_data + [
+            fakedb.Build(id=50, brid=41, number=5, start_time=1304262222),
+            fakedb.Build(id=51, brid=42, number=5, start_time=1304262222,
+                         finish_time=1304263333),
+            fakedb.Build(id=52, brid=42, number=6, start_time=1304262222),
+        ])
+        d.addCallback(lambda _:
+                      self.db.builds.finishBuildsBatch([50, 51, 53],
+                                                       _reactor=clock))
+
+        def check(outcomes):
+            self.assertEqual(outcomes, {50: True, 51: False, 53: False})
+
+            def thd(conn):
+                r = conn.execute(self.db.model.builds.select())
+                rows = [(row.id, row.finish_time) for row in r.fetchall()]
+                self.assertEqual(sorted(rows), [
+                    (50, 1305555555),
+                    (51, 1304263333),
+                    (52, None),
+                ])
+            return self.db.pool.do(thd)
+        d.addCallback(check)
+        return d
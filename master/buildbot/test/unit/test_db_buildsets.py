@@ -15,8 +15,10 @@
 
 import datetime
 import mock
+import sqlalchemy as sa
 
 from buildbot.db import buildsets
+from buildbot.db import sourcestamps
 from buildbot.test.fake import fakedb
 from buildbot.test.util import connector_component
 from buildbot.util import UTC
@@ -39,10 +41,13 @@ class TestBuildsetsConnectorComponent(
         d = self.setUpConnectorComponent(
             table_names=['patches', 'changes', 'sourcestamp_changes',
                          'buildsets', 'buildset_properties', 'objects',
-                         'buildrequests', 'sourcestamps', 'sourcestampsets'])
+                         'buildrequests', 'buildrequest_claims', 'builds',
+                         'sourcestamps', 'sourcestampsets'])
 
         def finish_setup(_):
             self.db.buildsets = buildsets.BuildsetsConnectorComponent(self.db)
+            self.db.sourcestamps = \
+                sourcestamps.SourceStampsConnectorComponent(self.db)
         d.addCallback(finish_setup)
 
         # set up a sourcestamp with id 234 for use below
@@ -137,6 +142,82 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_addBuildsets(self):
+        props = dict(prop=(['list'], 'test'))
+        rv = yield self.db.buildsets.addBuildsets([
+            dict(sourcestampsetid=234, reason='because', properties={},
+                 builderNames=['a']),
+            dict(sourcestamps=[
+                dict(branch='br', revision='rev', repository='repo',
+                     project='proj', codebase='cb', changeids=[]),
+                dict(branch='br2', revision=None, repository='repo2',
+                     project='proj', codebase='cb2',
+                     patch_body='diff', patch_level=1)],
+                reason='why', properties=props, builderNames=['a', 'b'],
+                external_idstring='extid'),
+        ], _reactor=self.clock)
+
+        self.assertEqual(len(rv), 2)
+        (bsid1, brids1), (bsid2, brids2) = rv
+        self.assertEqual(sorted(brids1), ['a'])
+        self.assertEqual(sorted(brids2), ['a', 'b'])
+
+        def thd(conn):
+            r = conn.execute(self.db.model.buildsets.select())
+            rows = dict((row.id, (row.reason, row.sourcestampsetid,
+                                  row.external_idstring, row.submitted_at))
+                        for row in r.fetchall())
+            self.assertEqual(rows[bsid1],
+                             ('because', 234, None, self.now))
+            reason, setid, extid, submitted_at = rows[bsid2]
+            self.assertEqual((reason, extid, submitted_at),
+                             ('why', 'extid', self.now))
+            self.assertNotEqual(setid, 234)
+
+            r = conn.execute(self.db.model.sourcestamps.select(
+                whereclause=(self.db.model.sourcestamps.c.sourcestampsetid
+                             == setid)))
+            rows = sorted((row.codebase, row.branch, row.revision,
+                           row.patchid is not None) for row in r.fetchall())
+            self.assertEqual(rows, [('cb', 'br', 'rev', False),
+                                    ('cb2', 'br2', None, True)])
+
+            r = conn.execute(self.db.model.buildrequests.select())
+            rows = sorted((row.buildsetid, row.buildername, row.id)
+                          for row in r.fetchall())
+            self.assertEqual(rows, sorted([(bsid1, 'a', brids1['a']),
+                                           (bsid2, 'a', brids2['a']),
+                                           (bsid2, 'b', brids2['b'])]))
+        yield self.db.pool.do(thd)
+
+        props2 = yield self.db.buildsets.getBuildsetProperties(bsid2)
+        self.assertEqual(props2, props)
+
+    @defer.inlineCallbacks
+    def test_addBuildsets_invalid(self):
+        # check lengths, as with MySQL
+        self.db.buildsets._is_check_length_necessary = True
+        try:
+            yield self.db.buildsets.addBuildsets([
+                dict(sourcestampsetid=234, reason='because', properties={},
+                     builderNames=['a']),
+                dict(sourcestampsetid=234, reason='x' * 1000, properties={},
+                     builderNames=['a']),
+            ], _reactor=self.clock)
+        except RuntimeError:
+            pass
+        else:
+            self.fail("addBuildsets should have failed")
+
+        # neither buildset was added
+        def thd(conn):
+            for tbl in (self.db.model.buildsets,
+                        self.db.model.buildrequests):
+                r = conn.execute(tbl.select())
+                self.assertEqual(r.fetchall(), [])
+        yield self.db.pool.do(thd)
+
     def do_test_getBuildsetProperties(self, buildsetid, rows, expected):
         d = self.insertTestData(rows)
         d.addCallback(lambda _:
@@ -479,3 +560,127 @@ class TestBuildsetsConnectorComponent(
             sourcestampsetid=234, reason='because',
             properties=props, builderNames=['a', 'b'])
         mockedCachePut.assert_called_once_with(bsid, props)
+
+    def insertPruneTestData(self):
+        old = self.now - 1000
+        return self.insertTestData([
+            fakedb.Object(id=5),
+            fakedb.Change(changeid=7),
+            fakedb.Patch(id=30, patch_author='me', patch_comment='fix'),
+
+            # an old buildset, with its own sourcestamp set
+            fakedb.SourceStampSet(id=20),
+            fakedb.SourceStamp(id=21, sourcestampsetid=20, patchid=30),
+            fakedb.SourceStampChange(sourcestampid=21, changeid=7),
+            fakedb.Buildset(id=10, sourcestampsetid=20, complete=1,
+                            complete_at=old),
+            fakedb.BuildsetProperty(buildsetid=10),
+            fakedb.BuildRequest(id=100, buildsetid=10, complete=1,
+                                complete_at=old),
+            fakedb.BuildRequestClaim(brid=100, objectid=5, claimed_at=old),
+            fakedb.Build(id=1000, brid=100),
+
+            # an old buildset sharing sourcestamp set 234 with a recent one
+            fakedb.Buildset(id=11, sourcestampsetid=234, complete=1,
+                            complete_at=old),
+            fakedb.BuildRequest(id=110, buildsetid=11, complete=1,
+                                complete_at=old),
+            fakedb.Buildset(id=12, sourcestampsetid=234, complete=1,
+                            complete_at=self.now - 10),
+            fakedb.BuildRequest(id=120, buildsetid=12, complete=1,
+                                complete_at=self.now - 10),
+
+            # an incomplete buildset
+            fakedb.Buildset(id=13, sourcestampsetid=234, complete=0),
+            fakedb.BuildRequest(id=130, buildsetid=13),
+        ])
+
+    def getIds(self):
+        def thd(conn):
+            results = {}
+            for tbl_name, col_name in [('buildsets', 'id'),
+                                       ('buildrequests', 'id'),
+                                       ('buildrequest_claims', 'brid'),
+                                       ('builds', 'id'),
+                                       ('buildset_properties', 'buildsetid'),
+                                       ('sourcestampsets', 'id'),
+                                       ('sourcestamps', 'id'),
+                                       ('sourcestamp_changes', 'sourcestampid'),
+                                       ('patches', 'id')]:
+                tbl = self.db.model.metadata.tables[tbl_name]
+                res = conn.execute(sa.select([tbl.c[col_name]]))
+                results[tbl_name] = sorted([row[0] for row in res.fetchall()])
+            return results
+        return self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def test_pruneBuildsets(self):
+        yield self.insertPruneTestData()
+        removed = yield self.db.buildsets.pruneBuildsets(100,
+                                                         _reactor=self.clock)
+        self.assertEqual(removed, {
+            'builds': 1,
+            'buildrequest_claims': 1,
+            'buildrequests': 2,
+            'buildset_properties': 1,
+            'buildsets': 2,
+            'sourcestamp_changes': 1,
+            'sourcestamps': 1,
+            'patches': 1,
+            'sourcestampsets': 1,
+        })
+        ids = yield self.getIds()
+        self.assertEqual(ids, {
+            'buildsets': [12, 13],
+            'buildrequests': [120, 130],
+            'buildrequest_claims': [],
+            'builds': [],
+            'buildset_properties': [],
+            'sourcestampsets': [234],
+            'sourcestamps': [234],
+            'sourcestamp_changes': [],
+            'patches': [],
+        })
+
+    @defer.inlineCallbacks
+    def test_pruneBuildsets_None(self):
+        yield self.insertPruneTestData()
+        removed = yield self.db.buildsets.pruneBuildsets(None,
+                                                         _reactor=self.clock)
+        self.assertEqual(sum(removed.values()), 0)
+        ids = yield self.getIds()
+        self.assertEqual(ids['buildsets'], [10, 11, 12, 13])
+
+    def insertLotsOfBuildsets(self, count):
+        return self.insertTestData([
+            fakedb.Buildset(id=n, sourcestampsetid=234, complete=1,
+                            complete_at=self.now - 1000)
+            for n in xrange(1, count + 1)
+        ])
+
+    @defer.inlineCallbacks
+    def test_pruneBuildsets_batches(self):
+        yield self.insertLotsOfBuildsets(25)
+        removed = yield self.db.buildsets.pruneBuildsets(
+            100, batch_size=10, _reactor=self.clock)
+        self.assertEqual(removed['buildsets'], 25)
+        ids = yield self.getIds()
+        self.assertEqual(ids['buildsets'], [])
+
+    @defer.inlineCallbacks
+    def test_pruneBuildsets_time_budget(self):
+        yield self.insertLotsOfBuildsets(25)
+
+        # let time pass while each batch is deleted
+        batch_thd = self.db.buildsets._pruneBuildsetsBatch_thd
+
+        def slow_batch_thd(*args):
+            self.clock.advance(6)
+            return batch_thd(*args)
+        self.db.buildsets._pruneBuildsetsBatch_thd = slow_batch_thd
+
+        removed = yield self.db.buildsets.pruneBuildsets(
+            100, batch_size=10, time_budget=10, _reactor=self.clock)
+        self.assertEqual(removed['buildsets'], 20)
+        ids = yield self.getIds()
+        self.assertEqual(ids['buildsets'], [21, 22, 23, 24, 25])
@@ -556,3 +556,73 @@ class TestChangesConnectorComponent(
                              {'notest': ('no', 'Change')})
         d.addCallback(check)
         return d
+
+    def test_getChanges(self):
+        d = self.insertTestData([
+            fakedb.Change(changeid=12),
+        ] + self.change13_rows + self.change14_rows)
+        d.addCallback(lambda _:
+                      self.db.changes.getChanges([14, 13, 99]))
+
+        def check(changes):
+            # missing changes are omitted, and the result is ordered
+            changeids = [c['changeid'] for c in changes]
+            self.assertEqual(changeids, [13, 14])
+            self.assertEqual(sorted(changes[0]['files']),
+                             sorted(['master/README.txt', 'slave/README.txt']))
+            self.assertEqual(changes[0]['properties'],
+                             {'notest': ('no', 'Change')})
+            self.assertEqual(changes[1], self.change14_dict)
+        d.addCallback(check)
+        return d
+
+    def test_getChanges_lots(self):
+        d = self.insertTestData(
+            [fakedb.Change(changeid=n) for n in xrange(1, 251)] +
+            [fakedb.ChangeFile(changeid=n, filename='f%d' % n)
+             for n in xrange(1, 251)])
+        d.addCallback(lambda _:
+                      self.db.changes.getChanges(range(1, 251)))
+
+        def check(changes):
+            self.assertEqual([c['changeid'] for c in changes],
+                             range(1, 251))
+            self.assertEqual([c['files'] for c in changes],
+                             [['f%d' % n] for n in xrange(1, 251)])
+        d.addCallback(check)
+        return d
+
+    def test_getChanges_fills_cache(self):
+        self.db.changes.getChange.cache.put = put = mock.Mock()
+        d = self.insertTestData(self.change14_rows)
+        d.addCallback(lambda _:
+                      self.db.changes.getChanges([14]))
+
+        def check(_):
+            put.assert_called_once_with(14, self.change14_dict)
+        d.addCallback(check)
+        return d
+
+    def test_getChangesInRange(self):
+        d = self.insertTestData([
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=12),
+        ] + self.change13_rows + self.change14_rows)
+        d.addCallback(lambda _:
+                      self.db.changes.getChangesInRange(11, 13))
+
+        def check(changes):
+            changeids = [c['changeid'] for c in changes]
+            self.assertEqual(changeids, [12, 13])
+            self.assertEqual(changes[1]['properties'],
+                             {'notest': ('no', 'Change')})
+        d.addCallback(check)
+        return d
+
+    def test_getChangesInRange_empty(self):
+        d = self.db.changes.getChangesInRange(1, 100)
+
+        def check(changes):
+            self.assertEqual(changes, [])
+        d.addCallback(check)
+        return d
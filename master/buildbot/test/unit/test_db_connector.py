@@ -81,6 +81,109 @@ class DBConnector(db.RealDatabaseMixin, unittest.TestCase):
             self.assertTrue(self.db.changes.pruneChanges.called)
         return d
 
+    def test_doJanitor_unconfigured(self):
+        self.db.buildsets.pruneBuildsets = mock.Mock()
+        d = self.db._doJanitor()
+
+        @d.addCallback
+        def check(_):
+            self.assertFalse(self.db.buildsets.pruneBuildsets.called)
+        return d
+
+    def test_doJanitor_configured(self):
+        self.db.buildsets.pruneBuildsets = mock.Mock(
+            return_value=defer.succeed({'buildsets': 3, 'buildrequests': 6}))
+        self.master.config.db['janitor_horizon'] = 86400
+        self.master.config.db['janitor_batch_size'] = 50
+        d = self.db._doJanitor()
+
+        @d.addCallback
+        def check(_):
+            self.db.buildsets.pruneBuildsets.assert_called_with(
+                86400, batch_size=50, time_budget=10)
+        return d
+
+    def test_setup_read_pool(self):
+        d = self.startService()
+
+        @d.addCallback
+        def check(_):
+            # an in-memory database can only have one pool
+            if self.db._engine.optimal_thread_pool_size == 1:
+                self.assertIdentical(self.db.read_pool, self.db.pool)
+            else:
+                self.assertNotIdentical(self.db.read_pool, self.db.pool)
+                self.assertEqual(self.db.read_pool.name, 'DBThreadPool-read')
+        return d
+
+    def test_setup_read_pool_size(self):
+        self.master.config.db['db_read_url'] = 'sqlite:///read.sqlite'
+        self.master.config.db['db_read_pool_size'] = 3
+        d = self.startService()
+
+        @d.addCallback
+        def check(_):
+            self.assertNotIdentical(self.db.read_pool, self.db.pool)
+            self.assertEqual(self.db.read_pool.max, 3)
+            self.assertTrue(self.db._read_engine.url.database.endswith(
+                'read.sqlite'))
+        return d
+
+    def test_reconfig_slow_query_threshold(self):
+        self.master.config.db['slow_query_threshold'] = 2
+        d = self.startService()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.db.pool.slow_query_threshold, 2)
+            self.assertEqual(self.db.read_pool.slow_query_threshold, 2)
+        return d
+
+    def test_reconfig_state_flush_interval(self):
+        self.master.config.db['state_flush_interval'] = 3
+        d = self.startService()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.db.state.flush_interval, 3)
+        return d
+
+    def test_stopService_flushes_state(self):
+        self.db.state.flushState = mock.Mock(
+            return_value=defer.succeed(None))
+        d = self.startService()
+        d.addCallback(lambda _: self.db.stopService())
+
+        @d.addCallback
+        def check(_):
+            self.assertTrue(self.db.state.flushState.called)
+            self.assertFalse(self.db.running)
+        return d
+
+    def test_setup_no_checkpoint_timer(self):
+        d = self.startService()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.db.checkpoint_timer, None)
+        return d
+
+    def test_setup_checkpoint_timer(self):
+        if not os.path.exists(self.db.basedir):
+            os.makedirs(self.db.basedir)
+        self.master.config.db['db_url'] = \
+            'sqlite:///checkpoint.sqlite?performance=1'
+        self.db.configured_url = None
+        d = self.db.setup(check_version=False)
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.db.checkpoint_timer.step, 60)
+            self.db.startService()
+            self.assertTrue(self.db.checkpoint_timer.running)
+            return self.db._doCheckpoint()
+        return d
+
     def test_setup_check_version_bad(self):
         d = self.startService(check_version=True)
         return self.assertFailure(d, connector.DatabaseNotReadyError)
@@ -13,9 +13,12 @@
 #
 # Copyright Buildbot Team Members
 
+import os
+
 from buildbot.db import enginestrategy
 from sqlalchemy.engine import url
 from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import SingletonThreadPool
 from twisted.python import runtime
 from twisted.trial import unittest
 
@@ -89,6 +92,46 @@ class BuildbotEngineStrategy_special_cases(unittest.TestCase):
                                # note: no poolclass= argument
                                pool_size=1)])  # extra in-memory args
 
+    def test_sqlite_performance(self):
+        u = url.make_url("sqlite:////x/state.sqlite?performance=1")
+        kwargs = dict(basedir='/my-base-dir')
+        u, kwargs, max_conns = self.strat.special_case_sqlite(u, kwargs)
+        self.assertEqual([str(u), max_conns, self.filter_kwargs(kwargs)],
+                         ["sqlite:////x/state.sqlite", 5,
+                          dict(basedir='/my-base-dir',
+                               poolclass=SingletonThreadPool, pool_size=20,
+                               connect_args=dict(timeout=30.0),
+                               sqlite_performance=True)])
+
+    def test_sqlite_performance_busy_timeout(self):
+        u = url.make_url(
+            "sqlite:////x/state.sqlite?performance=1&busy_timeout=2")
+        kwargs = dict(basedir='/my-base-dir')
+        u, kwargs, max_conns = self.strat.special_case_sqlite(u, kwargs)
+        self.assertEqual([str(u), kwargs['connect_args']],
+                         ["sqlite:////x/state.sqlite", dict(timeout=2.0)])
+
+    def test_sqlite_performance_off(self):
+        u = url.make_url("sqlite:////x/state.sqlite?performance=0")
+        kwargs = dict(basedir='/my-base-dir')
+        u, kwargs, max_conns = self.strat.special_case_sqlite(u, kwargs)
+        self.assertEqual([str(u), max_conns, self.filter_kwargs(kwargs)],
+                         ["sqlite:////x/state.sqlite", None, self.sqlite_kwargs])
+
+    def test_sqlite_performance_true(self):
+        u = url.make_url("sqlite:////x/state.sqlite?performance=true")
+        kwargs = dict(basedir='/my-base-dir')
+        u, kwargs, max_conns = self.strat.special_case_sqlite(u, kwargs)
+        self.assertEqual([max_conns, kwargs.get('sqlite_performance')],
+                         [5, True])
+
+    def test_sqlite_busy_timeout_without_performance(self):
+        u = url.make_url("sqlite:////x/state.sqlite?busy_timeout=2")
+        kwargs = dict(basedir='/my-base-dir')
+        u, kwargs, max_conns = self.strat.special_case_sqlite(u, kwargs)
+        self.assertEqual([str(u), max_conns, self.filter_kwargs(kwargs)],
+                         ["sqlite:////x/state.sqlite", None, self.sqlite_kwargs])
+
     def test_mysql_simple(self):
         u = url.make_url("mysql://host/dbname")
         kwargs = dict(basedir='my-base-dir')
@@ -177,3 +220,18 @@ class BuildbotEngineStrategy(unittest.TestCase):
     def test_create_engine(self):
         engine = enginestrategy.create_engine('sqlite://', basedir="/base")
         self.assertEqual(engine.scalar("SELECT 13 + 14"), 27)
+        self.assertFalse(engine.sqlite_performance)
+
+    def test_create_engine_sqlite_performance(self):
+        basedir = os.path.abspath('basedir')
+        if not os.path.exists(basedir):
+            os.makedirs(basedir)
+        engine = enginestrategy.create_engine(
+            'sqlite:///state.sqlite?performance=1', basedir=basedir)
+        self.addCleanup(engine.dispose)
+        self.assertTrue(engine.sqlite_performance)
+        self.assertEqual(engine.wal_checkpoint_interval, 60)
+        self.assertEqual(engine.optimal_thread_pool_size, 5)
+        # 1 is NORMAL
+        self.assertEqual(engine.scalar("pragma synchronous"), 1)
+        self.assertEqual(engine.scalar("pragma cache_size"), 16384)
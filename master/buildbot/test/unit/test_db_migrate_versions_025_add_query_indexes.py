@@ -0,0 +1,86 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import sqlalchemy as sa
+
+from buildbot.test.util import migration
+from sqlalchemy.engine import reflection
+from twisted.trial import unittest
+
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    def create_tables_thd(self, conn):
+        metadata = sa.MetaData()
+        metadata.bind = conn
+
+        self.buildsets = sa.Table('buildsets', metadata,
+                                  sa.Column('id', sa.Integer, primary_key=True),
+                                  sa.Column('submitted_at', sa.Integer, nullable=False),
+                                  sa.Column('complete', sa.SmallInteger, nullable=False,
+                                            server_default=sa.DefaultClause("0")),
+                                  sa.Column('complete_at', sa.Integer),
+                                  )
+        self.buildsets.create(bind=conn)
+
+        self.buildrequests = sa.Table('buildrequests', metadata,
+                                      sa.Column('id', sa.Integer, primary_key=True),
+                                      sa.Column('buildsetid', sa.Integer, sa.ForeignKey("buildsets.id"),
+                                                nullable=False),
+                                      sa.Column('buildername', sa.String(length=256), nullable=False),
+                                      sa.Column('complete', sa.Integer,
+                                                server_default=sa.DefaultClause("0")),
+                                      )
+        self.buildrequests.create(bind=conn)
+
+        self.sourcestamp_changes = sa.Table('sourcestamp_changes', metadata,
+                                            sa.Column('sourcestampid', sa.Integer, nullable=False),
+                                            sa.Column('changeid', sa.Integer, nullable=False),
+                                            )
+        self.sourcestamp_changes.create(bind=conn)
+
+    # tests
+
+    def test_migrate(self):
+        def setup_thd(conn):
+            self.create_tables_thd(conn)
+
+        def verify_thd(conn):
+            insp = reflection.Inspector.from_engine(conn)
+
+            def index_columns(table_name):
+                return dict((idx['name'], idx['column_names'])
+                            for idx in insp.get_indexes(table_name))
+
+            self.assertEqual(
+                index_columns('buildrequests').get(
+                    'buildrequests_buildername_complete'),
+                ['buildername', 'complete'])
+            self.assertEqual(
+                index_columns('buildsets').get(
+                    'buildsets_complete_complete_at'),
+                ['complete', 'complete_at'])
+            self.assertEqual(
+                index_columns('sourcestamp_changes').get(
+                    'sourcestamp_changes_changeid'),
+                ['changeid'])
+
+        return self.do_test_migration(24, 25, setup_thd, verify_thd)
@@ -21,6 +21,7 @@ from buildbot.db import pool
 from buildbot.test.util import db
 from twisted.internet import defer
 from twisted.internet import reactor
+from twisted.python import log
 from twisted.trial import unittest
 
 
@@ -78,6 +79,88 @@ class Basic(unittest.TestCase):
         d = self.pool.do_with_engine(fail)
         return self.assertFailure(d, sa.exc.OperationalError)
 
+    def test_do_metrics(self):
+        events = []
+
+        def observer(eventDict):
+            if 'metric' in eventDict:
+                events.append(eventDict['metric'])
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+        def noop(conn):
+            self.assertEqual(self.pool.outstanding, 1)
+        d = self.pool.do(noop)
+
+        def check(_):
+            self.assertEqual(self.pool.outstanding, 0)
+            depths = [(e.counter, e.count) for e in events
+                      if isinstance(e, pool.metrics.MetricCountEvent)]
+            self.assertEqual(depths, [('DBThreadPool.queue_depth', 1),
+                                      ('DBThreadPool.queue_depth', 0)])
+            waits = [e.timer for e in events
+                     if isinstance(e, pool.metrics.MetricTimeEvent)]
+            self.assertEqual(waits, ['DBThreadPool.wait'])
+        d.addCallback(check)
+        return d
+
+    def test_do_method_metrics(self):
+        events = []
+
+        def observer(eventDict):
+            if 'metric' in eventDict:
+                events.append(eventDict['metric'])
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+        # the time is attributed to the function that called do()
+        def getWidgets():
+            def thd(conn):
+                pass
+            return self.pool.do(thd)
+        d = getWidgets()
+
+        def check(_):
+            histograms = [e.histogram for e in events
+                          if isinstance(e, pool.metrics.MetricHistogramEvent)]
+            self.assertEqual(histograms, [
+                'DBConnector.test_db_pool.getWidgets.wait',
+                'DBConnector.test_db_pool.getWidgets.execute'])
+        d.addCallback(check)
+        return d
+
+    def test_slow_query_log(self):
+        messages = []
+
+        def observer(eventDict):
+            if not eventDict.get('metric'):
+                messages.append(log.textFromEventDict(eventDict))
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+        def fast(conn):
+            pass
+
+        def slow(conn):
+            time.sleep(0.02)
+
+        def runSlow(_):
+            return self.pool.do(slow)
+        self.pool.slow_query_threshold = 0.01
+        d = self.pool.do(fast)
+        d.addCallback(runSlow)
+
+        def check(_):
+            # the first query may also be slow, while the connection is set
+            # up, so only look for the one that must be logged
+            slow_messages = [m for m in messages
+                             if m.startswith('slow database query')
+                             and 'runSlow' in m]
+            self.assertEqual(len(slow_messages), 1)
+            self.assertIn('test_db_pool.runSlow took', slow_messages[0])
+        d.addCallback(check)
+        return d
+
     def test_persistence_across_invocations(self):
         # NOTE: this assumes that both methods are called with the same
         # connection; if they run in parallel threads then it is not valid to
@@ -97,6 +180,31 @@ class Basic(unittest.TestCase):
         return d
 
 
+class PoolSize(unittest.TestCase):
+
+    def do_test_pool_size(self, optimal_thread_pool_size, expected, **kwargs):
+        engine = sa.create_engine('sqlite://')
+        if optimal_thread_pool_size is not None:
+            engine.optimal_thread_pool_size = optimal_thread_pool_size
+        p = pool.DBThreadPool(engine, **kwargs)
+        self.addCleanup(p.shutdown)
+        self.assertEqual(p.max, expected)
+        # run a job, so that the pool is started before it is shut down
+        return p.do(lambda conn: None)
+
+    def test_default(self):
+        return self.do_test_pool_size(None, 5)
+
+    def test_optimal(self):
+        return self.do_test_pool_size(3, 3)
+
+    def test_explicit(self):
+        return self.do_test_pool_size(None, 8, pool_size=8)
+
+    def test_explicit_capped_by_optimal(self):
+        return self.do_test_pool_size(1, 1, pool_size=8)
+
+
 class Stress(unittest.TestCase):
 
     def setUp(self):
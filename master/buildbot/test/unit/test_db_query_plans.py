@@ -0,0 +1,192 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import re
+
+from buildbot.db import buildrequests
+from buildbot.db import builds
+from buildbot.db import buildsets
+from buildbot.db import changes
+from buildbot.db import sourcestamps
+from buildbot.test.fake import fakedb
+from buildbot.test.util import connector_component
+from buildbot.util import sautils
+from twisted.internet import defer
+from twisted.trial import unittest
+
+
+class QueryPlans(connector_component.ConnectorComponentMixin,
+                 unittest.TestCase):
+
+    """
+    Check that the queries run most often use an index, rather than scanning
+    a whole table.  This uses SQLite's EXPLAIN QUERY PLAN, and is skipped for
+    other databases.
+    """
+
+    # tables that grow without bound, and so must never be scanned
+    large_tables = ['buildrequests', 'buildrequest_claims', 'builds',
+                    'buildsets', 'buildset_properties', 'changes',
+                    'change_files', 'change_properties', 'sourcestamps',
+                    'sourcestamp_changes', 'sourcestampsets', 'patches']
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield self.setUpConnectorComponent(
+            table_names=['objects', 'users', 'scheduler_changes',
+                         'change_users'] + self.large_tables)
+
+        if self.db_engine.dialect.name != 'sqlite':
+            raise unittest.SkipTest("query plans are only checked on SQLite")
+        if sautils.sa_version() < (0, 7, 0):
+            raise unittest.SkipTest("statement recording needs SQLAlchemy "
+                                    "0.7 or higher")
+
+        self.db.buildrequests = \
+            buildrequests.BuildRequestsConnectorComponent(self.db)
+        self.db.builds = builds.BuildsConnectorComponent(self.db)
+        self.db.buildsets = buildsets.BuildsetsConnectorComponent(self.db)
+        self.db.changes = changes.ChangesConnectorComponent(self.db)
+        self.db.sourcestamps = \
+            sourcestamps.SourceStampsConnectorComponent(self.db)
+        self.db.master.getObjectId = lambda: defer.succeed(5)
+
+        yield self.insertTestData([
+            fakedb.Object(id=5),
+            fakedb.Change(changeid=12),
+            fakedb.Change(changeid=13),
+            fakedb.SourceStampSet(id=234),
+            fakedb.SourceStamp(id=234, sourcestampsetid=234),
+            fakedb.SourceStampChange(sourcestampid=234, changeid=13),
+            fakedb.Buildset(id=20, sourcestampsetid=234),
+            fakedb.BuildRequest(id=44, buildsetid=20),
+            fakedb.Build(id=50, brid=44),
+        ])
+
+        # record each statement, with its parameters; the engine is discarded
+        # with the test, so the listener need not be removed
+        self.statements = []
+        from sqlalchemy import event
+        event.listen(self.db_engine, 'before_cursor_execute',
+                     self.recordStatement)
+
+    def tearDown(self):
+        return self.tearDownConnectorComponent()
+
+    def recordStatement(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        if not executemany:
+            self.statements.append((statement, parameters))
+
+    scan_re = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+    def assertNoTableScans(self, kinds=('SELECT', 'UPDATE', 'DELETE')):
+        statements, self.statements = self.statements, []
+        statements = [(stmt, params) for stmt, params in statements
+                      if stmt.split(None, 1)[0].upper() in kinds]
+        self.assertNotEqual(statements, [], "no statements recorded")
+
+        def thd(conn):
+            scans = []
+            for stmt, params in statements:
+                cursor = conn.connection.cursor()
+                cursor.execute("EXPLAIN QUERY PLAN " + stmt, params)
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    mo = self.scan_re.match(detail)
+                    if mo and mo.group(1) in self.large_tables:
+                        scans.append('%s: %s' % (detail, stmt))
+                cursor.close()
+            return scans
+        d = self.db.pool.do(thd)
+
+        @d.addCallback
+        def check(scans):
+            if scans:
+                self.fail("full table scans:\n" + "\n".join(scans))
+        return d
+
+    # tests
+
+    @defer.inlineCallbacks
+    def test_getBuildRequests_unclaimed_for_builder(self):
+        yield self.db.buildrequests.getBuildRequests(
+            buildername='bldr', claimed=False, complete=False)
+        yield self.assertNoTableScans()
+
+    @defer.inlineCallbacks
+    def test_getBuildRequests_unclaimed_above_watermark(self):
+        yield self.db.buildrequests.getBuildRequests(claimed=False,
+                                                     min_brid=40)
+        yield self.assertNoTableScans()
+
+    @defer.inlineCallbacks
+    def test_getUnclaimedBuildRequestsChecksum(self):
+        yield self.db.buildrequests.getUnclaimedBuildRequestsChecksum(
+            max_brid=40)
+        yield self.assertNoTableScans()
+
+    @defer.inlineCallbacks
+    def test_getUnclaimedBuildRequestSummaries(self):
+        yield self.db.buildrequests.getUnclaimedBuildRequestSummaries()
+        yield self.assertNoTableScans()
+
+    @defer.inlineCallbacks
+    def test_getBuildRequests_for_buildset(self):
+        yield self.db.buildrequests.getBuildRequests(bsid=20)
+        yield self.assertNoTableScans()
+
+    @defer.inlineCallbacks
+    def test_claim_and_complete(self):
+        yield self.db.buildrequests.getBuildRequest(44)
+        yield self.db.buildrequests.claimBuildRequests([44])
+        yield self.db.buildrequests.reclaimBuildRequests([44])
+        yield self.db.buildrequests.completeBuildRequests([44], 0)
+        yield self.assertNoTableScans()
+
+    @defer.inlineCallbacks
+    def test_builds(self):
+        yield self.db.builds.getBuildsForRequest(44)
+        yield self.db.builds.finishBuilds([50])
+        yield self.assertNoTableScans()
+
+    @defer.inlineCallbacks
+    def test_buildsets(self):
+        yield self.db.buildsets.getBuildset(20)
+        yield self.db.buildsets.getBuildsetProperties(20, no_cache=True)
+        yield self.db.buildsets.completeBuildset(20, 0)
+        yield self.assertNoTableScans()
+
+    @defer.inlineCallbacks
+    def test_pruneBuildsets(self):
+        yield self.db.buildsets.pruneBuildsets(1)
+        yield self.assertNoTableScans()
+
+    @defer.inlineCallbacks
+    def test_changes(self):
+        yield self.db.changes.getLatestChangeid()
+        yield self.db.changes.getChangesInRange(10, 20)
+        yield self.db.changes.getChanges([13])
+        yield self.db.changes.getChange(13, no_cache=True)
+        yield self.db.sourcestamps.getSourceStamps(234)
+        yield self.db.sourcestamps.getSourceStamp(234, no_cache=True)
+        yield self.assertNoTableScans()
+
+    @defer.inlineCallbacks
+    def test_pruneChanges(self):
+        # finding the changes to prune reads the primary key index, but the
+        # deletions should not scan the tables that refer to changes
+        yield self.db.changes.pruneChanges(1)
+        yield self.assertNoTableScans(kinds=('DELETE',))
@@ -16,6 +16,8 @@
 from buildbot.db import state
 from buildbot.test.fake import fakedb
 from buildbot.test.util import connector_component
+from twisted.internet import defer
+from twisted.internet import task
 from twisted.trial import unittest
 
 
@@ -190,3 +192,127 @@ class TestStateConnectorComponent(
             return self.db.pool.do(thd)
         d.addCallback(check)
         return d
+
+
+class TestStateWriteBehind(
+    connector_component.ConnectorComponentMixin,
+        unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield self.setUpConnectorComponent(
+            table_names=['objects', 'object_state'])
+        self.db.state = state.StateConnectorComponent(self.db)
+        self.clock = self.db.state._reactor = task.Clock()
+        yield self.db.state.setFlushInterval(5)
+        yield self.insertTestData([
+            fakedb.Object(id=10, name='-', class_name='-'),
+            fakedb.ObjectState(objectid=10, name='x', value_json='"y"'),
+        ])
+
+    def tearDown(self):
+        return self.tearDownConnectorComponent()
+
+    def getRows(self):
+        def thd(conn):
+            q = self.db.model.object_state.select()
+            return sorted([(r.objectid, r.name, r.value_json)
+                           for r in conn.execute(q).fetchall()])
+        return self.db.pool.do(thd)
+
+    def setRow(self, value_json):
+        # simulate a change that bypasses the cache
+        def thd(conn):
+            tbl = self.db.model.object_state
+            conn.execute(tbl.update(), value_json=value_json)
+        return self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def test_getState_cached(self):
+        val = yield self.db.state.getState(10, 'x')
+        self.assertEqual(val, 'y')
+        yield self.setRow('"z"')
+        val = yield self.db.state.getState(10, 'x')
+        self.assertEqual(val, 'y')
+
+    @defer.inlineCallbacks
+    def test_getState_missing_not_cached(self):
+        val = yield self.db.state.getState(10, 'nosuch', None)
+        self.assertEqual(val, None)
+        yield self.insertTestData([
+            fakedb.ObjectState(objectid=10, name='nosuch', value_json='1'),
+        ])
+        val = yield self.db.state.getState(10, 'nosuch', None)
+        self.assertEqual(val, 1)
+
+    @defer.inlineCallbacks
+    def test_getState_copies(self):
+        yield self.db.state.setState(10, 'l', [1])
+        val = yield self.db.state.getState(10, 'l')
+        val.append(2)
+        val = yield self.db.state.getState(10, 'l')
+        self.assertEqual(val, [1])
+
+    @defer.inlineCallbacks
+    def test_setState_coalesced(self):
+        yield self.db.state.setState(10, 'x', 1)
+        yield self.db.state.setState(10, 'x', 2)
+        yield self.db.state.setState(10, 'new', [3])
+
+        # reads see the new values before they are written
+        val = yield self.db.state.getState(10, 'x')
+        self.assertEqual(val, 2)
+        rows = yield self.getRows()
+        self.assertEqual(rows, [(10, 'x', '"y"')])
+
+        # the timer writes them all
+        self.clock.advance(5)
+        yield self.db.state._flush_lock.run(lambda: None)
+        rows = yield self.getRows()
+        self.assertEqual(rows, [(10, 'new', '[3]'), (10, 'x', '2')])
+        self.assertEqual(self.db.state._flush_call, None)
+
+    @defer.inlineCallbacks
+    def test_setState_badjson(self):
+        yield self.assertFailure(
+            self.db.state.setState(10, 'x', object()), TypeError)
+        self.assertEqual(self.db.state._flush_call, None)
+
+    @defer.inlineCallbacks
+    def test_flushState(self):
+        yield self.db.state.setState(10, 'x', 1)
+        yield self.db.state.flushState()
+        rows = yield self.getRows()
+        self.assertEqual(rows, [(10, 'x', '1')])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    @defer.inlineCallbacks
+    def test_flushState_failure_retried(self):
+        yield self.db.state.setState(10, 'x', 1)
+
+        real_thd = self.db.state._setState_thd
+
+        def failing_thd(conn, objectid, name, value_json):
+            raise RuntimeError("oh noes")
+        self.db.state._setState_thd = failing_thd
+        yield self.assertFailure(self.db.state.flushState(), RuntimeError)
+
+        # the value is kept, and written by the rescheduled flush
+        self.db.state._setState_thd = real_thd
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(5)
+        yield self.db.state._flush_lock.run(lambda: None)
+        rows = yield self.getRows()
+        self.assertEqual(rows, [(10, 'x', '1')])
+
+    @defer.inlineCallbacks
+    def test_setFlushInterval_None(self):
+        yield self.db.state.setState(10, 'x', 1)
+        yield self.db.state.setFlushInterval(None)
+        rows = yield self.getRows()
+        self.assertEqual(rows, [(10, 'x', '1')])
+
+        # and the cache is no longer used
+        yield self.setRow('"z"')
+        val = yield self.db.state.getState(10, 'x')
+        self.assertEqual(val, 'z')
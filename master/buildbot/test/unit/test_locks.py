@@ -0,0 +1,242 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+
+from buildbot import locks
+from buildbot.process import metrics
+from buildbot.util import eventual
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.trial import unittest
+
+
+class BaseLock(unittest.TestCase):
+
+    def setUp(self):
+        self.lockid = locks.MasterLock('lock', maxCount=2)
+        self.lock = locks.RealMasterLock(self.lockid)
+        self.clock = self.lock._reactor = task.Clock()
+        self.counting = self.lockid.access('counting')
+        self.exclusive = self.lockid.access('exclusive')
+        self.woken = []
+
+    def wait(self, owner, access):
+        d = self.lock.waitUntilMaybeAvailable(owner, access)
+        d.addCallback(lambda _: self.woken.append(owner))
+        return d
+
+    @defer.inlineCallbacks
+    def test_waiters_woken_in_order(self):
+        self.lock.claim('a', self.exclusive)
+        for owner in 'bcde':
+            self.wait(owner, self.counting)
+
+        self.lock.release('a', self.exclusive)
+        yield eventual.flushEventualQueue()
+        # only the two waiters that can hold the lock are woken
+        self.assertEqual(self.woken, ['b', 'c'])
+        self.assertEqual(sorted(self.lock.waiting), ['d', 'e'])
+
+        self.lock.claim('b', self.counting)
+        self.lock.release('b', self.counting)
+        yield eventual.flushEventualQueue()
+        self.assertEqual(self.woken, ['b', 'c', 'd'])
+
+    @defer.inlineCallbacks
+    def test_exclusive_not_starved(self):
+        self.lock.claim('a', self.counting)
+        self.wait('b', self.exclusive)
+
+        # the lock has a free slot, but 'c' may not jump ahead of 'b'
+        self.assertFalse(self.lock.isAvailable('c', self.counting))
+        self.wait('c', self.counting)
+
+        self.lock.release('a', self.counting)
+        yield eventual.flushEventualQueue()
+        self.assertEqual(self.woken, ['b'])
+
+        self.lock.claim('b', self.exclusive)
+        self.lock.release('b', self.exclusive)
+        yield eventual.flushEventualQueue()
+        self.assertEqual(self.woken, ['b', 'c'])
+
+    @defer.inlineCallbacks
+    def test_handed_off_lock_is_reserved(self):
+        self.lock.claim('a', self.exclusive)
+        self.wait('b', self.exclusive)
+
+        self.lock.release('a', self.exclusive)
+        yield eventual.flushEventualQueue()
+        # a newcomer cannot take the lock from 'b' before it claims it
+        self.assertFalse(self.lock.isAvailable('c', self.counting))
+        self.assertTrue(self.lock.isAvailable('b', self.exclusive))
+
+        self.lock.claim('b', self.exclusive)
+        self.assertEqual(self.lock.reserved, {})
+        self.assertTrue(self.lock.isOwner('b', self.exclusive))
+
+    @defer.inlineCallbacks
+    def test_stopWaiting_passes_lock_on(self):
+        self.lock.claim('a', self.exclusive)
+        d = self.lock.waitUntilMaybeAvailable('b', self.exclusive)
+        self.wait('c', self.exclusive)
+
+        self.lock.release('a', self.exclusive)
+        # 'b' gives up before it is woken
+        self.lock.stopWaitingUntilAvailable('b', self.exclusive, d)
+        d.callback(None)
+        yield eventual.flushEventualQueue()
+        self.assertEqual(self.woken, ['c'])
+        self.assertEqual(self.lock.reserved.keys(), ['c'])
+
+    @defer.inlineCallbacks
+    def test_stopWaiting_while_queued(self):
+        self.lock.claim('a', self.exclusive)
+        d = self.lock.waitUntilMaybeAvailable('b', self.exclusive)
+        self.wait('c', self.exclusive)
+
+        self.lock.stopWaitingUntilAvailable('b', self.exclusive, d)
+        self.lock.release('a', self.exclusive)
+        yield eventual.flushEventualQueue()
+        self.assertEqual(self.woken, ['c'])
+        self.assertEqual(self.lock.waiting, {})
+
+    def test_metrics(self):
+        self.patch(metrics.MetricCountEvent, 'log', mock.Mock())
+        self.patch(metrics.MetricHistogramEvent, 'log', mock.Mock())
+
+        self.lock.claim('a', self.exclusive)
+        self.wait('b', self.counting)
+        metrics.MetricCountEvent.log.assert_called_with(
+            'MasterLock.lock.queue_length', 1, absolute=True)
+
+        self.clock.advance(30)
+        self.lock.release('a', self.exclusive)
+        metrics.MetricCountEvent.log.assert_called_with(
+            'MasterLock.lock.queue_length', 0, absolute=True)
+        self.lock.claim('b', self.counting)
+        metrics.MetricHistogramEvent.log.assert_called_with(
+            'MasterLock.lock.wait', 30)
+        return eventual.flushEventualQueue()
+
+
+class Owner(object):
+
+    """Takes several locks the way L{Build.acquireLocks} does."""
+
+    def __init__(self, locks):
+        self.locks = locks
+        self.stopped = False
+        self.acquired = False
+        self._acquiringLock = None
+
+    def acquireLocks(self, res=None):
+        self._acquiringLock = None
+        if self.stopped:
+            return
+        for lock, access in self.locks:
+            if not lock.isAvailable(self, access):
+                for other, _ in self.locks:
+                    if other is not lock:
+                        other.releaseReservation(self)
+                d = lock.waitUntilMaybeAvailable(self, access)
+                d.addCallback(self.acquireLocks)
+                self._acquiringLock = (lock, access, d)
+                return
+        for lock, access in self.locks:
+            lock.claim(self, access)
+        self.acquired = True
+
+    def releaseLocks(self):
+        for lock, access in self.locks:
+            lock.release(self, access)
+
+    def stop(self):
+        self.stopped = True
+        if self._acquiringLock:
+            lock, access, d = self._acquiringLock
+            lock.stopWaitingUntilAvailable(self, access, d)
+            d.callback(None)
+
+
+class SeveralLocks(unittest.TestCase):
+
+    def setUp(self):
+        self.locks = {}
+        for name in 'ABCD':
+            lockid = locks.MasterLock(name)
+            self.locks[name] = (locks.RealMasterLock(lockid),
+                                lockid.access('exclusive'))
+
+    def makeOwner(self, names):
+        return Owner([self.locks[name] for name in names])
+
+    @defer.inlineCallbacks
+    def test_opposite_orders(self):
+        x = self.makeOwner('AB')
+        x.acquireLocks()
+        b1 = self.makeOwner('AB')
+        b2 = self.makeOwner('BA')
+        b1.acquireLocks()
+        b2.acquireLocks()
+
+        x.releaseLocks()
+        yield eventual.flushEventualQueue()
+        # one of them got both locks, and the other waits for it rather
+        # than keeping one of the locks
+        self.assertEqual(sorted([b1.acquired, b2.acquired]), [False, True])
+
+        (b1 if b1.acquired else b2).releaseLocks()
+        yield eventual.flushEventualQueue()
+        self.assertTrue(b1.acquired and b2.acquired)
+
+    @defer.inlineCallbacks
+    def test_stop_while_waiting_for_second_lock(self):
+        x = self.makeOwner('C')
+        x.acquireLocks()
+        y = self.makeOwner('D')
+        y.acquireLocks()
+        b = self.makeOwner('CD')
+        b.acquireLocks()
+
+        # C is handed to b, which then waits for D
+        x.releaseLocks()
+        yield eventual.flushEventualQueue()
+        self.assertIdentical(b._acquiringLock[0], self.locks['D'][0])
+
+        b.stop()
+        y.releaseLocks()
+        yield eventual.flushEventualQueue()
+        for name in 'CD':
+            lock, access = self.locks[name]
+            self.assertEqual((lock.reserved, lock.waiting), ({}, {}))
+        c = self.makeOwner('CD')
+        c.acquireLocks()
+        self.assertTrue(c.acquired)
+
+
+class RealSlaveLock(unittest.TestCase):
+
+    def test_getLock(self):
+        lockid = locks.SlaveLock('lock', maxCount=1,
+                                 maxCountForSlave={'big': 4})
+        lock = locks.RealSlaveLock(lockid)
+        slave = mock.Mock(slavename='big')
+
+        real = lock.getLock(slave)
+        self.assertIdentical(lock.getLock(slave), real)
+        self.assertEqual(real.maxCount, 4)
+        self.assertEqual(real.metricName, 'SlaveLock.lock.big')
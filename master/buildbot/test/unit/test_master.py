@@ -217,6 +217,84 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_addBuildsets_batched(self):
+        self.master.db = mock.Mock()
+        self.master.db.buildsets.addBuildsets.return_value = \
+            defer.succeed([(10, dict(a=19)), (11, dict(a=20, b=21)),
+                           (12, dict(b=22))])
+        self.master.buildRequestAdded = mock.Mock()
+        clock = self.master._addBuildsetsBatcher._reactor = task.Clock()
+
+        cb = mock.Mock()
+        self.master.subscribeToBuildsets(cb)
+
+        bs1 = dict(sourcestampsetid=1, reason='r1')
+        bs2 = dict(sourcestamps=[], reason='r2')
+        bs3 = dict(sourcestampsetid=3, reason='r3')
+        d1 = self.master.addBuildsets([bs1, bs2])
+        d2 = self.master.addBuildsets([bs3])
+        clock.advance(0)
+
+        # both calls went to the database together, in order
+        self.master.db.buildsets.addBuildsets.assert_called_once_with(
+            [bs1, bs2, bs3])
+        self.assertEqual(self.successResultOf(d1),
+                         [(10, dict(a=19)), (11, dict(a=20, b=21))])
+        self.assertEqual(self.successResultOf(d2), [(12, dict(b=22))])
+        self.assertEqual(cb.call_args_list, [
+            mock.call(bsid=10, sourcestampsetid=1, reason='r1'),
+            mock.call(bsid=11, sourcestamps=[], reason='r2'),
+            mock.call(bsid=12, sourcestampsetid=3, reason='r3')])
+        self.assertEqual(sorted(c[1] for c in
+                                self.master.buildRequestAdded.call_args_list),
+                         sorted([dict(bsid=10, brid=19, buildername='a'),
+                                 dict(bsid=11, brid=20, buildername='a'),
+                                 dict(bsid=11, brid=21, buildername='b'),
+                                 dict(bsid=12, brid=22, buildername='b')]))
+
+    def test_addBuildsets_batch_with_invalid_buildset(self):
+        bs1 = dict(sourcestampsetid=1, reason='r1')
+        bs2 = dict(sourcestampsetid=2, reason='x' * 1000)
+        bs3 = dict(sourcestampsetid=3, reason='r3')
+        bsids = {'r1': 10, 'r3': 12}
+
+        def addBuildsets(buildsets):
+            if bs2 in buildsets:
+                return defer.fail(RuntimeError("reason is too long"))
+            rv = []
+            for bs in buildsets:
+                bsid = bsids[bs['reason']]
+                rv.append((bsid, dict(a=bsid + 10)))
+            return defer.succeed(rv)
+        self.master.db = mock.Mock()
+        self.master.db.buildsets.addBuildsets.side_effect = addBuildsets
+        self.master.buildRequestAdded = mock.Mock()
+        clock = self.master._addBuildsetsBatcher._reactor = task.Clock()
+
+        cb = mock.Mock()
+        self.master.subscribeToBuildsets(cb)
+
+        d1 = self.master.addBuildsets([bs1])
+        d2 = self.master.addBuildsets([bs2])
+        d3 = self.master.addBuildsets([bs3])
+        clock.advance(0)
+
+        # the batch failed, so each call's buildsets were added separately
+        self.assertEqual(
+            self.master.db.buildsets.addBuildsets.call_args_list,
+            [mock.call([bs1, bs2, bs3]), mock.call([bs1]), mock.call([bs2]),
+             mock.call([bs3])])
+        self.assertEqual(self.successResultOf(d1), [(10, dict(a=20))])
+        self.failureResultOf(d2, RuntimeError)
+        self.assertEqual(self.successResultOf(d3), [(12, dict(a=22))])
+        self.assertEqual(cb.call_args_list, [
+            mock.call(bsid=10, sourcestampsetid=1, reason='r1'),
+            mock.call(bsid=12, sourcestampsetid=3, reason='r3')])
+        self.assertEqual(sorted(c[1] for c in
+                                self.master.buildRequestAdded.call_args_list),
+                         [dict(bsid=10, brid=20, buildername='a'),
+                          dict(bsid=12, brid=22, buildername='a')])
+
     def test_buildset_completion_subscription(self):
         self.master.db = mock.Mock()
 
@@ -510,6 +588,54 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_pollDatabaseChanges_batches(self):
+        self.master.CHANGE_POLL_BATCH_SIZE = 2
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+        ] + [fakedb.Change(changeid=n) for n in range(10, 16)])
+        d = self.master.pollDatabaseChanges()
+
+        def check(_):
+            self.assertEqual([ch.number for ch in self.gotten_changes],
+                             [11, 12, 13, 14, 15])
+            self.db.state.assertState(53, last_processed_change=15)
+        d.addCallback(check)
+        return d
+
+    def test_pollDatabaseChanges_gap(self):
+        # a missing changeid may still be being inserted, so polling stops
+        # there and resumes from the same point next time
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+            fakedb.Change(changeid=13),
+        ])
+        d = self.master.pollDatabaseChanges()
+
+        def check(_):
+            self.assertEqual([ch.number for ch in self.gotten_changes], [11])
+            self.db.state.assertState(53, last_processed_change=11)
+        d.addCallback(check)
+
+        def fill_gap(_):
+            self.db.insertTestData([fakedb.Change(changeid=12)])
+            return self.master.pollDatabaseChanges()
+        d.addCallback(fill_gap)
+
+        def check_again(_):
+            self.assertEqual([ch.number for ch in self.gotten_changes],
+                             [11, 12, 13])
+            self.db.state.assertState(53, last_processed_change=13)
+        d.addCallback(check_again)
+        return d
+
     def test_pollDatabaseChanges_nothing_new(self):
         self.db.insertTestData([
             fakedb.Object(id=53, name='master',
@@ -553,6 +679,87 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_pollDatabaseBuildRequests_watermark(self):
+        d = defer.succeed(None)
+
+        def insert1(_):
+            self.db.insertTestData([
+                fakedb.BuildRequest(id=11, buildsetid=9, buildername='eleventy'),
+                fakedb.BuildRequest(id=12, buildsetid=9, buildername='twelve'),
+            ])
+        d.addCallback(insert1)
+        d.addCallback(lambda _: self.master.pollDatabaseBuildRequests())
+
+        def insert2(_):
+            self.gotten_buildrequest_additions.append('MARK')
+            self.db.insertTestData([
+                fakedb.BuildRequest(id=20, buildsetid=9,
+                                    buildername='twenty'),
+            ])
+            self.patch(self.db.buildrequests, 'getBuildRequests',
+                       mock.Mock(wraps=self.db.buildrequests.getBuildRequests))
+        d.addCallback(insert2)
+        d.addCallback(lambda _: self.master.pollDatabaseBuildRequests())
+
+        def check(_):
+            # nothing old changed, so only newer requests were fetched
+            self.db.buildrequests.getBuildRequests.assert_called_once_with(
+                claimed=False, min_brid=13)
+            self.assertEqual(self.gotten_buildrequest_additions, [
+                dict(bsid=9, brid=11, buildername='eleventy'),
+                dict(bsid=9, brid=12, buildername='twelve'),
+                'MARK',
+                dict(bsid=9, brid=20, buildername='twenty'),
+            ])
+            self.assertEqual(self.master._last_unclaimed_brids_set,
+                             set([11, 12, 20]))
+        d.addCallback(check)
+
+        def claim(_):
+            self.db.buildrequests.fakeClaimBuildRequest(12)
+        d.addCallback(claim)
+        d.addCallback(lambda _: self.master.pollDatabaseBuildRequests())
+
+        def check_claimed(_):
+            # the claim is detected and the requests rescanned
+            self.db.buildrequests.getBuildRequests.assert_called_with(
+                claimed=False)
+            self.assertEqual(self.master._last_unclaimed_brids_set,
+                             set([11, 20]))
+        d.addCallback(check_claimed)
+        return d
+
+    def test_pollDatabaseBuildRequests_same_count_and_sum(self):
+        d = defer.succeed(None)
+
+        def insert(_):
+            self.db.insertTestData([
+                fakedb.BuildRequest(id=brid, buildsetid=9, buildername='b')
+                for brid in (1, 2, 3, 4)])
+            self.db.buildrequests.fakeClaimBuildRequest(2)
+            self.db.buildrequests.fakeClaimBuildRequest(3)
+        d.addCallback(insert)
+        d.addCallback(lambda _: self.master.pollDatabaseBuildRequests())
+
+        def swap(_):
+            self.gotten_buildrequest_additions.append('MARK')
+            # {1, 4} becomes {2, 3}: same count, same sum of ids
+            self.db.buildrequests.fakeClaimBuildRequest(1)
+            self.db.buildrequests.fakeClaimBuildRequest(4)
+            self.db.buildrequests.fakeUnclaimBuildRequest(2)
+            self.db.buildrequests.fakeUnclaimBuildRequest(3)
+        d.addCallback(swap)
+        d.addCallback(lambda _: self.master.pollDatabaseBuildRequests())
+
+        def check(_):
+            self.assertEqual(self.master._last_unclaimed_brids_set,
+                             set([2, 3]))
+            self.assertEqual(self.gotten_buildrequest_additions[3:],
+                             [dict(bsid=9, brid=2, buildername='b'),
+                              dict(bsid=9, brid=3, buildername='b')])
+        d.addCallback(check)
+        return d
+
     def test_pollDatabaseBuildRequests_incremental(self):
         d = defer.succeed(None)
 
@@ -0,0 +1,122 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+
+from buildbot.process import affinity
+from twisted.internet import task
+from twisted.trial import unittest
+
+
+class WorkspaceAffinity(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(1000)
+        self.affinity = affinity.WorkspaceAffinity(maxWait=60)
+        self.affinity._reactor = self.clock
+
+        self.bldr = mock.Mock()
+        self.bldr.name = 'bldr'
+        self.bldr.slaves = []
+
+    def makeSlave(self, name):
+        sb = mock.Mock()
+        sb.slave.slavename = name
+        self.bldr.slaves.append(sb)
+        return sb
+
+    def makeBreq(self, branch='master', submittedAt=1000):
+        breq = mock.Mock()
+        ss = mock.Mock()
+        ss.repository = 'git://a'
+        ss.branch = branch
+        breq.sources = {'': ss}
+        breq.submittedAt = submittedAt
+        return breq
+
+    def start(self, sb, breq=None):
+        # run a build through the affinity, as the builder would
+        breq = breq or self.makeBreq()
+        self.assertTrue(self.affinity(self.bldr, sb, breq))
+        self.affinity.buildStarted(self.bldr, sb, [breq])
+
+    def test_first_build_is_miss(self):
+        sb1 = self.makeSlave('s1')
+        self.start(sb1)
+        self.assertEqual((self.affinity.hits, self.affinity.misses), (0, 1))
+        self.assertEqual(self.affinity.lastSlaves.values(), ['s1'])
+
+    def test_not_counted_until_started(self):
+        sb1 = self.makeSlave('s1')
+        sb2 = self.makeSlave('s2')
+        self.assertTrue(self.affinity(self.bldr, sb1, self.makeBreq()))
+        self.assertTrue(self.affinity(self.bldr, sb1, self.makeBreq()))
+        self.assertEqual((self.affinity.hits, self.affinity.misses), (0, 0))
+        self.assertEqual(self.affinity.lastSlaves, {})
+
+        # s1 failed to start the build, so s2 is not refused
+        self.assertTrue(self.affinity(self.bldr, sb2, self.makeBreq()))
+
+    def test_prefers_last_slave(self):
+        sb1 = self.makeSlave('s1')
+        sb2 = self.makeSlave('s2')
+        self.start(sb1)
+
+        self.assertFalse(self.affinity(self.bldr, sb2, self.makeBreq()))
+        self.start(sb1)
+        self.assertEqual((self.affinity.hits, self.affinity.misses), (1, 1))
+
+    def test_other_branch_not_affected(self):
+        sb1 = self.makeSlave('s1')
+        sb2 = self.makeSlave('s2')
+        self.start(sb1)
+
+        self.assertTrue(self.affinity(self.bldr, sb2,
+                                      self.makeBreq(branch='dev')))
+
+    def test_last_slave_detached(self):
+        sb1 = self.makeSlave('s1')
+        sb2 = self.makeSlave('s2')
+        self.start(sb1)
+        self.bldr.slaves.remove(sb1)
+
+        self.start(sb2)
+        self.assertEqual(self.affinity.lastSlaves.values(), ['s2'])
+
+    def test_wait_expires(self):
+        sb1 = self.makeSlave('s1')
+        sb2 = self.makeSlave('s2')
+        self.start(sb1)
+
+        self.clock.advance(61)
+        self.start(sb2)
+        self.assertEqual((self.affinity.hits, self.affinity.misses), (0, 2))
+
+    def test_retry_when_wait_expires(self):
+        sb1 = self.makeSlave('s1')
+        sb2 = self.makeSlave('s2')
+        self.start(sb1)
+
+        self.clock.advance(20)
+        self.affinity(self.bldr, sb2, self.makeBreq())
+        # a second refusal does not add another timer
+        self.affinity(self.bldr, sb2, self.makeBreq())
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+        self.clock.advance(40)
+        self.bldr.botmaster.maybeStartBuildsForBuilder.assert_called_once_with(
+            'bldr')
+        self.assertEqual(self.affinity.timers, {})
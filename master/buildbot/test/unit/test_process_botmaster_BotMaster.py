@@ -151,6 +151,7 @@ class TestBotMaster(unittest.TestCase):
                    mock.Mock())
 
         new_config = mock.Mock()
+        new_config.distributorConcurrency = 4
         d = self.botmaster.reconfigService(new_config)
 
         @d.addCallback
@@ -161,6 +162,7 @@ class TestBotMaster(unittest.TestCase):
                 new_config)
             self.assertTrue(
                 self.botmaster.maybeStartBuildsForAllBuilders.called)
+            self.assertEqual(self.botmaster.brd.max_concurrency, 4)
         return d
 
     @defer.inlineCallbacks
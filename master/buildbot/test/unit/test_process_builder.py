@@ -19,10 +19,15 @@ import random
 from buildbot import config
 from buildbot.process import builder
 from buildbot.process import factory
+from buildbot.process import properties
+from buildbot.status.results import FAILURE
+from buildbot.status.results import RETRY
+from buildbot.status.results import SUCCESS
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
 from buildbot.util import epoch2datetime
 from twisted.internet import defer
+from twisted.internet import task
 from twisted.trial import unittest
 
 
@@ -303,6 +308,31 @@ class TestBuilderBuildCreation(BuilderMixin, unittest.TestCase):
         result = yield self.bldr.canStartBuild(slave, breq)
         self.assertIdentical(True, result)
 
+    def test_leastLoadedSlave(self):
+        def makeSlaveBuilder(name, running=0, **resources):
+            sb = mock.Mock(name=name)
+            sb.slave.slavebuilders = dict(
+                ('b%d' % i, mock.Mock(isBusy=lambda: True))
+                for i in range(running))
+            sb.slave.resources = resources or None
+            return sb
+
+        idle = makeSlaveBuilder('idle')
+        busy = makeSlaveBuilder('busy', running=1, load=0.0, cpus=1)
+        loaded = makeSlaveBuilder('loaded', load=8.0, cpus=4)
+        quiet = makeSlaveBuilder('quiet', load=4.0, cpus=8, free_memory=10)
+        roomy = makeSlaveBuilder('roomy', load=2.0, cpus=4, free_memory=20)
+
+        self.assertIdentical(builder.leastLoadedSlave(None, []), None)
+        self.assertIdentical(
+            builder.leastLoadedSlave(None, [busy, idle]), idle)
+        self.assertIdentical(
+            builder.leastLoadedSlave(None, [idle, loaded]), loaded)
+        self.assertIdentical(
+            builder.leastLoadedSlave(None, [loaded, quiet]), quiet)
+        self.assertIdentical(
+            builder.leastLoadedSlave(None, [quiet, roomy]), roomy)
+
 
 class TestGetOldestRequestTime(BuilderMixin, unittest.TestCase):
 
@@ -347,6 +377,274 @@ class TestGetOldestRequestTime(BuilderMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_getUnclaimedBuildRequestCount(self):
+        yield self.makeBuilder(name='bldr1')
+        yield self.db.insertTestData(self.base_rows)
+        count = yield self.bldr.getUnclaimedBuildRequestCount()
+        self.assertEqual(count, 2)
+
+    @defer.inlineCallbacks
+    def test_getUnclaimedBuildRequestCount_all_claimed(self):
+        yield self.makeBuilder(name='bldr2')
+        yield self.db.insertTestData(self.base_rows)
+        count = yield self.bldr.getUnclaimedBuildRequestCount()
+        self.assertEqual(count, 0)
+
+
+class TestBuildFinished(BuilderMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.base_rows = [
+            fakedb.SourceStampSet(id=21),
+            fakedb.SourceStamp(id=21, sourcestampsetid=21),
+            fakedb.Buildset(id=11, reason='because', sourcestampsetid=21),
+            fakedb.BuildRequest(id=111, buildername='bldr', buildsetid=11),
+            fakedb.BuildRequest(id=222, buildername='bldr', buildsetid=11),
+            fakedb.Build(id=51, brid=111, number=1),
+            fakedb.Build(id=52, brid=222, number=2),
+        ]
+
+    def makeBuild(self, brid, results):
+        build = mock.Mock(name='build')
+        build.build_status.getResults.return_value = results
+        build.requests = [mock.Mock(name='breq', id=brid, bsid=11)]
+        self.bldr.building.append(build)
+        return build
+
+    @defer.inlineCallbacks
+    def test_builds_finished_together(self):
+        yield self.makeBuilder()
+        yield self.db.insertTestData(self.base_rows)
+        clock = task.Clock()
+        botmaster = self.master.botmaster
+        botmaster.finishBuildsBatcher._reactor = clock
+        botmaster.completeBuildRequestsBatcher._reactor = clock
+        batches = []
+        completeBuildRequestsBatch = self.db.buildrequests.completeBuildRequestsBatch
+
+        def wrap(brid_results, **kwargs):
+            batches.append(brid_results)
+            return completeBuildRequestsBatch(brid_results, **kwargs)
+        self.patch(self.db.buildrequests, 'completeBuildRequestsBatch', wrap)
+        sb = mock.Mock(name='slavebuilder', slave=None)
+
+        self.bldr.buildFinished(self.makeBuild(111, SUCCESS), sb, [51])
+        self.bldr.buildFinished(self.makeBuild(222, FAILURE), sb, [52])
+        clock.advance(0)
+
+        self.assertEqual(batches, [{111: SUCCESS, 222: FAILURE}])
+        self.assertEqual(self.bldr.building, [])
+        self.assertEqual(sorted((br.id, br.results) for br in
+                                self.db.buildrequests.reqs.values()),
+                         [(111, SUCCESS), (222, FAILURE)])
+        self.assertNotEqual(self.db.builds.builds[51].finish_time, None)
+        self.assertNotEqual(self.db.builds.builds[52].finish_time, None)
+
+    @defer.inlineCallbacks
+    def test_build_retried(self):
+        yield self.makeBuilder()
+        yield self.db.insertTestData(self.base_rows + [
+            fakedb.BuildRequestClaim(
+                brid=111, objectid=fakedb.FakeBuildRequestsComponent.MASTER_ID,
+                claimed_at=1300305712)])
+        self.master.buildRequestAdded = mock.Mock()
+        sb = mock.Mock(name='slavebuilder', slave=None)
+
+        self.bldr.buildFinished(self.makeBuild(111, RETRY), sb, [51])
+        yield self.master.botmaster.finishBuildsBatcher.flush()
+
+        self.db.buildrequests.assertMyClaims([])
+        self.master.buildRequestAdded.assert_called_with(11, 111, 'bldr')
+
+
+class TestStartBuildFor(BuilderMixin, unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def makeBuilder(self, **config_kwargs):
+        yield BuilderMixin.makeBuilder(self, **config_kwargs)
+        # use the real _startBuildFor, with a fake build and slave
+        del self.bldr._startBuildFor
+        yield self.db.insertTestData([
+            fakedb.SourceStampSet(id=21),
+            fakedb.SourceStamp(id=21, sourcestampsetid=21),
+            fakedb.Buildset(id=11, reason='because', sourcestampsetid=21),
+            fakedb.BuildRequest(id=111, buildername='bldr', buildsetid=11),
+        ])
+        self.build = mock.Mock(name='build')
+        self.build.requests = [mock.Mock(name='breq', id=111)]
+        self.build.startBuild.return_value = defer.Deferred()
+        self.patch(self.factory, 'newBuild', lambda breqs: self.build)
+
+    def makeSlaveBuilder(self, ping=True):
+        sb = mock.Mock(name='slavebuilder')
+        sb.prepare.return_value = defer.succeed(True)
+        sb.ping.return_value = defer.succeed(ping)
+        sb.remote.callRemote.return_value = defer.succeed(None)
+        return sb
+
+    def makeCanStartBuild(self):
+        canStartBuild = mock.Mock(name='canStartBuild')
+        canStartBuild.return_value = True
+        return canStartBuild
+
+    @defer.inlineCallbacks
+    def test_buildStarted(self):
+        canStartBuild = self.makeCanStartBuild()
+        yield self.makeBuilder(canStartBuild=canStartBuild)
+        sb = self.makeSlaveBuilder()
+
+        started = yield self.bldr._startBuildFor(sb, self.build.requests)
+        self.assertTrue(started)
+        canStartBuild.buildStarted.assert_called_once_with(
+            self.bldr, sb, self.build.requests)
+
+    @defer.inlineCallbacks
+    def test_buildStarted_not_called_if_ping_fails(self):
+        canStartBuild = self.makeCanStartBuild()
+        yield self.makeBuilder(canStartBuild=canStartBuild)
+        sb = self.makeSlaveBuilder(ping=False)
+
+        started = yield self.bldr._startBuildFor(sb, self.build.requests)
+        self.assertFalse(started)
+        self.assertFalse(canStartBuild.buildStarted.called)
+
+
+class TestBuildAvoidance(BuilderMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.base_rows = [
+            fakedb.SourceStampSet(id=21),
+            fakedb.SourceStamp(id=21, sourcestampsetid=21),
+            fakedb.Buildset(id=11, reason='because', sourcestampsetid=21),
+            fakedb.BuildRequest(id=111, buildername='bldr', buildsetid=11),
+            fakedb.BuildRequest(id=222, buildername='bldr', buildsetid=11),
+        ]
+        self.now = 1000
+        self.patch(builder.util, 'now', lambda *args: self.now)
+
+    def makeBuilder(self, **config_kwargs):
+        d = BuilderMixin.makeBuilder(self, buildAvoidanceHorizon=3600,
+                                     **config_kwargs)
+
+        @d.addCallback
+        def patch(_):
+            self.master.botmaster.maybeStartBuildsForBuilder = mock.Mock()
+        return d
+
+    def makeBreq(self, brid, revision='abcd', patch=None, **props):
+        breq = mock.Mock(name='breq', id=brid, bsid=11)
+        ss = mock.Mock(name='ss', repository='repo', project='proj',
+                       branch='master', revision=revision, patch=patch)
+        breq.sources = {'': ss}
+        breq.properties = properties.Properties(**props)
+        return breq
+
+    def makeBuild(self, breqs, number, results=SUCCESS):
+        build = mock.Mock(name='build')
+        build.build_status.getResults.return_value = results
+        build.build_status.number = number
+        build.requests = breqs
+        self.bldr.building.append(build)
+        return build
+
+    @defer.inlineCallbacks
+    def test_getBuildFingerprint(self):
+        yield self.makeBuilder(buildAvoidanceIgnoreProperties=['nonce'])
+        fp = self.bldr.getBuildFingerprint
+
+        self.assertNotEqual(fp([self.makeBreq(1)]), None)
+        # ignored properties do not matter
+        self.assertEqual(fp([self.makeBreq(1, a=1)]),
+                         fp([self.makeBreq(2, a=1, reason='x', nonce=3)]))
+        # other properties and sources do
+        self.assertNotEqual(fp([self.makeBreq(1, a=1)]),
+                            fp([self.makeBreq(1, a=2)]))
+        self.assertNotEqual(fp([self.makeBreq(1)]),
+                            fp([self.makeBreq(1, revision='efgh')]))
+        self.assertNotEqual(fp([self.makeBreq(1)]),
+                            fp([self.makeBreq(1, patch=(1, 'diff', None))]))
+        # no fixed revision, or requests that differ, give no fingerprint
+        self.assertEqual(fp([self.makeBreq(1, revision=None)]), None)
+        self.assertEqual(fp([self.makeBreq(1, a=1), self.makeBreq(2, a=2)]),
+                         None)
+
+    @defer.inlineCallbacks
+    def test_reuse(self):
+        yield self.makeBuilder()
+        yield self.db.insertTestData(self.base_rows)
+        sb = mock.Mock(name='slavebuilder', slave=None)
+
+        self.bldr.buildFinished(self.makeBuild([self.makeBreq(111)], 7),
+                                sb, [])
+        yield self.master.botmaster.completeBuildRequestsBatcher.flush()
+
+        self.now += 60
+        started = yield self.bldr.maybeStartBuild(sb, [self.makeBreq(222)])
+        yield self.master.botmaster.completeBuildRequestsBatcher.flush()
+
+        self.assertTrue(started)
+        self.assertEqual(self.builds_started, [])
+        self.assertEqual(self.db.buildrequests.reqs[222].results, SUCCESS)
+        self.assertEqual([b.number for b in self.db.builds.builds.values()
+                          if b.brid == 222], [7])
+        self.master.botmaster.maybeStartBuildsForBuilder.assert_called_with(
+            'bldr')
+
+    @defer.inlineCallbacks
+    def test_no_reuse_after_horizon(self):
+        yield self.makeBuilder()
+        sb = mock.Mock(name='slavebuilder', slave=None)
+
+        self.bldr.buildFinished(self.makeBuild([self.makeBreq(111)], 7),
+                                sb, [])
+        self.now += 3600
+        breqs = [self.makeBreq(222)]
+        yield self.bldr.maybeStartBuild(sb, breqs)
+        self.assertEqual(self.builds_started, [(sb, breqs)])
+
+    @defer.inlineCallbacks
+    def test_no_reuse_after_failure(self):
+        yield self.makeBuilder()
+        sb = mock.Mock(name='slavebuilder', slave=None)
+
+        self.bldr.buildFinished(
+            self.makeBuild([self.makeBreq(111)], 7, FAILURE), sb, [])
+        breqs = [self.makeBreq(222)]
+        yield self.bldr.maybeStartBuild(sb, breqs)
+        self.assertEqual(self.builds_started, [(sb, breqs)])
+
+    def reconfig(self):
+        mastercfg = config.MasterConfig()
+        mastercfg.builders = [config.BuilderConfig(
+            name='bldr', slavename='slv', builddir='bdir',
+            slavebuilddir='sbdir', factory=factory.BuildFactory(),
+            buildAvoidanceHorizon=3600)]
+        return self.bldr.reconfigService(mastercfg)
+
+    @defer.inlineCallbacks
+    def test_no_reuse_after_reconfig(self):
+        yield self.makeBuilder()
+        sb = mock.Mock(name='slavebuilder', slave=None)
+
+        self.bldr.buildFinished(self.makeBuild([self.makeBreq(111)], 7),
+                                sb, [])
+        yield self.reconfig()
+        breqs = [self.makeBreq(222)]
+        yield self.bldr.maybeStartBuild(sb, breqs)
+        self.assertEqual(self.builds_started, [(sb, breqs)])
+
+    @defer.inlineCallbacks
+    def test_no_reuse_of_build_running_during_reconfig(self):
+        yield self.makeBuilder()
+        sb = mock.Mock(name='slavebuilder', slave=None)
+
+        build = self.makeBuild([self.makeBreq(111)], 7)
+        yield self.reconfig()
+        self.bldr.buildFinished(build, sb, [])
+        self.assertEqual(self.bldr.buildFingerprints, {})
+        self.assertEqual(self.bldr.oldConfigBuilds, set())
+
 
 class TestRebuild(BuilderMixin, unittest.TestCase):
 
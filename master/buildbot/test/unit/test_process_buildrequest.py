@@ -29,6 +29,11 @@ class FakeSource:
     def canBeMergedWith(self, other):
         return self.mergeable
 
+    def getMergeKey(self):
+        if self.mergeable:
+            return 'key'
+        return ('patch', id(self))
+
 
 class TestBuildRequest(unittest.TestCase):
 
@@ -351,3 +356,51 @@ class TestBuildRequest(unittest.TestCase):
         mergeable = r1.canBeMergedWith(r2)
         self.assertFalse(mergeable, "Request containing different codebases " +
                                     "should never be able to merge")
+
+    def test_getMergeKey(self):
+        r1 = buildrequest.BuildRequest()
+        r1.sources = {"A": FakeSource(), "B": FakeSource()}
+        r2 = buildrequest.BuildRequest()
+        r2.sources = {"B": FakeSource(), "A": FakeSource()}
+        self.assertEqual(r1.getMergeKey(), r2.getMergeKey())
+
+    def test_getMergeKey_different_codebases(self):
+        r1 = buildrequest.BuildRequest()
+        r1.sources = {"A": FakeSource()}
+        r2 = buildrequest.BuildRequest()
+        r2.sources = {"B": FakeSource()}
+        self.assertNotEqual(r1.getMergeKey(), r2.getMergeKey())
+
+    def test_getMergeKey_non_mergeable(self):
+        r1 = buildrequest.BuildRequest()
+        r1.sources = {"A": FakeSource(mergeable=False)}
+        r2 = buildrequest.BuildRequest()
+        r2.sources = {"A": FakeSource(mergeable=False)}
+        self.assertNotEqual(r1.getMergeKey(), r2.getMergeKey())
+
+
+class TestMergeRequestsByKey(unittest.TestCase):
+
+    def setUp(self):
+        def getMergeKey(builder, req):
+            return req.branch
+        self.mergeRequests = buildrequest.mergeRequestsByKey(getMergeKey)
+
+    def makeRequest(self, branch):
+        req = buildrequest.BuildRequest()
+        req.branch = branch
+        return req
+
+    def test_getMergeKey_attribute(self):
+        req = self.makeRequest('dev')
+        self.assertEqual(self.mergeRequests.getMergeKey(None, req), 'dev')
+
+    def test_pairwise(self):
+        dev1, dev2, rel = [self.makeRequest(b)
+                           for b in ('dev', 'dev', 'rel')]
+        self.assertTrue(self.mergeRequests(None, dev1, dev2))
+        self.assertFalse(self.mergeRequests(None, dev1, rel))
+
+    def test_pairwise_None(self):
+        self.assertFalse(self.mergeRequests(None, self.makeRequest(None),
+                                            self.makeRequest(None)))
@@ -15,8 +15,12 @@
 
 import mock
 
+from buildbot import locks
 from buildbot.db import buildrequests
+from buildbot.process import builder
+from buildbot.process import buildrequest
 from buildbot.process import buildrequestdistributor
+from buildbot.process import metrics
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
 from buildbot.test.util import compat
@@ -24,6 +28,7 @@ from buildbot.util import epoch2datetime
 from buildbot.util.eventual import fireEventually
 from twisted.internet import defer
 from twisted.internet import reactor
+from twisted.internet import task
 from twisted.python import failure
 from twisted.trial import unittest
 
@@ -217,6 +222,130 @@ class Test(unittest.TestCase):
         self.quiet_deferred.addCallback(check)
         return self.quiet_deferred
 
+    def useControlled_maybeStartBuildsOnBuilder(self):
+        # sets up a "maybeStartBuildsOnBuilder" that only finishes when the
+        # test says so
+        self.maybeStartBuildsOnBuilder_calls = []
+        self.builderDeferreds = {}
+        # the loop may go quiet synchronously, so keep a reference
+        self.quiet = self.quiet_deferred
+
+        def maybeStartBuildsOnBuilder(bldr):
+            self.maybeStartBuildsOnBuilder_calls.append(bldr.name)
+            d = self.builderDeferreds[bldr.name] = defer.Deferred()
+            return d
+        self.brd._maybeStartBuildsOnBuilder = maybeStartBuildsOnBuilder
+
+    def finishBuilder(self, name):
+        self.builderDeferreds.pop(name).callback(None)
+
+    def configureBuilder(self, name, slavenames, locks=[]):
+        self.builders[name].config.slavenames = slavenames
+        self.builders[name].config.locks = locks
+
+    def test_maybeStartBuildsOn_concurrent(self):
+        self.brd.max_concurrency = 3
+        self.useControlled_maybeStartBuildsOnBuilder()
+        self.addBuilders(['bldr1', 'bldr2', 'bldr3', 'bldr4'])
+        for name in self.builders:
+            self.configureBuilder(name, ['slave-' + name])
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2', 'bldr3', 'bldr4'])
+
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr2', 'bldr3'])
+        self.finishBuilder('bldr2')
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr2', 'bldr3', 'bldr4'])
+        for name in 'bldr1', 'bldr3', 'bldr4':
+            self.finishBuilder(name)
+
+        def check(_):
+            self.checkAllCleanedUp()
+        self.quiet.addCallback(check)
+        return self.quiet
+
+    def test_maybeStartBuildsOn_concurrent_shared_slave(self):
+        self.brd.max_concurrency = 3
+        self.useControlled_maybeStartBuildsOnBuilder()
+        self.addBuilders(['bldr1', 'bldr2', 'bldr3'])
+        self.configureBuilder('bldr1', ['slave1'])
+        self.configureBuilder('bldr2', ['slave2', 'slave1'])
+        self.configureBuilder('bldr3', ['slave3'])
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2', 'bldr3'])
+
+        # bldr2 must wait for bldr1, with which it shares a slave
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr3'])
+        self.finishBuilder('bldr3')
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr3'])
+        self.finishBuilder('bldr1')
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr3', 'bldr2'])
+        self.finishBuilder('bldr2')
+
+        def check(_):
+            self.checkAllCleanedUp()
+        self.quiet.addCallback(check)
+        return self.quiet
+
+    def test_maybeStartBuildsOn_concurrent_shared_lock(self):
+        self.brd.max_concurrency = 3
+        self.useControlled_maybeStartBuildsOnBuilder()
+        self.addBuilders(['bldr1', 'bldr2', 'bldr3'])
+        lock = locks.MasterLock('db')
+        self.configureBuilder('bldr1', ['slave1'], [lock.access('counting')])
+        self.configureBuilder('bldr2', ['slave2'])
+        self.configureBuilder('bldr3', ['slave3'], [lock])
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2', 'bldr3'])
+
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr2'])
+        self.finishBuilder('bldr1')
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr2', 'bldr3'])
+        self.finishBuilder('bldr2')
+        self.finishBuilder('bldr3')
+
+        def check(_):
+            self.checkAllCleanedUp()
+        self.quiet.addCallback(check)
+        return self.quiet
+
+    def test_maybeStartBuildsOn_concurrent_same_builder(self):
+        # a builder added again while it is active waits for that run
+        self.brd.max_concurrency = 3
+        self.useControlled_maybeStartBuildsOnBuilder()
+        self.addBuilders(['bldr1'])
+        self.configureBuilder('bldr1', ['slave1'])
+        self.brd.maybeStartBuildsOn(['bldr1'])
+        self.brd.maybeStartBuildsOn(['bldr1'])
+
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls, ['bldr1'])
+        self.finishBuilder('bldr1')
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr1'])
+        self.finishBuilder('bldr1')
+        return self.quiet
+
+    def test_maybeStartBuildsOn_latency(self):
+        clock = task.Clock()
+        self.brd._reactor = clock
+        events = []
+        self.patch(metrics.MetricHistogramEvent, 'log',
+                   classmethod(lambda cls, name, value:
+                               events.append((name, value))))
+        self.useControlled_maybeStartBuildsOnBuilder()
+        self.addBuilders(['bldr1'])
+        self.brd.maybeStartBuildsOn(['bldr1'])
+        clock.advance(3)
+        self.finishBuilder('bldr1')
+
+        def check(_):
+            self.assertEqual(events, [('BuildRequestDistributor.bldr1', 3)])
+        self.quiet.addCallback(check)
+        return self.quiet
+
     def do_test_sortBuilders(self, prioritizeBuilders, oldestRequestTimes,
                              expected, returnDeferred=False):
         self.useMock_maybeStartBuildsOnBuilder()
@@ -1058,3 +1187,298 @@ class TestMaybeStartBuilds(unittest.TestCase):
         ]
         yield self.do_test_maybeStartBuildsOnBuilder(rows=rows,
                                                      exp_claims=[], exp_builds=[])
+
+
+class TestBasicBuildChooserMergeRequests(unittest.TestCase):
+
+    def setUp(self):
+        self.master = fakemaster.make_master(wantDb=True, testcase=self)
+        self.bldr = mock.Mock(name='A')
+        self.bldr.name = 'A'
+        self.bldr.config.nextSlave = None
+        self.bldr.config.nextBuild = None
+        self.bldr.getAvailableSlaves = lambda: []
+
+        # brids 10-15 on branches a, b, a, b, a, c
+        rows = []
+        for brid, branch in zip(range(10, 16), 'ababac'):
+            rows.extend([
+                fakedb.SourceStampSet(id=brid),
+                fakedb.SourceStamp(id=brid, sourcestampsetid=brid,
+                                   branch=branch),
+                fakedb.Buildset(id=brid, sourcestampsetid=brid),
+                fakedb.BuildRequest(id=brid, buildsetid=brid,
+                                    buildername='A', submitted_at=brid),
+            ])
+        return self.master.db.insertTestData(rows)
+
+    @defer.inlineCallbacks
+    def chooseAll(self, mergeRequestsFn):
+        self.bldr.getMergeRequestsFn = lambda: mergeRequestsFn
+        bc = buildrequestdistributor.BasicBuildChooser(self.bldr, self.master)
+        chosen = []
+        while True:
+            breq = yield bc._getNextUnclaimedBuildRequest()
+            if not breq:
+                break
+            bc._removeBuildRequest(breq)
+            breqs = yield bc.mergeRequests(breq)
+            for b in breqs:
+                bc._removeBuildRequest(b)
+            chosen.append([b.id for b in breqs])
+        defer.returnValue(chosen)
+
+    @defer.inlineCallbacks
+    def test_merge_by_key(self):
+        keyed = []
+
+        def getMergeKey(builder, req):
+            self.assertIdentical(builder, self.bldr)
+            keyed.append(req.id)
+            return req.source.branch
+        chosen = yield self.chooseAll(
+            buildrequest.mergeRequestsByKey(getMergeKey))
+        self.assertEqual(chosen, [[10, 12, 14], [11, 13], [15]])
+        # each request is keyed once when grouping, and once more when it is
+        # the chosen request (unless nothing is left to merge it with)
+        self.assertEqual(sorted(keyed), [10, 11, 11, 12, 13, 14, 15])
+
+    @defer.inlineCallbacks
+    def test_merge_by_key_None(self):
+        def getMergeKey(builder, req):
+            if req.source.branch != 'a':
+                return req.source.branch
+        chosen = yield self.chooseAll(
+            buildrequest.mergeRequestsByKey(getMergeKey))
+        self.assertEqual(chosen, [[10], [11, 13], [12], [14], [15]])
+
+    @defer.inlineCallbacks
+    def test_merge_default(self):
+        chosen = yield self.chooseAll(builder.Builder._defaultMergeRequestFn)
+        self.assertEqual(chosen, [[10, 12, 14], [11, 13], [15]])
+
+    @defer.inlineCallbacks
+    def test_merge_pairwise(self):
+        def mergeRequests(builder, req1, req2):
+            return req1.source.branch == req2.source.branch
+        chosen = yield self.chooseAll(mergeRequests)
+        self.assertEqual(chosen, [[10, 12, 14], [11, 13], [15]])
+
+
+class TestUnclaimedBuildRequests(unittest.TestCase):
+
+    def setUp(self):
+        self.master = fakemaster.make_master(wantDb=True, testcase=self)
+        self.clock = task.Clock()
+        self.unclaimed = buildrequestdistributor.UnclaimedBuildRequests(
+            self.master)
+        self.unclaimed._reactor = self.clock
+
+        # count the queries for all of a builder's unclaimed requests
+        self.queries = []
+        getBuildRequests = self.master.db.buildrequests.getBuildRequests
+
+        def wrap(**kwargs):
+            self.queries.append(kwargs['buildername'])
+            return getBuildRequests(**kwargs)
+        self.patch(self.master.db.buildrequests, 'getBuildRequests', wrap)
+
+        return self.insertRequests([(10, 'A', 300), (11, 'A', 100),
+                                    (12, 'B', 200)])
+
+    def insertRequests(self, requests, claimed=False):
+        rows = [
+            fakedb.SourceStampSet(id=21),
+            fakedb.SourceStamp(id=21, sourcestampsetid=21),
+            fakedb.Buildset(id=11, sourcestampsetid=21),
+        ] if not self.master.db.buildsets.buildsets else []
+        for brid, buildername, submitted_at in requests:
+            rows.append(fakedb.BuildRequest(id=brid, buildsetid=11,
+                                            buildername=buildername,
+                                            submitted_at=submitted_at))
+            if claimed:
+                rows.append(fakedb.BuildRequestClaim(brid=brid, objectid=9999,
+                                                     claimed_at=1000))
+        return self.master.db.insertTestData(rows)
+
+    @defer.inlineCallbacks
+    def assertUnclaimed(self, buildername, exp_brids, exp_queries):
+        brdicts = yield self.unclaimed.getUnclaimedBrdicts(buildername)
+        self.assertEqual([brd['brid'] for brd in brdicts], exp_brids)
+        self.assertEqual(self.queries, exp_queries)
+
+    @defer.inlineCallbacks
+    def test_cached(self):
+        brdicts = yield self.unclaimed.getUnclaimedBrdicts('A')
+        # oldest first
+        self.assertEqual([brd['brid'] for brd in brdicts], [11, 10])
+        # modifying the returned list does not affect the view
+        del brdicts[:]
+        yield self.assertUnclaimed('A', [11, 10], ['A'])
+        yield self.assertUnclaimed('B', [12], ['A', 'B'])
+
+    @defer.inlineCallbacks
+    def test_buildRequestAdded(self):
+        yield self.assertUnclaimed('A', [11, 10], ['A'])
+        yield self.insertRequests([(13, 'A', 50)])
+        self.unclaimed.buildRequestAdded('A', 13)
+        yield self.assertUnclaimed('A', [13, 11, 10], ['A'])
+
+    @defer.inlineCallbacks
+    def test_buildRequestAdded_already_claimed(self):
+        yield self.assertUnclaimed('A', [11, 10], ['A'])
+        yield self.insertRequests([(13, 'A', 50)], claimed=True)
+        self.unclaimed.buildRequestAdded('A', 13)
+        yield self.assertUnclaimed('A', [11, 10], ['A'])
+
+    @defer.inlineCallbacks
+    def test_buildRequestAdded_in_progress(self):
+        yield self.assertUnclaimed('A', [11, 10], ['A'])
+        yield self.insertRequests([(13, 'A', 50)])
+        d = defer.Deferred()
+        self.patch(self.master.db.buildrequests, 'getBuildRequest',
+                   lambda brid: d)
+        self.unclaimed.buildRequestAdded('A', 13)
+
+        res = []
+        self.unclaimed.getUnclaimedBrdicts('A').addCallback(res.append)
+        self.assertEqual(res, [])
+        brdict = yield self.master.db.buildrequests.getBuildRequests(
+            buildername='A', claimed=False)
+        d.callback([brd for brd in brdict if brd['brid'] == 13][0])
+        self.assertEqual([brd['brid'] for brd in res[0]], [13, 11, 10])
+
+    @defer.inlineCallbacks
+    def test_buildRequestAdded_while_fetching(self):
+        d = defer.Deferred()
+        getBuildRequests = self.master.db.buildrequests.getBuildRequests
+        self.master.db.buildrequests.getBuildRequests = lambda **kwargs: d
+        res = []
+        self.unclaimed.getUnclaimedBrdicts('A').addCallback(res.append)
+        self.master.db.buildrequests.getBuildRequests = getBuildRequests
+
+        # a request added while the view is being read may be missed by that
+        # read, so the view is not kept
+        self.unclaimed.buildRequestAdded('A', 13)
+        d.callback([])
+        self.assertEqual(res, [[]])
+        yield self.assertUnclaimed('A', [11, 10], ['A'])
+        yield self.assertUnclaimed('A', [11, 10], ['A'])
+
+    @defer.inlineCallbacks
+    def test_buildRequestsClaimed(self):
+        yield self.assertUnclaimed('A', [11, 10], ['A'])
+        self.unclaimed.buildRequestsClaimed('A', [11, 99])
+        yield self.assertUnclaimed('A', [10], ['A'])
+
+    @defer.inlineCallbacks
+    def test_invalidate(self):
+        yield self.assertUnclaimed('A', [11, 10], ['A'])
+        yield self.insertRequests([(13, 'A', 50)])
+        self.unclaimed.invalidate('A')
+        yield self.assertUnclaimed('A', [13, 11, 10], ['A', 'A'])
+
+    @defer.inlineCallbacks
+    def test_refresh(self):
+        yield self.assertUnclaimed('A', [11, 10], ['A'])
+        self.clock.advance(self.unclaimed.refresh_interval - 1)
+        yield self.assertUnclaimed('A', [11, 10], ['A'])
+        self.clock.advance(1)
+        yield self.assertUnclaimed('A', [11, 10], ['A', 'A'])
+
+    def countSummaryQueries(self):
+        queries = []
+        getSummaries = \
+            self.master.db.buildrequests.getUnclaimedBuildRequestSummaries
+
+        def wrap():
+            queries.append(None)
+            return getSummaries()
+        self.patch(self.master.db.buildrequests,
+                   'getUnclaimedBuildRequestSummaries', wrap)
+        return queries
+
+    @defer.inlineCallbacks
+    def test_getQueueSummaries(self):
+        queries = self.countSummaryQueries()
+        summaries = yield self.unclaimed.getQueueSummaries()
+        self.assertEqual(summaries, {
+            'A': dict(oldest_submitted_at=epoch2datetime(100), count=2),
+            'B': dict(oldest_submitted_at=epoch2datetime(200), count=1),
+        })
+        yield self.unclaimed.getQueueSummaries()
+        self.assertEqual(len(queries), 1)
+
+    @defer.inlineCallbacks
+    def test_getQueueSummaries_shared(self):
+        queries = self.countSummaryQueries()
+        d = defer.Deferred()
+        self.patch(self.master.db.buildrequests,
+                   'getUnclaimedBuildRequestSummaries', lambda: d)
+        res = []
+        self.unclaimed.getQueueSummaries().addCallback(res.append)
+        self.unclaimed.getQueueSummaries().addCallback(res.append)
+        d.callback({'A': 'summary'})
+        self.assertEqual(res, [{'A': 'summary'}] * 2)
+        yield self.unclaimed.getQueueSummaries()
+        self.assertEqual(queries, [])
+
+    @defer.inlineCallbacks
+    def test_getQueueSummaries_invalidated(self):
+        queries = self.countSummaryQueries()
+        yield self.unclaimed.getQueueSummaries()
+        yield self.unclaimed.getUnclaimedBrdicts('A')
+
+        yield self.insertRequests([(13, 'A', 50)])
+        self.unclaimed.buildRequestAdded('A', 13)
+        summaries = yield self.unclaimed.getQueueSummaries()
+        self.assertEqual(summaries['A'],
+                         dict(oldest_submitted_at=epoch2datetime(50), count=3))
+
+        yield self.master.db.buildrequests.claimBuildRequests([13])
+        self.unclaimed.buildRequestsClaimed('A', [13])
+        summaries = yield self.unclaimed.getQueueSummaries()
+        self.assertEqual(summaries['A']['count'], 2)
+
+        self.unclaimed.invalidate('B')
+        yield self.unclaimed.getQueueSummaries()
+        self.assertEqual(len(queries), 4)
+
+    @defer.inlineCallbacks
+    def test_getQueueSummaries_invalidated_while_fetching(self):
+        d = defer.Deferred()
+        getSummaries = \
+            self.master.db.buildrequests.getUnclaimedBuildRequestSummaries
+        self.master.db.buildrequests.getUnclaimedBuildRequestSummaries = \
+            lambda: d
+        self.unclaimed.getQueueSummaries()
+        self.master.db.buildrequests.getUnclaimedBuildRequestSummaries = \
+            getSummaries
+
+        self.unclaimed.invalidate('A')
+        d.callback({})
+        summaries = yield self.unclaimed.getQueueSummaries()
+        self.assertEqual(sorted(summaries), ['A', 'B'])
+
+    @defer.inlineCallbacks
+    def test_getQueueSummaries_refresh(self):
+        queries = self.countSummaryQueries()
+        yield self.unclaimed.getQueueSummaries()
+        self.clock.advance(self.unclaimed.refresh_interval)
+        yield self.unclaimed.getQueueSummaries()
+        self.assertEqual(len(queries), 2)
+
+    def test_distributor(self):
+        botmaster = mock.Mock(name='botmaster')
+        botmaster.master = self.master
+        brd = buildrequestdistributor.BuildRequestDistributor(botmaster)
+        brd.unclaimedBuildRequests = mock.Mock()
+        brd.buildRequestAdded(dict(bsid=11, brid=13, buildername='A'))
+        brd.unclaimedBuildRequests.buildRequestAdded.assert_called_with(
+            'A', 13)
+
+        bldr = mock.Mock(name='A')
+        bldr.config.nextSlave = None
+        bc = brd.createBuildChooser(bldr, self.master)
+        self.assertIdentical(bc.unclaimedBuildRequests,
+                             brd.unclaimedBuildRequests)
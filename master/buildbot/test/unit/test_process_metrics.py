@@ -133,6 +133,46 @@ class TestMetricTimeEvent(TestMetricBase):
         self.assertEquals(report['timers']['foo_time'], sum(data) / float(len(data)))
 
 
+class TestMetricHistogramEvent(TestMetricBase):
+
+    def testManualEvent(self):
+        metrics.MetricHistogramEvent.log('foo_latency', 0.003)
+        report = self.observer.asDict()
+        h = report['histograms']['foo_latency']
+        self.assertEquals(h['count'], 1)
+        self.assertEquals(h['max'], 0.003)
+        self.assertEquals(dict(h['buckets'])[0.005], 1)
+
+    def testPercentiles(self):
+        h = metrics.Histogram()
+        for i in range(90):
+            h.add(0.0015)
+        for i in range(9):
+            h.add(0.3)
+        h.add(7)
+        self.assertEquals(h.count, 100)
+        self.assertEquals(h.percentile(50), 0.002)
+        self.assertEquals(h.percentile(95), 0.5)
+        self.assertEquals(h.percentile(100), 7)
+        self.assertAlmostEqual(h.mean, (90 * 0.0015 + 9 * 0.3 + 7) / 100)
+
+    def testPercentileCappedAtMax(self):
+        h = metrics.Histogram()
+        h.add(0.3)
+        self.assertEquals(h.percentile(50), 0.3)
+
+    def testOverflow(self):
+        h = metrics.Histogram()
+        h.add(100)
+        self.assertEquals(h.buckets[-1], 1)
+        self.assertEquals(h.percentile(99), 100)
+
+    def testEmpty(self):
+        h = metrics.Histogram()
+        self.assertEquals(h.mean, 0)
+        self.assertEquals(h.percentile(50), 0)
+
+
 class TestPeriodicChecks(TestMetricBase):
 
     def testPeriodicCheck(self):
@@ -242,6 +282,15 @@ class TestReports(unittest.TestCase):
         self.assertEquals("Timer time_foo: 1", handler.report())
         self.assertEquals({"timers": {"time_foo": 1}}, handler.asDict())
 
+    def testMetricHistogramReport(self):
+        handler = metrics.MetricHistogramHandler(None)
+        handler.handle({}, metrics.MetricHistogramEvent('latency_foo', 1))
+
+        self.assertEquals("Histogram latency_foo: count=1 mean=1 p50=1 "
+                          "p95=1 p99=1 max=1", handler.report())
+        self.assertEquals(handler.asDict()['histograms']['latency_foo']['count'],
+                          1)
+
     def testMetricAlarmReport(self):
         handler = metrics.MetricAlarmHandler(None)
         handler.handle({}, metrics.MetricAlarmEvent('alarm_foo', msg='Uh oh', level=metrics.ALARM_WARN))
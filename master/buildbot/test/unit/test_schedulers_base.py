@@ -249,6 +249,32 @@ class BaseScheduler(scheduler.SchedulerMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_addBuildsetForSourceStamps(self):
+        sched = self.makeScheduler(name='xyz', builderNames=['y', 'z'])
+        d = sched.addBuildsetForSourceStamps(
+            [dict(codebase='a', branch='br', revision='1', repository='ra',
+                  project='p'),
+             dict(codebase='b', branch='br', revision='2', repository='rb',
+                  project='p')],
+            reason='cuz', external_idstring='try_1234')
+
+        def check(xxx_todo_changeme):
+            (bsid, brids) = xxx_todo_changeme
+            self.db.buildsets.assertBuildset(bsid,
+                                             dict(reason='cuz', brids=brids,
+                                                  external_idstring='try_1234',
+                                                  properties=[('scheduler', ('xyz', 'Scheduler'))],
+                                                  sourcestampsetid=100),
+                                             {'a':
+                                              dict(branch='br', revision='1', repository='ra',
+                                                   codebase='a', project='p', sourcestampsetid=100),
+                                              'b':
+                                              dict(branch='br', revision='2', repository='rb',
+                                                   codebase='b', project='p', sourcestampsetid=100),
+                                              })
+        d.addCallback(check)
+        return d
+
     def test_addBuildsetForChanges_one_change(self):
         sched = self.makeScheduler(name='n', builderNames=['b'])
         self.db.insertTestData([
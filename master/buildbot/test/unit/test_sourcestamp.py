@@ -186,6 +186,35 @@ class TestBuilderBuildCreation(unittest.TestCase):
                                      patch=(1, ''))
         self.assertTrue(ss.canBeMergedWith(ss))
 
+    def test_getMergeKey_agrees_with_canBeMergedWith(self):
+        c1 = mock.Mock()
+        c1.codebase = 'cb'
+
+        def ss(**kwargs):
+            args = dict(branch='dev', revision='xyz', project='p',
+                        repository='r', codebase='cb', changes=[])
+            args.update(kwargs)
+            return sourcestamp.SourceStamp(**args)
+        patched = ss(patch=(1, ''))
+        stamps = [
+            ss(),
+            ss(revision='abc'),
+            ss(revision=None),
+            ss(changes=[c1]),
+            ss(changes=[c1], revision='abc'),
+            ss(branch='other'),
+            ss(project='q'),
+            ss(repository='s'),
+            ss(codebase='cbA'),
+            patched,
+            ss(patch=(1, '')),
+        ]
+        for ss1 in stamps:
+            for ss2 in stamps:
+                self.assertEqual(ss1.getMergeKey() == ss2.getMergeKey(),
+                                 ss1.canBeMergedWith(ss2),
+                                 (ss1, ss2))
+
     def test_constructor_most_recent_change(self):
         chgs = [
             changes.Change('author', [], 'comments', branch='branch',
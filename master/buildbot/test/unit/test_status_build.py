@@ -19,6 +19,8 @@ from buildbot import interfaces
 from buildbot import util
 from buildbot.status import build
 from buildbot.test.fake import fakemaster
+from cPickle import dumps
+from cPickle import loads
 from twisted.trial import unittest
 from zope.interface import implements
 
@@ -141,3 +143,59 @@ class TestBuildGetSourcestamps(unittest.TestCase):
                                  FakeSource('lib2', 'aaaaaaa'),
                                  FakeSource('lib3', '0000000')]
         self.assertEqual(sourcestamps, expected_sourcestamps)
+
+
+class TestBuildPersistence(unittest.TestCase):
+
+    BUILD_NUMBER = 33
+
+    def setUp(self):
+        self.builder_status = FakeBuilderStatus()
+        self.master = fakemaster.make_master()
+        self.build_status = build.BuildStatus(self.builder_status, self.master,
+                                              self.BUILD_NUMBER)
+        for name in ['compile', 'test']:
+            self.build_status.addStepWithName(name)
+
+    def reload(self, build_status):
+        loaded = loads(dumps(build_status, -1))
+        loaded.setProcessObjects(self.builder_status, self.master)
+        return loaded
+
+    def test_steps_loaded_lazily(self):
+        loaded = self.reload(self.build_status)
+        self.assertNotIn('steps', loaded.__dict__)
+        self.assertEqual(loaded.number, self.BUILD_NUMBER)
+
+        steps = loaded.getSteps()
+        self.assertEqual([s.getName() for s in steps], ['compile', 'test'])
+        self.assertIdentical(steps[0].getBuild(), loaded)
+        self.assertIdentical(steps[0].master, self.master)
+        self.assertNotIn('_pickledSteps', loaded.__dict__)
+
+    def test_steps_loaded_before_setProcessObjects(self):
+        loaded = loads(dumps(self.build_status, -1))
+        steps = loaded.getSteps()
+        loaded.setProcessObjects(self.builder_status, self.master)
+        self.assertIdentical(steps[1].getBuild(), loaded)
+
+    def test_unloaded_steps_saved_unchanged(self):
+        state = self.build_status.__getstate__()
+        loaded = self.reload(self.build_status)
+        self.assertEqual(loaded.__getstate__()['_pickledSteps'],
+                         state['_pickledSteps'])
+        self.assertNotIn('steps', loaded.__dict__)
+
+    def test_currentStep(self):
+        self.build_status.currentStep = self.build_status.getSteps()[1]
+        loaded = self.reload(self.build_status)
+        self.assertIdentical(loaded.getCurrentStep(), loaded.getSteps()[1])
+
+    def test_no_currentStep(self):
+        loaded = self.reload(self.build_status)
+        self.assertEqual(loaded.getCurrentStep(), None)
+        self.assertNotIn('steps', loaded.__dict__)
+
+    def test_other_attributes(self):
+        loaded = self.reload(self.build_status)
+        self.assertRaises(AttributeError, lambda: loaded.nosuchattribute)
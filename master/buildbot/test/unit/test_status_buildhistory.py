@@ -0,0 +1,557 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+
+from buildbot.sourcestamp import SourceStamp
+from buildbot.status import builder
+from buildbot.status import buildhistory
+from buildbot.status.results import FAILURE
+from buildbot.status.results import SUCCESS
+from buildbot.test.fake import fakemaster
+from twisted.internet import defer
+from twisted.trial import unittest
+
+
+class FakeLog(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+
+
+class FakeStep(object):
+
+    def __init__(self, logs):
+        self.logs = logs
+
+    def getLogs(self):
+        return self.logs
+
+
+class FakeSourceStamp(object):
+
+    branch = 'master'
+
+
+class FakeBuild(object):
+
+    def __init__(self, number, logfiles=(), times=(10, 20)):
+        self.number = number
+        self.times = times
+        self.steps = [FakeStep([FakeLog(f) for f in logfiles])]
+        self.sources = [FakeSourceStamp()]
+
+    def getNumber(self):
+        return self.number
+
+    def getTimes(self):
+        return self.times
+
+    def getResults(self):
+        return 0
+
+    def getText(self):
+        return ['build', 'successful']
+
+    def getSteps(self):
+        return self.steps
+
+    def getSourceStamps(self):
+        return self.sources
+
+    def getAllGotRevisions(self):
+        return {'': 'abcd'}
+
+    def getSlavename(self):
+        return 'slave1'
+
+    def getResponsibleUsers(self):
+        return ['me']
+
+
+SUMMARY = dict(number=0, started=10, finished=20, results=0,
+               text=['build', 'successful'], branches=['master'],
+               revisions={'': 'abcd'}, slavename='slave1', blamelist=['me'])
+
+
+class StoreMixin(object):
+
+    def setUp(self):
+        self.basedir = os.path.abspath(self.mktemp())
+        os.makedirs(self.basedir)
+        self.store = self.makeStore()
+
+    def tearDown(self):
+        self.store.close()
+
+    def reopen(self):
+        self.store.close()
+        self.store = self.makeStore()
+
+    def touch(self, filename):
+        open(os.path.join(self.basedir, filename), "w").close()
+
+    def exists(self, filename):
+        return os.path.exists(os.path.join(self.basedir, filename))
+
+    def test_empty(self):
+        self.assertEqual(self.store.getBuildNumbers(), [])
+        self.assertEqual(self.store.getLastBuildNumber(), None)
+        self.assertRaises(IndexError, lambda: self.store.loadBuild(0))
+
+    def test_saveBuild_loadBuild(self):
+        for number in (0, 1, 3):
+            self.store.saveBuild(FakeBuild(number))
+        self.reopen()
+        self.assertEqual(self.store.getBuildNumbers(), [0, 1, 3])
+        self.assertEqual(self.store.getLastBuildNumber(), 3)
+        self.assertEqual(self.store.loadBuild(3).number, 3)
+        self.assertRaises(IndexError, lambda: self.store.loadBuild(2))
+
+    def test_saveBuild_again(self):
+        self.store.saveBuild(FakeBuild(0))
+        build = FakeBuild(0)
+        build.extra = 'x'
+        self.store.saveBuild(build)
+        self.reopen()
+        self.assertEqual(self.store.loadBuild(0).extra, 'x')
+
+    def test_writeBuilds(self):
+        self.store.writeBuilds([buildhistory.serializeBuild(FakeBuild(number))
+                                for number in (0, 1)])
+        self.reopen()
+        self.assertEqual(self.store.getBuildNumbers(), [0, 1])
+        self.assertEqual(self.store.loadBuild(1).number, 1)
+        self.assertEqual(self.store.getSummary(0), SUMMARY)
+
+    def test_removeBuild(self):
+        self.store.saveBuild(FakeBuild(0))
+        self.store.saveBuild(FakeBuild(1))
+        self.store.removeBuild(0)
+        self.reopen()
+        self.assertEqual(self.store.getBuildNumbers(), [1])
+
+    def test_pruneBuilds(self):
+        for number in range(6):
+            self.store.saveBuild(FakeBuild(number, ['%d-log-a-b' % number]))
+            self.touch('%d-log-a-b' % number)
+        self.store.pruneBuilds(2, 4, keep=set([1]))
+        self.reopen()
+
+        self.assertEqual(self.store.getBuildNumbers(), [1, 2, 3, 4, 5])
+        self.assertEqual([n for n in range(6) if self.exists('%d-log-a-b' % n)],
+                         [1, 4, 5])
+
+    def test_getSummary(self):
+        self.store.saveBuild(FakeBuild(0))
+        self.reopen()
+        self.assertEqual(self.store.getSummary(0), SUMMARY)
+        self.assertEqual(self.store.getSummary(1), None)
+
+    def test_getSummary_pruned(self):
+        self.store.saveBuild(FakeBuild(0))
+        self.store.saveBuild(FakeBuild(1))
+        self.store.pruneBuilds(1, 1)
+        self.reopen()
+        self.assertEqual(self.store.getSummary(0), None)
+        self.assertEqual(self.store.getSummary(1)['number'], 1)
+
+
+class PickleDirectoryStore(StoreMixin, unittest.TestCase):
+
+    def makeStore(self):
+        return buildhistory.PickleDirectoryStore(self.basedir)
+
+    def test_getSummary_no_summaries(self):
+        # builds saved before summaries were kept have none
+        self.store.saveBuild(FakeBuild(0))
+        self.store.close()
+        os.unlink(os.path.join(self.basedir, 'summaries.idx'))
+        self.store = self.makeStore()
+        self.assertEqual(self.store.getSummary(0), None)
+        self.assertEqual(self.store.loadBuild(0).number, 0)
+
+    def test_compact_summaries(self):
+        self.patch(buildhistory.PickleDirectoryStore,
+                   'summaryCompactionMinimum', 0)
+        for number in range(4):
+            self.store.saveBuild(FakeBuild(number))
+        self.store.pruneBuilds(3, 3)
+        self.assertEqual(self.store.deadSummaries, 0)
+        self.reopen()
+        self.assertEqual([n for n in range(4) if self.store.getSummary(n)],
+                         [3])
+
+
+class IndexedBuildStore(StoreMixin, unittest.TestCase):
+
+    def makeStore(self):
+        return buildhistory.IndexedBuildStore(self.basedir)
+
+    def test_one_file_per_builder(self):
+        for number in range(10):
+            self.store.saveBuild(FakeBuild(number))
+        self.assertEqual(sorted(os.listdir(self.basedir)),
+                         ['builds-0.dat', 'builds.idx'])
+
+    def test_writeBuilds_syncs_once(self):
+        synced = []
+        self.patch(buildhistory.os, 'fsync', synced.append)
+        self.store.writeBuilds([buildhistory.serializeBuild(FakeBuild(number))
+                                for number in range(5)])
+        # once for the data file, then once for the index
+        self.assertEqual(synced, [self.store._data.fileno(),
+                                  self.store._index.fileno()])
+
+    def test_getSummary_unfinished(self):
+        build = FakeBuild(0, times=(10, None))
+        self.patch(buildhistory.util, 'now', lambda: 30)
+        self.store.saveBuild(build)
+        # the build is saved as finished
+        self.assertEqual(self.store.getSummary(0)['finished'], 30)
+
+    def test_truncated_index(self):
+        self.store.saveBuild(FakeBuild(0))
+        self.store.saveBuild(FakeBuild(1))
+        self.store.close()
+        indexfile = os.path.join(self.basedir, 'builds.idx')
+        size = os.path.getsize(indexfile)
+        with open(indexfile, "r+b") as f:
+            f.truncate(size - 3)
+
+        self.store = self.makeStore()
+        self.assertEqual(self.store.getBuildNumbers(), [0])
+        # the partial record is discarded, so new records can follow
+        self.store.saveBuild(FakeBuild(2))
+        self.reopen()
+        self.assertEqual(self.store.getBuildNumbers(), [0, 2])
+
+    def test_truncated_data(self):
+        self.store.saveBuild(FakeBuild(0))
+        self.store.saveBuild(FakeBuild(1))
+        self.store.close()
+        datafile = os.path.join(self.basedir, 'builds-0.dat')
+        with open(datafile, "r+b") as f:
+            f.truncate(os.path.getsize(datafile) - 3)
+
+        self.store = self.makeStore()
+        self.assertEqual(self.store.getBuildNumbers(), [0])
+
+    def test_pruneBuilds_incremental(self):
+        for number in range(4):
+            self.store.saveBuild(FakeBuild(number))
+        self.store.pruneBuilds(2, 2)
+        self.reopen()
+        self.assertEqual((self.store.buildsPrunedBefore,
+                          self.store.logsPrunedBefore), (2, 2))
+        # a later prune starts where this one left off
+        self.store.pruneBuilds(3, 3)
+        self.assertEqual(self.store.getBuildNumbers(), [3])
+
+    def test_compact(self):
+        self.patch(buildhistory.IndexedBuildStore, 'compactionMinimum', 0)
+        for number in range(6):
+            self.store.saveBuild(FakeBuild(number))
+        self.store.pruneBuilds(4, 4)
+
+        self.assertEqual(self.store.generation, 1)
+        self.assertEqual(self.store.deadBytes, 0)
+        self.assertFalse(self.exists('builds-0.dat'))
+        self.reopen()
+        self.assertEqual(self.store.getBuildNumbers(), [4, 5])
+        self.assertEqual(self.store.loadBuild(5).number, 5)
+        self.assertEqual(self.store.buildsPrunedBefore, 4)
+
+    def test_interrupted_compaction(self):
+        self.store.saveBuild(FakeBuild(0))
+        self.store.close()
+        # a compaction that did not get as far as replacing the index
+        self.touch('builds-1.dat')
+
+        self.store = self.makeStore()
+        self.assertFalse(self.exists('builds-1.dat'))
+        self.assertEqual(self.store.loadBuild(0).number, 0)
+
+
+class Migration(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath(self.mktemp())
+        os.makedirs(self.basedir)
+        pickles = buildhistory.PickleDirectoryStore(self.basedir)
+        for number in range(3):
+            pickles.saveBuild(FakeBuild(number))
+        self.migrateBuilds = buildhistory.migrateBuilds
+
+    def test_migrateBuilds(self):
+        pickles = buildhistory.PickleDirectoryStore(self.basedir)
+        indexed = buildhistory.IndexedBuildStore(self.basedir)
+        self.assertEqual(
+            buildhistory.migrateBuilds(pickles, indexed, remove=True), 3)
+        self.assertEqual(indexed.getBuildNumbers(), [0, 1, 2])
+        self.assertEqual(pickles.getBuildNumbers(), [])
+        indexed.close()
+
+    def test_migrateBuilds_batches(self):
+        pickles = buildhistory.PickleDirectoryStore(self.basedir)
+        indexed = buildhistory.IndexedBuildStore(self.basedir)
+        batches = []
+        writeBuilds = indexed.writeBuilds
+
+        def recordBatch(builds):
+            batches.append([number for number, _, _, _ in builds])
+            writeBuilds(builds)
+        indexed.writeBuilds = recordBatch
+        buildhistory.migrateBuilds(pickles, indexed, batchSize=2)
+        self.assertEqual(batches, [[0, 1], [2]])
+        indexed.close()
+
+    def test_makeStore_migrates(self):
+        store = buildhistory.makeStore('indexed', self.basedir)
+        self.assertEqual(store.getBuildNumbers(), [0, 1, 2])
+        store.close()
+        # the pickles are left in place
+        self.assertEqual(os.path.exists(os.path.join(self.basedir, '2')), True)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.basedir, 'builds.idx.migrating')))
+
+    def test_makeStore_interrupted(self):
+        def migrateBuilds(source, dest):
+            dest.writeBuilds([buildhistory.serializeBuild(
+                source.loadBuild(0))])
+            raise RuntimeError("master crashed")
+        self.patch(buildhistory, 'migrateBuilds', migrateBuilds)
+        self.assertRaises(RuntimeError,
+                          buildhistory.makeStore, 'indexed', self.basedir)
+        # the partial copy is not taken for the whole history
+        self.assertFalse(os.path.exists(
+            os.path.join(self.basedir, 'builds.idx')))
+
+        self.patch(buildhistory, 'migrateBuilds', self.migrateBuilds)
+        store = buildhistory.makeStore('indexed', self.basedir)
+        self.assertEqual(store.getBuildNumbers(), [0, 1, 2])
+        self.assertEqual(store.loadBuild(0).number, 0)
+        store.close()
+
+
+class BuilderStatus(unittest.TestCase):
+
+    def makeBuilderStatus(self, buildHistoryStore, basedir):
+        m = fakemaster.make_master()
+        m.config.buildHistoryStore = buildHistoryStore
+        b = builder.BuilderStatus(buildername='bldr', tags=None,
+                                  master=m, description=None)
+        b.basedir = basedir
+        b.determineNextBuildNumber()
+        b.currentBigState = 'idle'
+        b.status = 'idle'
+        return b
+
+    def test_nextBuildNumber_after_pickles(self):
+        basedir = os.path.abspath(self.mktemp())
+        os.mkdir(basedir)
+        store = buildhistory.IndexedBuildStore(basedir)
+        store.saveBuild(FakeBuild(0))
+        store.close()
+        # a pickle that was not copied into the indexed store
+        buildhistory.PickleDirectoryStore(basedir).saveBuild(FakeBuild(5))
+
+        b = self.makeBuilderStatus('indexed', basedir)
+        self.assertEqual(b.nextBuildNumber, 6)
+        b.getBuildStore().close()
+
+    def do_test_history(self, buildHistoryStore):
+        basedir = os.path.abspath(self.mktemp())
+        os.mkdir(basedir)
+        b = self.makeBuilderStatus(buildHistoryStore, basedir)
+        for i in range(3):
+            build = b.newBuild()
+            build.setProperty('propkey', 'propval%d' % i, 'test')
+            build.buildStarted(build)
+            build.buildFinished()
+        b.getBuildStore().close()
+
+        b2 = self.makeBuilderStatus(buildHistoryStore, basedir)
+        self.assertEqual(b2.nextBuildNumber, 3)
+        self.assertEqual(b2.getBuild(1).getProperty('propkey'), 'propval1')
+        self.assertEqual(b2.getBuildSummary(-1)['number'], 2)
+        self.assertEqual(b2.getBuildSummary(3), None)
+        b2.getBuildStore().close()
+
+    def test_history_pickle(self):
+        self.do_test_history('pickle')
+
+    def test_history_indexed(self):
+        self.do_test_history('indexed')
+
+    def makeHistory(self, buildHistoryStore):
+        basedir = os.path.abspath(self.mktemp())
+        os.mkdir(basedir)
+        b = self.makeBuilderStatus(buildHistoryStore, basedir)
+        for branch, results in [('master', SUCCESS), ('dev', SUCCESS),
+                                ('master', FAILURE), ('dev', FAILURE)]:
+            build = b.newBuild()
+            build.setSourceStamps([SourceStamp(branch=branch)])
+            build.buildStarted(build)
+            build.setResults(results)
+            build.buildFinished()
+        b.getBuildStore().close()
+
+        b = self.makeBuilderStatus(buildHistoryStore, basedir)
+        self.loaded = []
+        loadBuildFromFile = b.loadBuildFromFile
+
+        def load(number):
+            self.loaded.append(number)
+            return loadBuildFromFile(number)
+        b.loadBuildFromFile = load
+        return b
+
+    def test_generateFinishedBuilds_filters_summaries(self):
+        b = self.makeHistory('indexed')
+        builds = list(b.generateFinishedBuilds(branches=['dev'],
+                                               results=[FAILURE]))
+        self.assertEqual([build.number for build in builds], [3])
+        # only the build returned was loaded
+        self.assertEqual(self.loaded, [3])
+        b.getBuildStore().close()
+
+    def test_generateFinishedBuilds_num_builds(self):
+        b = self.makeHistory('pickle')
+        builds = list(b.generateFinishedBuilds(branches=['master'],
+                                               num_builds=1))
+        self.assertEqual([build.number for build in builds], [2])
+        self.assertEqual(self.loaded, [2])
+
+    def test_eventGenerator_filters_summaries(self):
+        b = self.makeHistory('indexed')
+        builds = [e for e in b.eventGenerator(branches=['master'])
+                  if hasattr(e, 'number')]
+        self.assertEqual([build.number for build in builds], [2, 0])
+        self.assertEqual(self.loaded, [2, 0])
+        b.getBuildStore().close()
+
+    def test_getBuildSummary_current_build(self):
+        basedir = os.path.abspath(self.mktemp())
+        os.mkdir(basedir)
+        b = self.makeBuilderStatus('pickle', basedir)
+        build = b.newBuild()
+        build.buildStarted(build)
+        self.assertEqual(b.getBuildSummary(0)['finished'], None)
+        self.assertEqual(list(b.generateFinishedBuilds()), [])
+
+    def makeThreadedHistory(self, buildHistoryStore):
+        b = self.makeHistory(buildHistoryStore)
+        # run the loads when the test says so, rather than in a thread
+        self.threadCalls = []
+
+        def deferToThread(f, *args):
+            d = defer.Deferred()
+            self.threadCalls.append(
+                (args[0], lambda: defer.maybeDeferred(f, *args)
+                 .chainDeferred(d)))
+            return d
+        self.patch(builder.threads, 'deferToThread', deferToThread)
+        return b
+
+    def runThreadCalls(self):
+        calls, self.threadCalls = self.threadCalls, []
+        for number, call in calls:
+            call()
+
+    @defer.inlineCallbacks
+    def test_getBuildAsync(self):
+        b = self.makeThreadedHistory('indexed')
+        b.buildPrefetch = 0
+        d1 = b.getBuildAsync(2)
+        d2 = b.getBuildAsync(-2)
+        # both requests share one load
+        self.assertEqual([n for n, _ in self.threadCalls], [2])
+        self.runThreadCalls()
+
+        build1, build2 = yield defer.gatherResults([d1, d2])
+        self.assertIdentical(build1, build2)
+        self.assertEqual(build1.number, 2)
+        self.assertIdentical(b.getBuild(2), build1)
+        # the build is now in memory
+        build = yield b.getBuildAsync(2)
+        self.assertIdentical(build, build1)
+        self.assertEqual(self.threadCalls, [])
+        b.getBuildStore().close()
+
+    @defer.inlineCallbacks
+    def test_getBuildAsync_unpickles_on_reactor(self):
+        b = self.makeThreadedHistory('indexed')
+        b.buildPrefetch = 0
+        unpickled = []
+        unpickleBuild = buildhistory.unpickleBuild
+
+        def unpickle(number, data):
+            unpickled.append(data)
+            return unpickleBuild(number, data)
+        self.patch(buildhistory, 'unpickleBuild', unpickle)
+
+        d = b.getBuildAsync(1)
+        self.runThreadCalls()
+        build = yield d
+        # the thread only read the pickle, which was unpickled afterwards
+        self.assertEqual(len(unpickled), 1)
+        self.assertIsInstance(unpickled[0], str)
+        self.assertEqual(build.number, 1)
+        b.getBuildStore().close()
+
+    @defer.inlineCallbacks
+    def test_getBuildAsync_prefetch(self):
+        b = self.makeThreadedHistory('pickle')
+        b.buildPrefetch = 2
+        d = b.getBuildAsync(3)
+        self.assertEqual([n for n, _ in self.threadCalls], [3, 2, 1])
+        self.runThreadCalls()
+        yield d
+
+        self.assertEqual(sorted(b.buildCache.keys()), [1, 2, 3])
+        # the prefetched builds are not loaded again
+        build = yield b.getBuildAsync(1)
+        self.assertEqual(build.number, 1)
+        self.assertEqual(self.threadCalls, [])
+
+    @defer.inlineCallbacks
+    def test_getBuildAsync_loaded_meanwhile(self):
+        b = self.makeThreadedHistory('pickle')
+        b.buildPrefetch = 0
+        d = b.getBuildAsync(1)
+        build = b.getBuild(1)
+        self.runThreadCalls()
+        self.assertIdentical((yield d), build)
+
+    @defer.inlineCallbacks
+    def test_getBuildAsync_missing(self):
+        b = self.makeThreadedHistory('pickle')
+        self.assertEqual((yield b.getBuildAsync(4)), None)
+        os.unlink(os.path.join(b.basedir, '3'))
+        d = b.getBuildAsync(3)
+        self.runThreadCalls()
+        self.assertEqual((yield d), None)
+
+    @defer.inlineCallbacks
+    def test_getBuildAsync_corrupted(self):
+        b = self.makeThreadedHistory('pickle')
+        with open(os.path.join(b.basedir, '3'), 'wb') as f:
+            f.write('not a pickle')
+        d = b.getBuildAsync(3)
+        self.runThreadCalls()
+        self.assertEqual((yield d), None)
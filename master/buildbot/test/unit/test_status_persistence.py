@@ -0,0 +1,135 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+
+from buildbot.status import builder
+from buildbot.status import persistence
+from buildbot.test.fake import fakemaster
+from cPickle import load
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.trial import unittest
+
+
+class StatusWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = persistence.StatusWriter()
+        self.clock = self.writer.batcher._reactor = task.Clock()
+        # (d, function, args) for each write waiting for its "thread"
+        self.threadWrites = []
+        self.writer._deferToThread = self.deferToThread
+
+    def deferToThread(self, f, *args):
+        d = defer.Deferred()
+        self.threadWrites.append((d, f, args))
+        return d
+
+    def runThreadWrites(self):
+        while self.threadWrites:
+            d, f, args = self.threadWrites.pop(0)
+            d.callback(f(*args))
+
+    def makeBuilderStatus(self, name='bldr'):
+        m = fakemaster.make_master()
+        b = builder.BuilderStatus(buildername=name, tags=None,
+                                  master=m, description=None)
+        b.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(b.basedir)
+        b.determineNextBuildNumber()
+        b.currentBigState = 'idle'
+        b.status = 'idle'
+        b.statusWriter = self.writer
+        self.addCleanup(lambda: b.getBuildStore().close())
+        return b
+
+    def finishBuild(self, b):
+        build = b.newBuild()
+        build.buildStarted(build)
+        build.buildFinished()
+        return build
+
+    def loadBuilderPickle(self, b):
+        with open(os.path.join(b.basedir, "builder"), "rb") as f:
+            return load(f)
+
+    def test_not_running(self):
+        b = self.makeBuilderStatus()
+        self.finishBuild(b)
+        b.saveYourself()
+        # written immediately, without a thread
+        self.assertEqual(self.threadWrites, [])
+        self.assertEqual(b.getBuildStore().getBuildNumbers(), [0])
+        self.assertEqual(self.loadBuilderPickle(b).name, 'bldr')
+
+    def test_batch(self):
+        self.writer.start()
+        b1 = self.makeBuilderStatus('b1')
+        b2 = self.makeBuilderStatus('b2')
+        for i in range(3):
+            self.finishBuild(b1)
+        self.finishBuild(b2)
+        b1.saveYourself()
+        self.assertEqual(b1.getBuildStore().getBuildNumbers(), [])
+
+        self.clock.advance(0)
+        self.assertEqual(len(self.threadWrites), 1)
+        self.runThreadWrites()
+        self.assertEqual(b1.getBuildStore().getBuildNumbers(), [0, 1, 2])
+        self.assertEqual(b2.getBuildStore().getBuildNumbers(), [0])
+        self.assertEqual(self.loadBuilderPickle(b1).name, 'b1')
+
+    def test_saved_while_writing(self):
+        self.writer.start()
+        b = self.makeBuilderStatus()
+        self.finishBuild(b)
+        self.clock.advance(0)
+        # builds saved while a batch is written go into the next one
+        self.finishBuild(b)
+        self.finishBuild(b)
+        self.runThreadWrites()
+        self.assertEqual(b.getBuildStore().getBuildNumbers(), [0])
+        self.clock.advance(0)
+        self.runThreadWrites()
+        self.assertEqual(b.getBuildStore().getBuildNumbers(), [0, 1, 2])
+
+    def test_stop(self):
+        self.writer.start()
+        b = self.makeBuilderStatus()
+        self.finishBuild(b)
+        d = self.writer.stop()
+        self.assertFalse(d.called)
+
+        self.clock.advance(0)
+        self.runThreadWrites()
+        self.assertTrue(d.called)
+        self.assertEqual(b.getBuildStore().getBuildNumbers(), [0])
+
+        # from now on, saves are immediate
+        b.saveYourself()
+        self.assertEqual(self.threadWrites, [])
+        self.assertEqual(self.loadBuilderPickle(b).name, 'bldr')
+
+    def test_write_error(self):
+        self.writer.start()
+        b = self.makeBuilderStatus()
+        b.basedir = os.path.join(b.basedir, 'nosuchdir')
+        b.saveYourself()
+        self.clock.advance(0)
+        self.runThreadWrites()
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
@@ -0,0 +1,95 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from buildbot.test.util import simulation
+from buildbot.util import eventual
+from twisted.trial import unittest
+
+
+class SchedulingSimulation(unittest.TestCase):
+
+    def run_sim(self, **kwargs):
+        sim = simulation.SchedulingSimulation(**kwargs)
+        results = sim.run()
+        del results['wall_time']
+        del results['requests_per_sec']
+        return sim, results
+
+    def test_all_requests_built(self):
+        sim, results = self.run_sim(numBuilders=5, numSlaves=3,
+                                    numRequests=50, mergeRequests=False)
+        self.assertEqual(results['dispatched'], 50)
+        self.assertEqual(results['builds'], 50)
+        self.assertEqual(sim.master.db.buildrequests.unclaimed,
+                         dict((name, set()) for name in
+                              sim.master.db.buildrequests.unclaimed))
+        self.assertTrue(0 < results['slave_utilisation'] <= 1)
+        self.assertTrue(results['wait_p50'] <= results['wait_p95']
+                        <= results['wait_p99'] <= results['wait_max'])
+
+    def test_deterministic(self):
+        kwargs = dict(numBuilders=5, numSlaves=3, numRequests=50,
+                      concurrency=2, seed=3)
+        results = self.run_sim(**kwargs)[1]
+        # allocate objects between the runs, so that the simulated objects
+        # are elsewhere in memory
+        garbage = []
+        for i in range(5):
+            garbage.append([object() for _ in xrange(i * 997)])
+            self.assertEqual(self.run_sim(**kwargs)[1], results)
+
+    def test_deterministic_with_eventual_queue(self):
+        kwargs = dict(numBuilders=4, numSlaves=4, slavesPerBuilder=4,
+                      numRequests=8, mergeRequests=False, numLocks=1,
+                      buildTime=(100, 100))
+        results = self.run_sim(**kwargs)[1]
+        # a call left in the eventual-send queue by something else does not
+        # keep the simulation's own calls from running
+        eventual.eventually(lambda: None)
+        self.addCleanup(eventual.flushEventualQueue)
+        self.assertEqual(self.run_sim(**kwargs)[1], results)
+
+    def test_merging(self):
+        sim, results = self.run_sim(numBuilders=2, numSlaves=1,
+                                    numRequests=20, numBranches=1)
+        self.assertEqual(results['dispatched'], 20)
+        # all of each builder's requests are merged into a single build
+        buildernames = set(row.buildername for row in
+                           sim.master.db.buildrequests.reqs.itervalues())
+        self.assertEqual(results['builds'], len(buildernames))
+
+    def test_locks(self):
+        _, results = self.run_sim(numBuilders=4, numSlaves=4,
+                                  slavesPerBuilder=4, numRequests=8,
+                                  mergeRequests=False, numLocks=1,
+                                  buildTime=(100, 100))
+        # the builds are serialized on the lock
+        self.assertEqual(results['sim_time'], 800)
+
+    def test_submitInterval(self):
+        _, results = self.run_sim(numBuilders=2, numSlaves=2,
+                                  slavesPerBuilder=2, numRequests=5,
+                                  submitInterval=1000, buildTime=(10, 10))
+        # each request is started as soon as it is submitted
+        self.assertEqual(results['wait_max'], 0)
+        self.assertEqual(results['sim_time'], 4010)
+
+    def test_maxTime(self):
+        sim = simulation.SchedulingSimulation(
+            numBuilders=1, numSlaves=1, numRequests=5, mergeRequests=False,
+            buildTime=(100, 100))
+        results = sim.run(maxTime=250)
+        self.assertEqual(results['dispatched'], 3)
+        self.assertEqual(results['sim_time'], 250)
@@ -0,0 +1,130 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from buildbot.util import batch
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.trial import unittest
+
+
+class Batcher(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.calls = []
+        self.callDeferreds = []
+
+    def makeBatcher(self, wait=0):
+        def function(items):
+            self.calls.append(sorted(items.items()))
+            d = defer.Deferred()
+            self.callDeferreds.append((d, items))
+            return d
+        b = batch.Batcher(function, wait=wait)
+        b._reactor = self.clock
+        return b
+
+    def finishCall(self):
+        d, items = self.callDeferreds.pop(0)
+        d.callback(dict((k, v * 10) for k, v in items.iteritems()))
+
+    def results(self, d):
+        res = []
+        d.addBoth(res.append)
+        return res
+
+    def test_coalesce(self):
+        b = self.makeBatcher(wait=2)
+        r1 = self.results(b({1: 1, 2: 2}))
+        self.clock.advance(1)
+        r2 = self.results(b({3: 3}))
+        self.assertEqual(self.calls, [])
+        self.clock.advance(1)
+        self.assertEqual(self.calls, [[(1, 1), (2, 2), (3, 3)]])
+        self.finishCall()
+        self.assertEqual(r1, [{1: 10, 2: 20}])
+        self.assertEqual(r2, [{3: 30}])
+
+    def test_overlapping_keys_run_in_next_batch(self):
+        b = self.makeBatcher()
+        r1 = self.results(b({1: 1}))
+        r2 = self.results(b({1: 2}))
+        self.clock.advance(0)
+        self.assertEqual(self.calls, [[(1, 1)]])
+        self.finishCall()
+        self.assertEqual(r1, [{1: 10}])
+        self.assertEqual(r2, [])
+        self.clock.advance(0)
+        self.assertEqual(self.calls, [[(1, 1)], [(1, 2)]])
+        self.finishCall()
+        self.assertEqual(r2, [{1: 20}])
+
+    def test_calls_while_running_wait(self):
+        b = self.makeBatcher()
+        b({1: 1})
+        self.clock.advance(0)
+        r2 = self.results(b({2: 2}))
+        r3 = self.results(b({3: 3}))
+        self.clock.advance(0)
+        self.assertEqual(len(self.calls), 1)
+        self.finishCall()
+        self.clock.advance(0)
+        self.assertEqual(self.calls[1], [(2, 2), (3, 3)])
+        self.finishCall()
+        self.assertEqual((r2, r3), ([{2: 20}], [{3: 30}]))
+
+    def test_empty(self):
+        b = self.makeBatcher()
+        self.assertEqual(self.results(b({})), [{}])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_failure(self):
+        b = self.makeBatcher()
+        d1 = b({1: 1})
+        d2 = b({2: 2})
+        self.clock.advance(0)
+        self.callDeferreds.pop(0)[0].errback(RuntimeError('oh noes'))
+        self.assertFailure(d1, RuntimeError)
+        self.assertFailure(d2, RuntimeError)
+        return defer.gatherResults([d1, d2])
+
+    def test_flush(self):
+        b = self.makeBatcher()
+        self.assertEqual(self.results(b.flush()), [None])
+        b({1: 1})
+        flushed = self.results(b.flush())
+        self.clock.advance(0)
+        self.assertEqual(flushed, [])
+        self.finishCall()
+        self.assertEqual(flushed, [None])
+
+    def test_flush_from_flush_callback(self):
+        b = self.makeBatcher()
+        b({1: 1})
+        flushed = []
+
+        def addAndFlush(_):
+            b({2: 2})
+            b.flush().addCallback(flushed.append)
+        b.flush().addCallback(addAndFlush)
+
+        self.clock.advance(0)
+        self.finishCall()
+        # the second flush waits for the batch added by the first's callback
+        self.assertEqual(flushed, [])
+        self.clock.advance(0)
+        self.assertEqual(self.calls, [[(1, 1)], [(2, 2)]])
+        self.finishCall()
+        self.assertEqual(flushed, [None])
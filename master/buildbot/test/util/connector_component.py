@@ -42,6 +42,7 @@ class ConnectorComponentMixin(db.RealDatabaseMixin):
         def finish_setup(_):
             self.db = FakeDBConnector()
             self.db.pool = self.db_pool
+            self.db.read_pool = self.db_pool
             self.db.model = model.Model(self.db)
             self.db.master = fakemaster.make_master()
         d.addCallback(finish_setup)
@@ -54,6 +55,7 @@ class ConnectorComponentMixin(db.RealDatabaseMixin):
             self.db_pool.shutdown()
             # break some reference loops, just for fun
             del self.db.pool
+            del self.db.read_pool
             del self.db.model
             del self.db
         d.addCallback(finish_cleanup)
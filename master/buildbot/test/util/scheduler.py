@@ -33,6 +33,9 @@ class FakeMaster(object):
     def addBuildset(self, **kwargs):
         return self.db.buildsets.addBuildset(**kwargs)
 
+    def addBuildsets(self, buildsets):
+        return self.db.buildsets.addBuildsets(buildsets)
+
     # subscriptions
     # note that only one subscription of each type is supported
 
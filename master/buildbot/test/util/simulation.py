@@ -0,0 +1,422 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+A deterministic simulation of build scheduling, for benchmarking the build
+request distributor offline.
+
+The simulation drives the real L{BotMaster}, L{BuildRequestDistributor},
+L{BasicBuildChooser}, locks and merging code against a L{task.Clock}, the
+fake database, and fake slaves whose builds take a configurable time.  It
+reports how many build requests were dispatched per second, how long they
+waited in the queue, and how busy the slaves were.
+"""
+
+import heapq
+import random
+import time
+
+from buildbot import config
+from buildbot import locks
+from buildbot.process import botmaster
+from buildbot.process import builder
+from buildbot.process import factory
+from buildbot.process import slavebuilder
+from buildbot.status.results import SUCCESS
+from buildbot.test.fake import fakedb
+from buildbot.test.fake import fakemaster
+from buildbot.util import epoch2datetime
+from buildbot.util import eventual
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.python import log
+
+# simulated time at which the simulation starts
+START_TIME = 1400000000
+
+
+class SimBuildRequestsComponent(fakedb.FakeBuildRequestsComponent):
+
+    """
+    A L{fakedb.FakeBuildRequestsComponent} that indexes the unclaimed
+    requests by builder, so that the queries the distributor makes do not scan
+    every request, as a real database would use its indexes.
+    """
+
+    def setUp(self):
+        fakedb.FakeBuildRequestsComponent.setUp(self)
+        # buildername -> set of unclaimed brids
+        self.unclaimed = {}
+        # buildername -> heap of (submitted_at, brid), possibly including
+        # requests that are no longer unclaimed
+        self.queues = {}
+
+    def _addUnclaimed(self, brids):
+        for brid in brids:
+            row = self.reqs.get(brid)
+            if not row or row.complete or brid in self.claims:
+                continue
+            self.unclaimed.setdefault(row.buildername, set()).add(brid)
+            heapq.heappush(self.queues.setdefault(row.buildername, []),
+                           (row.submitted_at, brid))
+
+    def _removeUnclaimed(self, brids):
+        for brid in brids:
+            row = self.reqs.get(brid)
+            if row:
+                self.unclaimed.get(row.buildername, set()).discard(brid)
+
+    def insertTestData(self, rows):
+        fakedb.FakeBuildRequestsComponent.insertTestData(self, rows)
+        self._addUnclaimed([row.id for row in rows
+                            if isinstance(row, fakedb.BuildRequest)])
+
+    def getBuildRequests(self, buildername=None, complete=None, claimed=None,
+                         bsid=None, branch=None, repository=None,
+                         min_brid=None, max_brid=None):
+        if (buildername is None or claimed is not False
+                or complete is not None or bsid is not None
+                or branch or repository
+                or min_brid is not None or max_brid is not None):
+            return fakedb.FakeBuildRequestsComponent.getBuildRequests(
+                self, buildername=buildername, complete=complete,
+                claimed=claimed, bsid=bsid, branch=branch,
+                repository=repository, min_brid=min_brid, max_brid=max_brid)
+        return defer.succeed([self._brdictFromRow(self.reqs[brid])
+                              for brid in self.unclaimed.get(buildername, ())])
+
+    def getUnclaimedBuildRequestSummaries(self):
+        rv = {}
+        for buildername, brids in self.unclaimed.iteritems():
+            if not brids:
+                continue
+            queue = self.queues[buildername]
+            while queue[0][1] not in brids:
+                heapq.heappop(queue)
+            rv[buildername] = dict(
+                oldest_submitted_at=epoch2datetime(queue[0][0]),
+                count=len(brids))
+        return defer.succeed(rv)
+
+    def claimBuildRequests(self, brids, **kwargs):
+        d = fakedb.FakeBuildRequestsComponent.claimBuildRequests(
+            self, brids, **kwargs)
+        self._removeUnclaimed(brids)
+        return d
+
+    def unclaimBuildRequests(self, brids):
+        d = fakedb.FakeBuildRequestsComponent.unclaimBuildRequests(self, brids)
+        self._addUnclaimed(brids)
+        return d
+
+    def completeBuildRequests(self, brids, results, **kwargs):
+        d = fakedb.FakeBuildRequestsComponent.completeBuildRequests(
+            self, brids, results, **kwargs)
+        self._removeUnclaimed(brids)
+        return d
+
+
+class SimSlave(object):
+
+    """
+    A buildslave that runs up to C{max_builds} builds at once, and keeps
+    track of the time it spends running at least one build.
+    """
+
+    def __init__(self, sim, slavename, max_builds=1):
+        self.sim = sim
+        self.slavename = slavename
+        self.max_builds = max_builds
+        self.building = set()
+        self.busySince = None
+        self.busyTime = 0
+
+    def canStartBuild(self):
+        return not self.max_builds or len(self.building) < self.max_builds
+
+    def buildStarted(self, sb):
+        if not self.building:
+            self.busySince = self.sim.clock.seconds()
+        self.building.add(sb)
+
+    def buildFinished(self, sb):
+        self.building.discard(sb)
+        if not self.building:
+            self.busyTime += self.sim.clock.seconds() - self.busySince
+            self.busySince = None
+        self.sim.botmaster.maybeStartBuildsForSlave(self.slavename)
+
+    def releaseLocks(self):
+        pass
+
+
+class SimBuilder(builder.Builder):
+
+    """
+    A builder whose builds hold the builder's locks, and occupy the slave, for
+    the time given by the simulation's C{buildDuration}, and then succeed.
+    """
+
+    def __init__(self, sim, name):
+        builder.Builder.__init__(self, name, _addServices=False)
+        self.sim = sim
+
+    def maybeStartBuild(self, slavebuilder, breqs):
+        self.sim.requestsDispatched(breqs)
+        d = self._runBuild(slavebuilder, breqs)
+        d.addErrback(log.err, 'while running simulated build')
+        return defer.succeed(True)
+
+    @defer.inlineCallbacks
+    def _runBuild(self, slavebuilder, breqs):
+        slavebuilder.buildStarted()
+        owner = object()
+        lockList = [(self.botmaster.getLockFromLockAccess(access)
+                     .getLock(slavebuilder.slave), access)
+                    for access in self.config.locks]
+        yield self._acquireLocks(owner, lockList)
+
+        duration = self.sim.buildDuration(self, breqs)
+        yield task.deferLater(self.sim.clock, duration, lambda: None)
+
+        for lock, access in lockList:
+            lock.release(owner, access)
+        yield self.master.db.buildrequests.completeBuildRequests(
+            [br.id for br in breqs], SUCCESS)
+        slavebuilder.buildFinished()
+
+    @defer.inlineCallbacks
+    def _acquireLocks(self, owner, lockList):
+        # wait for the locks the same way Build.acquireLocks does
+        while True:
+            for lock, access in lockList:
+                if not lock.isAvailable(owner, access):
+                    for other, _ in lockList:
+                        if other is not lock:
+                            other.releaseReservation(owner)
+                    yield lock.waitUntilMaybeAvailable(owner, access)
+                    break
+            else:
+                for lock, access in lockList:
+                    lock.claim(owner, access)
+                return
+
+
+class SchedulingSimulation(object):
+
+    """
+    A simulated master with C{numBuilders} builders, each of which can use
+    C{slavesPerBuilder} of C{numSlaves} slaves, and C{numRequests} build
+    requests.  The requests are submitted C{submitInterval} seconds apart (all
+    at once, by default), each for a random builder and one of C{numBranches}
+    branches, so requests for the same builder and branch can be merged
+    unless C{mergeRequests} is false.  Each build takes between
+    C{buildTime[0]} and C{buildTime[1]} seconds.  If C{numLocks} is nonzero,
+    each builder takes counting access to one of that many master locks, each
+    with C{lockMaxCount} slots.  C{concurrency} is the distributor's
+    C{max_concurrency}.
+
+    The simulation is deterministic: the same parameters and C{seed} always
+    give the same schedule.  Every random choice, including the slave that
+    each build goes to, is made by the simulation's own seeded random number
+    generator, and each run has its own eventual-send queue.
+    """
+
+    def __init__(self, numBuilders=10, numSlaves=5, numRequests=100,
+                 slavesPerBuilder=2, maxBuilds=1, buildTime=(60, 600),
+                 numBranches=10, mergeRequests=True, numLocks=0,
+                 lockMaxCount=1, concurrency=1, submitInterval=0, seed=0):
+        self.numRequests = numRequests
+        self.submitInterval = submitInterval
+        self.buildTime = buildTime
+        self.numBranches = numBranches
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+        self.clock = task.Clock()
+        self.clock.advance(START_TIME)
+
+        self.master = fakemaster.make_master()
+        self.master.db = fakedb.FakeDBConnector(None)
+        brcomp = SimBuildRequestsComponent(self.master.db, None)
+        self.master.db._components[
+            self.master.db._components.index(self.master.db.buildrequests)] \
+            = brcomp
+        self.master.db.buildrequests = brcomp
+        self.master.config.mergeRequests = mergeRequests
+
+        self.botmaster = botmaster.BotMaster(self.master)
+        self.master.botmaster = self.botmaster
+        self.brd = self.botmaster.brd
+        self.brd._reactor = self.clock
+        self.brd.unclaimedBuildRequests._reactor = self.clock
+        self.brd.max_concurrency = concurrency
+
+        self.slaves = [SimSlave(self, 'slave%04d' % i, maxBuilds)
+                       for i in xrange(numSlaves)]
+        lockIds = [locks.MasterLock('lock%04d' % i, maxCount=lockMaxCount)
+                   for i in xrange(numLocks)]
+
+        for i in xrange(numBuilders):
+            name = 'builder%04d' % i
+            slaves = self.rng.sample(self.slaves,
+                                     min(slavesPerBuilder, numSlaves))
+            bldr = SimBuilder(self, name)
+            bldr.master = self.master
+            bldr.botmaster = self.botmaster
+            bldr.config = config.BuilderConfig(
+                name=name, factory=factory.BuildFactory(),
+                slavenames=[s.slavename for s in slaves],
+                nextSlave=self.nextSlave,
+                locks=[lockIds[i % numLocks].access('counting')]
+                if lockIds else [])
+            for slave in slaves:
+                sb = slavebuilder.SlaveBuilder()
+                sb.slave = slave
+                sb.setBuilder(bldr)
+                sb.state = slavebuilder.IDLE
+                bldr.slaves.append(sb)
+            self.botmaster.builders[name] = bldr
+            self.botmaster.builderNames.append(name)
+
+        # brid -> submission time, and dispatch times of the requests
+        self.submittedAt = {}
+        self.waits = []
+        self.builds = 0
+        self.lastDispatch = None
+
+    def buildDuration(self, bldr, breqs):
+        """
+        Return the time that a build of C{breqs} on C{bldr} takes.  Override
+        this to model particular builders.
+        """
+        return self.rng.uniform(*self.buildTime)
+
+    def nextSlave(self, bldr, slavebuilders):
+        # the distributor's default, but using the seeded generator
+        return self.rng.choice(slavebuilders) if slavebuilders else None
+
+    def requestsDispatched(self, breqs):
+        now = self.clock.seconds()
+        self.builds += 1
+        self.lastDispatch = now
+        for br in breqs:
+            self.waits.append(now - self.submittedAt[br.id])
+
+    def submitRequests(self, brids, notify=True):
+        rows = []
+        now = self.clock.seconds()
+        for brid in brids:
+            branch = self.rng.randrange(self.numBranches)
+            buildername = self.rng.choice(self.botmaster.builderNames)
+            rows.extend([
+                fakedb.Buildset(id=brid, sourcestampsetid=branch + 1,
+                                submitted_at=now),
+                fakedb.BuildRequest(id=brid, buildsetid=brid,
+                                    buildername=buildername,
+                                    submitted_at=now),
+            ])
+            self.submittedAt[brid] = now
+        self.master.db.insertTestData(rows)
+
+        if notify:
+            for row in rows:
+                if isinstance(row, fakedb.BuildRequest):
+                    self.brd.buildRequestAdded(
+                        dict(buildername=row.buildername, brid=row.id))
+                    self.botmaster.maybeStartBuildsForBuilder(
+                        row.buildername)
+
+    def run(self, maxTime=None):
+        """
+        Run the simulation until every request has been built, or for at most
+        C{maxTime} simulated seconds, and return a dictionary of results.
+        """
+        # use a fresh eventual-send queue on the simulated clock, so that
+        # nothing queued by an earlier test or run can change the schedule
+        queue = eventual._SimpleCallQueue()
+        queue._reactor = self.clock
+        oldQueue, eventual._theSimpleQueue = eventual._theSimpleQueue, queue
+        try:
+            return self._run(maxTime)
+        finally:
+            eventual._theSimpleQueue = oldQueue
+
+    def _run(self, maxTime):
+        # one sourcestamp set for each branch
+        rows = []
+        for i in xrange(self.numBranches):
+            rows.extend([
+                fakedb.SourceStampSet(id=i + 1),
+                fakedb.SourceStamp(id=i + 1, sourcestampsetid=i + 1,
+                                   branch='branch%d' % i),
+            ])
+        self.master.db.insertTestData(rows)
+
+        started = time.time()
+        if self.submitInterval:
+            for brid in xrange(1, self.numRequests + 1):
+                self.clock.callLater((brid - 1) * self.submitInterval,
+                                     self.submitRequests, [brid])
+        else:
+            self.submitRequests(range(1, self.numRequests + 1), notify=False)
+        self.botmaster.startService()
+        self.botmaster.maybeStartBuildsForAllBuilders()
+
+        endTime = maxTime and START_TIME + maxTime
+        while True:
+            calls = self.clock.getDelayedCalls()
+            if not calls:
+                break
+            nextTime = min(call.getTime() for call in calls)
+            if endTime and nextTime > endTime:
+                self.clock.advance(endTime - self.clock.seconds())
+                break
+            self.clock.advance(max(0, nextTime - self.clock.seconds()))
+        wallTime = time.time() - started
+
+        self.brd.stopService()
+        self.clock.advance(0)
+        return self.getResults(wallTime)
+
+    def getResults(self, wallTime):
+        elapsed = self.clock.seconds() - START_TIME
+        for slave in self.slaves:
+            if slave.busySince is not None:
+                slave.busyTime += self.clock.seconds() - slave.busySince
+                slave.busySince = self.clock.seconds()
+
+        waits = sorted(self.waits)
+
+        def percentile(p):
+            if not waits:
+                return None
+            return waits[min(len(waits) - 1, int(len(waits) * p / 100.0))]
+
+        busyTime = sum(slave.busyTime for slave in self.slaves)
+        return dict(
+            requests=self.numRequests,
+            dispatched=len(waits),
+            builds=self.builds,
+            wall_time=wallTime,
+            sim_time=elapsed,
+            requests_per_sec=len(waits) / wallTime if wallTime else None,
+            wait_p50=percentile(50),
+            wait_p95=percentile(95),
+            wait_p99=percentile(99),
+            wait_max=waits[-1] if waits else None,
+            slave_utilisation=(busyTime / (len(self.slaves) * elapsed)
+                               if self.slaves and elapsed else None),
+        )
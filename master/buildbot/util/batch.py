@@ -0,0 +1,104 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.python import failure
+
+
+class Batcher(object):
+
+    """
+    Coalesce calls that arrive close together into a single call of
+    C{function}.
+
+    Each call passes a dictionary of items; C{function} is called with the
+    union of those dictionaries, and must return (possibly via a Deferred) a
+    dictionary mapping each key to its outcome.  Each caller gets back the
+    outcomes for its own keys only.  Calls whose keys overlap a waiting batch
+    go into the next batch, and batches are run one at a time, so a key is
+    never passed to C{function} twice at once.
+    """
+
+    def __init__(self, function, wait=0):
+        # callable taking a dictionary of items
+        self.function = function
+        # time to wait for more items before invoking
+        self.wait = wait
+        # batches not yet started, each a tuple (items, [(keys, d), ..])
+        self.batches = []
+        # Twisted timer for waiting
+        self.timer = None
+        # true while the function is executing
+        self.running = False
+        # deferreds to fire when all batches are complete
+        self.idleDeferreds = []
+        # for tests
+        self._reactor = reactor
+
+    def __call__(self, items):
+        d = defer.Deferred()
+        if not items:
+            d.callback({})
+            return d
+
+        if not self.batches or \
+                any(k in self.batches[-1][0] for k in items):
+            self.batches.append(({}, []))
+        batch_items, waiters = self.batches[-1]
+        batch_items.update(items)
+        waiters.append((list(items), d))
+
+        if not self.running and not self.timer:
+            self.timer = self._reactor.callLater(self.wait, self.invoke)
+        return d
+
+    @defer.inlineCallbacks
+    def invoke(self):
+        self.timer = None
+        items, waiters = self.batches.pop(0)
+        self.running = True
+        try:
+            outcomes = yield defer.maybeDeferred(self.function, items)
+        except Exception:
+            f = failure.Failure()
+            for _, d in waiters:
+                d.errback(f)
+        else:
+            outcomes = outcomes or {}
+            for keys, d in waiters:
+                d.callback(dict((k, outcomes.get(k)) for k in keys))
+        finally:
+            self.running = False
+
+        if self.batches:
+            self.timer = self._reactor.callLater(self.wait, self.invoke)
+        else:
+            # a waiter may add a batch and flush again; that flush must wait
+            # for the new batch, so only the waiters seen here are fired
+            waiters, self.idleDeferreds = self.idleDeferreds, []
+            for d in waiters:
+                d.callback(None)
+
+    def flush(self):
+        """
+        Return a Deferred that fires when every batch added so far has been
+        processed.
+        """
+        if not (self.running or self.batches or self.timer):
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.idleDeferreds.append(d)
+        return d
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+# usage: python migrate_build_history.py [--to indexed|pickle] [--remove]
+#                                        BUILDERDIR [BUILDERDIR ...]
+#
+# Copy the builds saved in each builder status directory (the directories
+# named after each builder's builddir in the master's basedir) from one build
+# history store to the other; see c['buildHistoryStore'].  By default, build
+# pickles are copied into an indexed store.  With --remove, each build is
+# removed from the old store once it is copied, which is what frees a large
+# builder directory of its build pickles.  Logfiles are not touched.
+#
+# Stop the master before running this, and set c['buildHistoryStore'] to
+# match before starting it again.
+
+import optparse
+import sys
+
+from buildbot.status import buildhistory
+from twisted.python import log
+
+
+def main(options, builderdirs):
+    source_kind = {'indexed': 'pickle', 'pickle': 'indexed'}[options.to]
+    for builderdir in builderdirs:
+        source = buildhistory.storeClasses[source_kind](builderdir)
+        dest = buildhistory.storeClasses[options.to](builderdir)
+        copied = buildhistory.migrateBuilds(source, dest,
+                                            remove=options.remove)
+        source.close()
+        dest.close()
+        print "%s: copied %d builds" % (builderdir, copied)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(
+        usage="%prog [options] BUILDERDIR [BUILDERDIR ...]")
+    parser.add_option('--to', choices=['indexed', 'pickle'],
+                      default='indexed',
+                      help='kind of store to copy builds into')
+    parser.add_option('--remove', action='store_true', default=False,
+                      help='remove builds from the old store once copied')
+    parser.add_option('--verbose', action='store_true', default=False,
+                      help='log progress to stdout')
+    options, args = parser.parse_args()
+    if not args:
+        parser.error("no builder directories given")
+    if options.verbose:
+        log.startLogging(sys.stdout)
+    main(options, args)
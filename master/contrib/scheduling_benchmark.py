@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+# usage: python scheduling_benchmark.py [--builders N] [--slaves N]
+#                                       [--requests N] [options]
+#
+# Simulate a busy master and report how quickly the build request
+# distributor dispatches queued build requests.  The simulation uses the real
+# botmaster, build request distributor, build chooser, locks and request
+# merging, with a fake clock, the fake database, and fake slaves whose builds
+# take a random time; see buildbot.test.util.simulation.  The same options
+# and --seed always give the same schedule, so the simulated results can be
+# compared before and after a change to the scheduling code.
+#
+# The results are:
+#   requests/sec   build requests dispatched per second of (real) run time
+#   wait p50/95/99 simulated time requests waited before being dispatched
+#   utilisation    fraction of simulated slave time spent running builds
+#
+# Run it from a checkout with buildbot importable (e.g., from the master
+# directory).
+
+import optparse
+
+from buildbot.test.util import simulation
+
+
+def main(options):
+    sim = simulation.SchedulingSimulation(
+        numBuilders=options.builders, numSlaves=options.slaves,
+        numRequests=options.requests,
+        slavesPerBuilder=options.slaves_per_builder,
+        maxBuilds=options.max_builds,
+        buildTime=(options.min_build_time, options.max_build_time),
+        numBranches=options.branches, mergeRequests=not options.no_merge,
+        numLocks=options.locks, lockMaxCount=options.lock_max_count,
+        concurrency=options.concurrency,
+        submitInterval=options.submit_interval, seed=options.seed)
+    results = sim.run(maxTime=options.max_time)
+
+    print "%d builders, %d slaves, %d requests" % (
+        options.builders, options.slaves, options.requests)
+    print "dispatched      %d requests in %d builds" % (
+        results['dispatched'], results['builds'])
+    print "run time        %.1fs (%.1fs simulated)" % (
+        results['wall_time'], results['sim_time'])
+    print "requests/sec    %.1f" % (results['requests_per_sec'] or 0,)
+    if results['dispatched']:
+        print "wait p50/95/99  %.0fs / %.0fs / %.0fs (max %.0fs)" % (
+            results['wait_p50'], results['wait_p95'], results['wait_p99'],
+            results['wait_max'])
+    print "utilisation     %.1f%%" % (
+        100 * (results['slave_utilisation'] or 0),)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--builders', type='int', default=1000,
+                      help='number of builders')
+    parser.add_option('--slaves', type='int', default=300,
+                      help='number of slaves')
+    parser.add_option('--requests', type='int', default=50000,
+                      help='number of build requests')
+    parser.add_option('--slaves-per-builder', type='int', default=5,
+                      help='number of slaves each builder can use')
+    parser.add_option('--max-builds', type='int', default=1,
+                      help='number of builds each slave can run at once')
+    parser.add_option('--min-build-time', type='float', default=60,
+                      help='shortest build, in seconds')
+    parser.add_option('--max-build-time', type='float', default=600,
+                      help='longest build, in seconds')
+    parser.add_option('--branches', type='int', default=10,
+                      help='number of branches requests are spread over')
+    parser.add_option('--no-merge', action='store_true', default=False,
+                      help='do not merge build requests')
+    parser.add_option('--locks', type='int', default=0,
+                      help='number of master locks shared by the builders')
+    parser.add_option('--lock-max-count', type='int', default=1,
+                      help='number of builds that can hold each lock')
+    parser.add_option('--concurrency', type='int', default=1,
+                      help='number of builders the distributor handles at once')
+    parser.add_option('--submit-interval', type='float', default=0,
+                      help='seconds between requests (default: all at once)')
+    parser.add_option('--max-time', type='float', default=None,
+                      help='stop after this many simulated seconds')
+    parser.add_option('--seed', type='int', default=0,
+                      help='random seed')
+    options, args = parser.parse_args()
+    main(options)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# usage: python sqlite_benchmark.py [--count N] [--concurrency N]
+#
+# Measure the throughput of the database operations a busy master performs
+# most often -- inserting changes, inserting buildsets and claiming build
+# requests -- against a fresh SQLite database, first with the default engine
+# settings and then with the SQLite performance profile
+# (``?performance=1`` in the database URL).  The results are printed as
+# operations per second.
+#
+# This uses the real connector components, so run it from a checkout with
+# buildbot importable (e.g., from the master directory).
+
+import optparse
+import shutil
+import tempfile
+import time
+
+from twisted.internet import defer
+from twisted.internet import reactor
+
+from buildbot import config
+from buildbot.db import connector
+from buildbot.db import model
+from buildbot.process import cache
+
+URLS = [
+    ('default', 'sqlite:///state.sqlite'),
+    ('performance', 'sqlite:///state.sqlite?performance=1'),
+]
+
+BUILDERS = ['builder-%d' % i for i in range(4)]
+
+
+class BenchmarkMaster(object):
+
+    # just enough of a master for a DBConnector
+
+    def __init__(self, db_url):
+        self.config = config.MasterConfig()
+        self.config.db['db_url'] = db_url
+        self.caches = cache.CacheManager()
+
+    def getObjectId(self):
+        return defer.succeed(1)
+
+
+@defer.inlineCallbacks
+def run_concurrently(count, concurrency, fn):
+    """Call fn(i) for i in range(count), with at most concurrency calls
+    outstanding, and return the number of calls per second."""
+    sem = defer.DeferredSemaphore(concurrency)
+    start = time.time()
+    yield defer.gatherResults([sem.run(fn, i) for i in xrange(count)])
+    defer.returnValue(count / (time.time() - start))
+
+
+@defer.inlineCallbacks
+def benchmark(db_url, count, concurrency):
+    basedir = tempfile.mkdtemp()
+    try:
+        master = BenchmarkMaster(db_url)
+        db = connector.DBConnector(master, basedir)
+        yield db.setup(check_version=False, verbose=False)
+        yield db.pool.do(lambda conn:
+                         model.Model.metadata.create_all(bind=conn))
+
+        results = {}
+
+        def addChange(i):
+            return db.changes.addChange(
+                author=u'author', files=[u'file-%d' % i],
+                comments=u'change %d' % i, revision=u'rev-%d' % i,
+                branch=u'master', repository=u'repo', project=u'proj',
+                properties={u'prop': (u'value', 'Change')})
+        results['change-insert'] = \
+            yield run_concurrently(count, concurrency, addChange)
+
+        @defer.inlineCallbacks
+        def addBuildset(i):
+            setid = yield db.sourcestampsets.addSourceStampSet()
+            yield db.sourcestamps.addSourceStamp(
+                branch=u'master', revision=u'rev-%d' % i,
+                repository=u'repo', project=u'proj',
+                sourcestampsetid=setid, changeids=[i + 1])
+            bsid, brids = yield db.buildsets.addBuildset(
+                sourcestampsetid=setid, reason=u'benchmark',
+                properties={}, builderNames=BUILDERS)
+            defer.returnValue(brids)
+        results['buildset-insert'] = \
+            yield run_concurrently(count, concurrency, addBuildset)
+
+        brdicts = yield db.buildrequests.getBuildRequests(claimed=False)
+        brids = [brd['brid'] for brd in brdicts][:count]
+
+        def claim(i):
+            return db.buildrequests.claimBuildRequests([brids[i]])
+        results['claim'] = \
+            yield run_concurrently(len(brids), concurrency, claim)
+
+        db.pool.shutdown()
+        if db.read_pool is not db.pool:
+            db.read_pool.shutdown()
+        defer.returnValue(results)
+    finally:
+        shutil.rmtree(basedir)
+
+
+@defer.inlineCallbacks
+def main(options):
+    all_results = []
+    for name, db_url in URLS:
+        results = yield benchmark(db_url, options.count, options.concurrency)
+        all_results.append((name, results))
+
+    print "%d operations, %d concurrent (operations per second)" % (
+        options.count, options.concurrency)
+    print "%-16s" % ('',) + "".join("%16s" % (name,)
+                                    for name, _ in all_results)
+    for op in 'change-insert', 'buildset-insert', 'claim':
+        print "%-16s" % (op,) + "".join("%16.1f" % (results[op],)
+                                        for _, results in all_results)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--count', type='int', default=500,
+                      help='number of operations of each kind')
+    parser.add_option('--concurrency', type='int', default=4,
+                      help='number of operations in flight at once')
+    options, args = parser.parse_args()
+
+    def run():
+        d = main(options)
+        d.addErrback(lambda f: f.printTraceback())
+        d.addBoth(lambda _: reactor.stop())
+    reactor.callWhenRunning(run)
+    reactor.run()
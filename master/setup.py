@@ -310,7 +310,9 @@ setup_args = {
             ('buildbot.locks', ['MasterLock', 'SlaveLock']),
             ('buildbot.manhole', [
                 'AuthorizedKeysManhole', 'PasswordManhole', 'TelnetManhole']),
-            ('buildbot.process.builder', ['enforceChosenSlave']),
+            ('buildbot.process.affinity', ['WorkspaceAffinity']),
+            ('buildbot.process.builder', [
+                'enforceChosenSlave', 'leastLoadedSlave']),
             ('buildbot.process.factory', [
                 'BuildFactory', 'GNUAutoconf', 'CPAN', 'Distutils', 'Trial',
                 'BasicBuildFactory', 'QuickBuildFactory', 'BasicSVN']),
@@ -331,6 +331,53 @@ class Bot(pb.Referenceable, service.MultiService):
         """Send our version back to the Master"""
         return buildslave.version
 
+    def getResources(self):
+        """Describe how busy this machine is, for the master to use when
+        choosing slaves.  The result is a dictionary with keys C{load} (the
+        one-minute load average), C{cpus}, C{free_memory} (in bytes) and
+        C{free_disk} (bytes available in the basedir's filesystem).  Figures
+        that are not available on this platform are None.
+        """
+        resources = dict(load=None, cpus=None, free_memory=None,
+                         free_disk=None)
+        try:
+            resources['load'] = os.getloadavg()[0]
+        except (AttributeError, OSError):
+            pass
+        resources['cpus'] = self._getCpuCount()
+        try:
+            st = os.statvfs(self.basedir)
+            resources['free_disk'] = st.f_bavail * st.f_frsize
+        except (AttributeError, OSError):
+            pass
+        resources['free_memory'] = self._getFreeMemory()
+        return resources
+
+    def _getCpuCount(self):
+        # multiprocessing.cpu_count is not available in Python 2.5
+        try:
+            cpus = os.sysconf('SC_NPROCESSORS_ONLN')
+        except (AttributeError, ValueError, OSError):
+            return None
+        if cpus < 1:
+            return None
+        return cpus
+
+    def _getFreeMemory(self):
+        # only Linux makes this easy
+        try:
+            meminfo = {}
+            for line in open('/proc/meminfo'):
+                name, value = line.split(':', 1)
+                meminfo[name] = int(value.split()[0]) * 1024
+        except (IOError, ValueError, IndexError):
+            return None
+        if 'MemAvailable' in meminfo:
+            return meminfo['MemAvailable']
+        if 'MemFree' in meminfo:
+            return meminfo['MemFree'] + meminfo.get('Cached', 0)
+        return None
+
     def remote_shutdown(self):
         log.msg("slave shutting down on command from master")
         # there's no good way to learn that the PB response has been delivered,
@@ -354,6 +401,10 @@ class BotFactory(ReconnectingPBClientFactory):
     # between connection retries
     maxDelay = 300
 
+    # 'getResources', if set, is called with each keepalive to get a
+    # description of the machine's load, which is sent to the master
+    getResources = None
+
     keepaliveTimer = None
     unsafeTracebacks = 1
     perspective = None
@@ -421,9 +472,26 @@ class BotFactory(ReconnectingPBClientFactory):
             log.msg("sending app-level keepalive")
             d = self.perspective.callRemote("keepalive")
             d.addErrback(log.err, "error sending keepalive")
+
+            if self.getResources:
+                self.sendResources()
         self.keepaliveTimer = self._reactor.callLater(self.keepaliveInterval,
                                                       doKeepalive)
 
+    def sendResources(self):
+        d = self.perspective.callRemote("reportResources",
+                                        self.getResources())
+
+        def failed(err):
+            if err.check(AttributeError):
+                log.msg("Master does not support resource reports; "
+                        "not sending them again")
+                self.getResources = None
+            else:
+                log.err(err, "error sending resource report")
+        d.addErrback(failed)
+        return d
+
     def stopTimers(self):
         if self.keepaliveTimer:
             self.keepaliveTimer.cancel()
@@ -468,6 +536,7 @@ class BuildSlave(service.MultiService):
 
         self.allow_shutdown = allow_shutdown
         bf = self.bf = BotFactory(buildmaster_host, port, keepalive, maxdelay)
+        bf.getResources = bot.getResources
         bf.startLogin(credentials.UsernamePassword(name, passwd), client=bot)
         self.connection = c = internet.TCPClient(buildmaster_host, port, bf)
         c.setServiceParent(self)
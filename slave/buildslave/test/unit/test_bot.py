@@ -93,6 +93,19 @@ class TestBot(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_getResources(self):
+        resources = self.real_bot.getResources()
+        self.assertEqual(set(resources.keys()),
+                         set(['load', 'cpus', 'free_memory', 'free_disk']))
+        if hasattr(os, 'statvfs'):
+            self.assertTrue(resources['free_disk'] > 0)
+
+    def test_getResources_no_cpu_count(self):
+        def sysconf(name):
+            raise ValueError("unrecognized configuration name")
+        self.patch(os, 'sysconf', sysconf)
+        self.assertEqual(self.real_bot.getResources()['cpus'], None)
+
     def test_setBuilderList_empty(self):
         d = self.bot.callRemote("setBuilderList", [])
 
@@ -423,4 +436,44 @@ class TestBotFactory(unittest.TestCase):
         clock.advance(35)
         self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
 
+    def test_timers_resources(self):
+        clock = self.bf._reactor = task.Clock()
+        self.bf.getResources = lambda: dict(load=1.5)
+
+        calls = []
+
+        def callRemote(method, *args):
+            calls.append((method,) + args)
+            return defer.succeed(None)
+        self.bf.perspective = mock.Mock()
+        self.bf.perspective.callRemote = callRemote
+
+        self.bf.startTimers()
+        clock.advance(35)
+        self.bf.stopTimers()
+        self.assertEqual(calls, [('keepalive',),
+                                 ('reportResources', dict(load=1.5))])
+
+    def test_timers_resources_unsupported(self):
+        clock = self.bf._reactor = task.Clock()
+        self.bf.getResources = lambda: dict(load=1.5)
+
+        calls = []
+
+        def callRemote(method, *args):
+            calls.append(method)
+            if method == 'reportResources':
+                return defer.fail(AttributeError("no such method"))
+            return defer.succeed(None)
+        self.bf.perspective = mock.Mock()
+        self.bf.perspective.callRemote = callRemote
+
+        self.bf.startTimers()
+        clock.advance(35)
+        clock.advance(35)
+        self.bf.stopTimers()
+        # resources are not sent again once the master rejects them
+        self.assertEqual(calls, ['keepalive', 'reportResources',
+                                 'keepalive'])
+
 # note that the BuildSlave class is tested in test_bot_BuildSlave